@@ -2,8 +2,11 @@ from base64 import b64encode
 from collections import namedtuple
 from flask import logging
 from backdrop.core import records
+from backdrop.core.database import QUERY_ENGINES, PartialWriteError
 from backdrop.core.errors import ValidationError
-from backdrop.core.validation import bucket_is_valid
+from backdrop.core.query_cache import BucketVersions
+from backdrop.core.rollups import Rollups
+from backdrop.core.validation import bucket_is_valid, key_is_valid
 
 log = logging.getLogger(__name__)
 
@@ -11,8 +14,16 @@ log = logging.getLogger(__name__)
 class Bucket(object):
     def __init__(self, db, config):
         self.bucket_name = config.name
-        self.repository = db.get_repository(config.name)
+        # realtime buckets are read as they are written, so they are not
+        # read from secondaries that may be behind
+        self.repository = db.get_repository(config.name, config.query_engine,
+                                            read_from_primary=config.realtime)
         self.auto_id_keys = config.auto_ids
+        self.versions = BucketVersions(db)
+        if config.rollups:
+            self.rollups = Rollups(db, config.name, **config.rollups)
+        else:
+            self.rollups = None
 
     def parse_and_store(self, data):
         log.info("received %s documents" % len(data))
@@ -23,12 +34,69 @@ class Bucket(object):
         self.store(records.parse_all(data))
 
     def store(self, records):
+        try:
+            self._store(records)
+        finally:
+            self.versions.bump(self.bucket_name)
+
+    def _store(self, records):
         if isinstance(records, list):
-            [self.repository.save(record.to_mongo()) for record in records]
+            documents = [record.to_mongo() for record in records]
         else:
-            self.repository.save(records.to_mongo())
+            documents = [records.to_mongo()]
+        replaced = self._replaced_records(documents)
+
+        def written(documents):
+            self._update_rollups(documents, replaced)
+            # a record stored again in a later chunk replaces these
+            replaced.update((document["_id"], document)
+                            for document in documents if "_id" in document)
+
+        try:
+            if not isinstance(records, list):
+                self.repository.save(documents[0])
+                written(documents)
+            elif self.rollups:
+                self.repository.save_all(documents, written=written)
+            else:
+                self.repository.save_all(documents)
+        except PartialWriteError:
+            # the records that were written have been rolled up
+            raise
+        except Exception:
+            # records may have been written without being rolled up
+            self._mark_rollups_dirty()
+            raise
+
+    def _replaced_records(self, documents):
+        # read before storing, so that they can be taken out of the rollups
+        if self.rollups:
+            return self.rollups.stored_records(documents)
+        return {}
+
+    def _update_rollups(self, documents, replaced):
+        if self.rollups:
+            self.rollups.update(documents, replaced)
+
+    def _mark_rollups_dirty(self):
+        if self.rollups:
+            self.rollups.mark_dirty()
+
+    def rebuild_rollups(self, documents, chunk_size=1000):
+        """Recalculate the rollups from all the documents in the bucket
+
+        Writes to the bucket must be stopped while the documents are read.
+        """
+        if self.rollups is None:
+            raise ValueError(
+                "Bucket {0} does not keep rollups".format(self.bucket_name))
+        self.rollups.rebuild(documents, chunk_size)
+        self.versions.bump(self.bucket_name)
 
     def query(self, query):
+        if self.rollups and self.rollups.can_answer(query):
+            return query.execute(self.rollups)
+
         result = query.execute(self.repository)
 
         return result
@@ -50,17 +118,32 @@ class Bucket(object):
 _BucketConfig = namedtuple(
     "_BucketConfig",
     "name data_group data_type raw_queries_allowed bearer_token upload_format "
-    "upload_filters auto_ids queryable realtime capped_size")
+    "upload_filters auto_ids queryable realtime capped_size query_engine "
+    "rollups indexes")
 
 
 class BucketConfig(_BucketConfig):
     def __new__(cls, name, data_group, data_type, raw_queries_allowed=False,
                 bearer_token=None, upload_format="csv", upload_filters=None,
                 auto_ids=None, queryable=True, realtime=False,
-                capped_size=5040):
+                capped_size=5040, query_engine=None, rollups=None,
+                indexes=None):
         if not bucket_is_valid(name):
             raise ValueError("Bucket name is not valid")
 
+        if query_engine is not None and query_engine not in QUERY_ENGINES:
+            raise ValueError("Query engine is not valid")
+
+        if rollups is not None and not _rollups_are_valid(rollups):
+            raise ValueError("Rollups are not valid")
+
+        if rollups is not None and (auto_ids or realtime):
+            raise ValueError(
+                "Rollups can only be kept for buckets that are added to")
+
+        if indexes is not None and not _indexes_are_valid(indexes):
+            raise ValueError("Indexes are not valid")
+
         if upload_filters is None:
             upload_filters = [
                 "backdrop.core.upload.filters.first_sheet_filter"]
@@ -71,8 +154,25 @@ class BucketConfig(_BucketConfig):
                                                 bearer_token, upload_format,
                                                 upload_filters, auto_ids,
                                                 queryable, realtime,
-                                                capped_size)
+                                                capped_size, query_engine,
+                                                rollups, indexes)
 
     @property
     def max_age(self):
         return 120 if self.realtime else 1800
+
+
+def _rollups_are_valid(rollups):
+    if not isinstance(rollups, dict):
+        return False
+    if not set(rollups.keys()).issubset(["fields", "group_by"]):
+        return False
+    keys = rollups.get("fields", []) + rollups.get("group_by", [])
+    return all(map(key_is_valid, keys))
+
+
+def _indexes_are_valid(indexes):
+    if not isinstance(indexes, list):
+        return False
+    return all(isinstance(keys, list) and keys and all(map(key_is_valid, keys))
+               for keys in indexes)
@@ -1,7 +1,6 @@
 """
 Cache control decorators for flask apps
 """
-import hashlib
 from flask import make_response, request
 from functools import wraps
 
@@ -23,12 +22,18 @@ def set(cache_control):
     return decorator
 
 
-def etag(func):
-    @wraps(func)
-    def new_func(*args, **kwargs):
-        resp = make_response(func(*args, **kwargs))
-        resp.set_etag(hashlib.sha1(resp.data).hexdigest())
-        resp.make_conditional(request)
-        return resp
+def not_modified(etag, last_modified=None):
+    """Whether the client already has the response with this etag
 
-    return new_func
+    This lets a view answer a conditional request before doing the work of
+    making the response. If-None-Match takes precedence over
+    If-Modified-Since, and uses the weak comparison.
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if last_modified is not None and request.if_modified_since is not None:
+        return last_modified.replace(tzinfo=None, microsecond=0) <= \
+            request.if_modified_since
+    return False
@@ -0,0 +1,84 @@
+"""
+Gzip compression of flask responses
+
+Compressed bodies are kept in a store keyed on a hash of the uncompressed
+body, so a body that is served again, such as a cached query result, is
+only compressed once. Streamed bodies are compressed as they are sent and
+are not kept.
+"""
+import gzip
+import hashlib
+import zlib
+from StringIO import StringIO
+from flask import request
+
+
+def gzip_responses(store, min_size=500):
+    """Create an after request function that gzips responses
+
+    Only successful responses are compressed, and only for clients that
+    accept gzip. Complete responses must be at least min_size bytes;
+    streamed responses, whose size is not known up front, are always
+    compressed.
+    """
+    def compress(response):
+        if not _should_compress(response, min_size):
+            return response
+
+        etag, _ = response.get_etag()
+        if response.is_streamed:
+            response.response = gzip_stream(response.response)
+            response.headers.pop('Content-Length', None)
+        else:
+            body = response.get_data()
+            key = etag or hashlib.sha1(body).hexdigest()
+
+            compressed = store.get(key)
+            if compressed is None:
+                compressed = gzip_bytes(body)
+                store.set(key, compressed)
+
+            response.set_data(compressed)
+
+        response.headers['Content-Encoding'] = 'gzip'
+        response.vary.add('Accept-Encoding')
+        if etag:
+            # the compressed body is a different encoding of the same
+            # representation, so it only carries a weak etag
+            response.set_etag(etag, weak=True)
+        return response
+
+    return compress
+
+
+def _should_compress(response, min_size):
+    return 'gzip' in request.accept_encodings \
+        and response.status_code == 200 \
+        and 'Content-Encoding' not in response.headers \
+        and (response.is_streamed or response.content_length >= min_size)
+
+
+def gzip_bytes(body):
+    buf = StringIO()
+    # a fixed mtime keeps the output the same for the same body
+    with gzip.GzipFile(fileobj=buf, mode='wb', mtime=0) as f:
+        f.write(body)
+    return buf.getvalue()
+
+
+def gzip_stream(chunks):
+    """Gzip an iterable of chunks as it is read
+
+    zlib buffers its output, so compressed data is only yielded once there
+    is a block of it, and the rest follows when the chunks run out.
+    """
+    # a window of 16 + MAX_WBITS writes a gzip header and trailer
+    compressor = zlib.compressobj(
+        zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        if isinstance(chunk, unicode):
+            chunk = chunk.encode('utf-8')
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
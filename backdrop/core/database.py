@@ -1,25 +1,97 @@
 import logging
-from bson import Code
+from bson import Code, ObjectId, SON
 import pymongo
-from pymongo.errors import AutoReconnect
+from pymongo.errors import AutoReconnect, BulkWriteError
 from backdrop import statsd
-from backdrop.core import timeutils
-from backdrop.core.nested_merge import nested_merge, InvalidOperationError
+from backdrop.core import explain, sketch, timeutils
+from backdrop.core.nested_merge import nested_merge, InvalidOperationError, \
+    summary_of, summary_key
+
+
+QUERY_ENGINES = ["group", "aggregate"]
+
+# the index raw queries are paged through
+PAGING_INDEX = [("_timestamp", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)]
+
+# reducer code keeping a value of field f at k, for the group command;
+# first and last keep the timestamp along with the value
+PICKING_CODE = {
+    "min": "if (current['{f}'] !== undefined && current['{f}'] !== null && "
+           "(previous['{k}'] === null || current['{f}'] < previous['{k}'])) "
+           "{{ previous['{k}'] = current['{f}']; }}",
+    "max": "if (current['{f}'] !== undefined && current['{f}'] !== null && "
+           "(previous['{k}'] === null || current['{f}'] > previous['{k}'])) "
+           "{{ previous['{k}'] = current['{f}']; }}",
+    "first": "if (current['{f}'] !== undefined && current['{f}'] !== null && "
+             "current._timestamp !== undefined && "
+             "(previous['{k}'] === null || "
+             "current._timestamp < previous['{k}'][0])) "
+             "{{ previous['{k}'] = [current._timestamp, current['{f}']]; }}",
+    "last": "if (current['{f}'] !== undefined && current['{f}'] !== null && "
+            "current._timestamp !== undefined && "
+            "(previous['{k}'] === null || "
+            "current._timestamp > previous['{k}'][0])) "
+            "{{ previous['{k}'] = [current._timestamp, current['{f}']]; }}",
+}
+
+READ_PREFERENCES = {
+    "primary": pymongo.ReadPreference.PRIMARY,
+    "primaryPreferred": pymongo.ReadPreference.PRIMARY_PREFERRED,
+    "secondary": pymongo.ReadPreference.SECONDARY,
+    "secondaryPreferred": pymongo.ReadPreference.SECONDARY_PREFERRED,
+    "nearest": pymongo.ReadPreference.NEAREST,
+}
 
 
 class Database(object):
-    def __init__(self, host, port, name):
-        self._mongo = pymongo.MongoClient(host, port)
+    def __init__(self, host, port, name, query_engine="group",
+                 bulk_write_chunk_size=1000, ordered_bulk_writes=True,
+                 replica_set=None, read_preference="primary",
+                 max_pool_size=100):
+        """Connect to a single mongod or, given its name, a replica set
+
+        `host` may be a comma separated list of hosts or a MongoDB URI.
+        Reads go to the members picked by `read_preference`, one of
+        READ_PREFERENCES, unless a repository asks for the primary.
+        """
+        if read_preference not in READ_PREFERENCES:
+            raise ValueError(
+                "Unknown read preference {0}".format(read_preference))
+        options = {
+            "port": port,
+            "max_pool_size": max_pool_size,
+            "read_preference": READ_PREFERENCES[read_preference]
+        }
+        if replica_set:
+            self._mongo = pymongo.MongoReplicaSetClient(
+                host, replicaSet=replica_set, **options)
+        else:
+            self._mongo = pymongo.MongoClient(host, **options)
         self.name = name
+        self.query_engine = query_engine
+        self.bulk_write_chunk_size = bulk_write_chunk_size
+        self.ordered_bulk_writes = ordered_bulk_writes
 
     def alive(self):
         return self._mongo.alive()
 
-    def get_repository(self, bucket_name):
-        return Repository(self.get_collection(bucket_name))
+    def get_repository(self, bucket_name, query_engine=None,
+                       read_from_primary=False):
+        return Repository(self.get_collection(bucket_name, read_from_primary),
+                          query_engine or self.query_engine,
+                          bulk_write_chunk_size=self.bulk_write_chunk_size,
+                          ordered_bulk_writes=self.ordered_bulk_writes)
+
+    def get_collection(self, collection_name, read_from_primary=False):
+        collection = self._mongo[self.name][collection_name]
+        if read_from_primary:
+            collection.read_preference = pymongo.ReadPreference.PRIMARY
+        return MongoDriver(collection)
 
-    def get_collection(self, collection_name):
-        return MongoDriver(self._mongo[self.name][collection_name])
+    def pinned_reads(self):
+        """A context in which the reads of this thread are all made of the
+        same member of a replica set, for each read preference"""
+        return self._mongo.start_request()
 
     def create_capped_collection(self, collection_name, capped_size):
         return self.mongo_database.create_collection(name=collection_name,
@@ -43,32 +115,241 @@ class MongoDriver(object):
         if direction not in self.sort_options.keys():
             raise InvalidSortError(direction)
 
-        cursor.sort(key, self.sort_options[direction])
+        if key == "_timestamp":
+            # tie break on _id so that pages of results do not overlap
+            cursor.sort([(key, self.sort_options[direction]),
+                         ("_id", self.sort_options[direction])])
+        else:
+            cursor.sort(key, self.sort_options[direction])
 
     def find_one(self, query):
         return self._collection.find_one(query)
 
-    def find(self, query, sort, limit):
-        cursor = self._collection.find(query)
+    def find(self, query, sort, limit, fields=None, after=None):
+        """Find documents, optionally only those sorted after a document
+
+        `after` is the (_timestamp, _id) of a document; only documents that
+        come after it when sorted on `_timestamp` are found.
+        """
+        if after is not None:
+            if sort[0] != "_timestamp":
+                raise InvalidSortError("Can only page on _timestamp")
+            query = dict(query, **{"$or": self._build_after(after, sort[1])})
+        projection = self._build_projection(fields)
+        if explain.is_explaining():
+            self._explain({"find": query, "projection": projection,
+                           "sort": sort, "limit": limit}, query, sort)
+        cursor = self._collection.find(query, projection)
         self._apply_sorting(cursor, sort[0], sort[1])
         if limit:
             cursor.limit(limit)
         return cursor
 
+    def _explain(self, operation, query, sort=None):
+        # the plan of finding the documents an operation reads is the plan
+        # of the operation itself, as far as indexes are concerned
+        cursor = self._collection.find(query)
+        if sort:
+            self._apply_sorting(cursor, sort[0], sort[1])
+        explain.record(mongo=operation,
+                       plan=explain.summarise_plan(cursor.explain()))
+
+    def _build_after(self, after, direction):
+        # documents without a _timestamp sort before all of those with one
+        timestamp, _id = after
+        if direction == "ascending":
+            if timestamp is None:
+                return [{"_timestamp": {"$ne": None}},
+                        {"_timestamp": None, "_id": {"$gt": _id}}]
+            return [{"_timestamp": {"$gt": timestamp}},
+                    {"_timestamp": timestamp, "_id": {"$gt": _id}}]
+        else:
+            if timestamp is None:
+                return [{"_timestamp": None, "_id": {"$lt": _id}}]
+            return [{"_timestamp": {"$lt": timestamp}},
+                    {"_timestamp": None},
+                    {"_timestamp": timestamp, "_id": {"$lt": _id}}]
+
+    def _build_projection(self, fields):
+        if fields is None:
+            return None
+        projection = dict((field, 1) for field in fields)
+        projection.setdefault("_id", 0)
+        return projection
+
     def _ignore_docs_without_grouping_keys(self, keys, query):
         for key in keys:
             if key not in query:
                 query[key] = {"$ne": None}
         return query
 
-    def group(self, keys, query, collect_fields):
+    def group(self, keys, query, collect_fields, summaries=()):
+        """Group documents with the group command
+
+        Returns one document per distinct combination of keys, with a
+        `_count`, a list of values for each collect field and, for each
+        pair of field and summary, the summary of the field at its
+        `summary_key`.
+        """
+        condition = self._ignore_docs_without_grouping_keys(keys, query)
+        reducer = self._build_reducer_function(collect_fields, summaries)
+        if explain.is_explaining():
+            self._explain({"group": {"key": keys, "condition": condition,
+                                     "reduce": str(reducer)}}, condition)
         return self._collection.group(
             key=keys,
-            condition=self._ignore_docs_without_grouping_keys(keys, query),
-            initial=self._build_accumulator_initial_state(collect_fields),
-            reduce=self._build_reducer_function(collect_fields)
+            condition=condition,
+            initial=self._build_accumulator_initial_state(collect_fields,
+                                                          summaries),
+            reduce=reducer
         )
 
+    def aggregate(self, keys, query, collect_fields, sort=None, limit=None,
+                  summaries=()):
+        """Group documents with an aggregation pipeline
+
+        Returns the same shape of results as `group`: one document per
+        distinct combination of keys, with a `_count`, a list of values
+        for each collect field and the summaries of fields. `sort` may only
+        refer to the first key or to `_count`. When grouping on two keys,
+        sort and limit apply to the groups of the first key, counted across
+        all of their subgroups.
+
+        A pipeline has no way of building sketches, so documents are
+        grouped on the bins of the fields to be sketched as well, and those
+        groups are merged back together with a count for each bin, which is
+        sketched here. Binning uses $ln and $ceil, which need MongoDB 3.2.
+        """
+        pipeline = self._build_pipeline(keys, query, collect_fields,
+                                        sort, limit, summaries)
+        if explain.is_explaining():
+            self._explain({"aggregate": pipeline}, pipeline[0]["$match"])
+        # a cursor is not limited to a single reply document, and the group
+        # and sort stages may spill to disk for large numbers of groups
+        cursor = self._collection.aggregate(pipeline, cursor={},
+                                            allowDiskUse=True)
+        return [self._flatten_group(group.get("_subgroup", group), summaries,
+                                    collect_fields)
+                for group in cursor]
+
+    def _build_pipeline(self, keys, query, collect_fields, sort, limit,
+                        summaries=()):
+        group = {
+            "_id": dict((key, "$" + key) for key in keys),
+            "_count": {"$sum": 1}
+        }
+        for collect_field in collect_fields:
+            group[collect_field] = {"$push": "$" + collect_field}
+        for field, summary in summaries:
+            if summary == "sketch":
+                sign, index = sketch.bin_expressions(field)
+                group["_id"][_bin_key(field, "sign")] = sign
+                group["_id"][_bin_key(field, "index")] = index
+            else:
+                group[summary_key(field, summary)] = \
+                    self._build_summary_operator(field, summary)
+
+        pipeline = [
+            {"$match": self._ignore_docs_without_grouping_keys(keys, query)},
+            {"$group": group}
+        ]
+        if _is_binned(summaries):
+            pipeline.append({"$group": self._build_bins_group(
+                keys, collect_fields, summaries)})
+
+        nested = len(keys) > 1 and bool(sort or limit)
+        if nested:
+            pipeline.append({"$group": self._build_outer_group(
+                keys[0], collect_fields, summaries)})
+        if sort:
+            pipeline.append({"$sort": self._build_sort(keys[:1], sort)})
+        if limit:
+            pipeline.append({"$limit": limit})
+        if nested:
+            pipeline.append({"$unwind": "$_subgroup"})
+
+        return pipeline
+
+    def _build_summary_operator(self, field, summary):
+        if summary in ["min", "max"]:
+            return {"$" + summary: "$" + field}
+        if summary in ["first", "last"]:
+            # the least or greatest timestamp of the documents with a value,
+            # paired with the value; $min and $max skip the nulls
+            has_value = {"$and": [{"$gt": ["$" + field, None]},
+                                  {"$gt": ["$_timestamp", None]}]}
+            pair = SON([("t", "$_timestamp"), ("v", "$" + field)])
+            operator = "$min" if summary == "first" else "$max"
+            return {operator: {"$cond": [has_value, pair, None]}}
+        raise ValueError("Unknown summary {0}".format(summary))
+
+    def _build_bins_group(self, keys, collect_fields, summaries):
+        # merge the groups of each bin back together, keeping the count of
+        # documents in each bin of each sketched field
+        group = {
+            "_id": dict((key, "$_id." + key) for key in keys),
+            "_count": {"$sum": "$_count"}
+        }
+        for collect_field in collect_fields:
+            group[collect_field] = {"$push": "$" + collect_field}
+        for field, summary in summaries:
+            key = summary_key(field, summary)
+            if summary == "sketch":
+                group[key] = {"$push": {
+                    "s": "$_id." + _bin_key(field, "sign"),
+                    "i": "$_id." + _bin_key(field, "index"),
+                    "c": "$_count"}}
+            elif summary in ["min", "first"]:
+                group[key] = {"$min": "$" + key}
+            else:
+                group[key] = {"$max": "$" + key}
+        return group
+
+    def _build_outer_group(self, key, collect_fields, summaries=()):
+        # gather the groups under their first key so that they can be sorted
+        # and limited together, and unwound back into groups afterwards
+        subgroup = {"_id": "$_id", "_count": "$_count"}
+        for collect_field in collect_fields:
+            subgroup[collect_field] = "$" + collect_field
+        for field, summary in summaries:
+            subgroup[summary_key(field, summary)] = \
+                "$" + summary_key(field, summary)
+        return {
+            "_id": {key: "$_id." + key},
+            "_count": {"$sum": "$_count"},
+            "_subgroup": {"$push": subgroup}
+        }
+
+    def _build_sort(self, keys, sort):
+        key, direction = sort
+        if direction not in self.sort_options.keys():
+            raise InvalidSortError(direction)
+
+        # tie break on the group keys to match the order nested_merge gives
+        sort_spec = SON()
+        if key != "_count":
+            key = "_id." + key
+        sort_spec[key] = self.sort_options[direction]
+        for group_key in keys:
+            sort_spec.setdefault("_id." + group_key, pymongo.ASCENDING)
+        return sort_spec
+
+    def _flatten_group(self, group, summaries=(), collect_fields=()):
+        doc = group.pop("_id") or {}
+        doc.update(group)
+        if _is_binned(summaries):
+            # the values of each bin's group were pushed as a list
+            for collect_field in collect_fields:
+                doc[collect_field] = [value for values in doc[collect_field]
+                                      for value in values]
+        for field, summary in summaries:
+            key = summary_key(field, summary)
+            if summary == "sketch":
+                doc[key] = sketch.from_bins(doc[key])
+            elif summary in ["first", "last"] and doc.get(key) is not None:
+                doc[key] = [doc[key]["t"], doc[key]["v"]]
+        return doc
+
     def _build_collector_code(self, collect_fields):
         template = "if (current['{c}'] !== undefined) " \
                    "{{ previous['{c}'].push(current['{c}']); }}"
@@ -79,18 +360,38 @@ class MongoDriver(object):
     def _clean_collect_field(self, collect_field):
         return collect_field.replace('\\', '\\\\').replace("'", "\\'")
 
-    def _build_accumulator_initial_state(self, collect_fields):
+    def _build_summary_code(self, summaries):
+        code = []
+        for field, summary in summaries:
+            field, key = (self._clean_collect_field(field),
+                          self._clean_collect_field(
+                              summary_key(field, summary)))
+            if summary == "sketch":
+                code.append(sketch.reducer_code(field, key))
+            elif summary in PICKING_CODE:
+                code.append(PICKING_CODE[summary].format(f=field, k=key))
+            else:
+                raise ValueError("Unknown summary {0}".format(summary))
+        return "\n".join(code)
+
+    def _build_accumulator_initial_state(self, collect_fields, summaries=()):
         initial = {'_count': 0}
         for collect_field in collect_fields:
             initial.update({collect_field: []})
+        for field, summary in summaries:
+            if summary == "sketch":
+                initial[summary_key(field, summary)] = sketch.empty()
+            else:
+                initial[summary_key(field, summary)] = None
         return initial
 
-    def _build_reducer_function(self, collect_fields):
+    def _build_reducer_function(self, collect_fields, summaries=()):
         reducer_skeleton = "function (current, previous)" + \
                            "{{ previous._count++; {collectors} }}"
-        reducer_code = reducer_skeleton.format(
-            collectors=self._build_collector_code(collect_fields)
-        )
+        collectors = self._build_collector_code(collect_fields)
+        if summaries:
+            collectors += "\n" + self._build_summary_code(summaries)
+        reducer_code = reducer_skeleton.format(collectors=collectors)
         reducer = Code(reducer_code)
         return reducer
 
@@ -105,10 +406,76 @@ class MongoDriver(object):
             else:
                 raise
 
+    def save_all(self, objs, ordered=True, tries=3):
+        """Upsert a list of documents on their _id in one bulk operation
+
+        Returns the number of documents written and a list of write errors,
+        each being the index of the failed document and a message. Every
+        document must have an _id so that retrying is safe.
+        """
+        if ordered:
+            bulk = self._collection.initialize_ordered_bulk_op()
+        else:
+            bulk = self._collection.initialize_unordered_bulk_op()
+
+        for obj in objs:
+            bulk.find({"_id": obj["_id"]}).upsert().replace_one(obj)
+
+        try:
+            result = bulk.execute()
+        except BulkWriteError as e:
+            result = e.details
+        except AutoReconnect:
+            logging.warning("AutoReconnect on bulk save")
+            statsd.incr("db.AutoReconnect", bucket=self._collection.name)
+            if tries > 1:
+                return self.save_all(objs, ordered, tries - 1)
+            else:
+                raise
+
+        errors = [(error["index"], error["errmsg"])
+                  for error in result.get("writeErrors", [])]
+        return result["nUpserted"] + result["nMatched"], errors
+
+    def update_all(self, updates):
+        """Apply a list of (spec, document) upserts in one bulk operation
+
+        Updates are not retried on AutoReconnect as they are not
+        idempotent.
+        """
+        bulk = self._collection.initialize_unordered_bulk_op()
+        for spec, document in updates:
+            bulk.find(spec).upsert().update(document)
+        bulk.execute()
+
+    def update(self, spec, document, upsert=False):
+        self._collection.update(spec, document, upsert=upsert)
+
+    def remove(self, query):
+        self._collection.remove(query)
+
+    def ensure_index(self, keys, **kwargs):
+        self._collection.ensure_index(keys, **kwargs)
+
+    def rename(self, name):
+        """Rename the collection, replacing any collection of that name"""
+        self._collection.rename(name, dropTarget=True)
+
+    def index_keys(self):
+        """The names of the fields of each index on the collection"""
+        return [[key for key, _ in index["key"]]
+                for index in self._collection.index_information().values()]
+
 
 class Repository(object):
-    def __init__(self, mongo_driver):
+    def __init__(self, mongo_driver, query_engine="group",
+                 bulk_write_chunk_size=1000, ordered_bulk_writes=True):
+        if query_engine not in QUERY_ENGINES:
+            raise ValueError("Unknown query engine {0}".format(query_engine))
         self._mongo_driver = mongo_driver
+        self._query_engine = query_engine
+        self._bulk_write_chunk_size = bulk_write_chunk_size
+        self._ordered_bulk_writes = ordered_bulk_writes
 
     def _validate_sort(self, sort):
         if len(sort) != 2:
@@ -123,7 +490,13 @@ class Repository(object):
 
         self._validate_sort(sort)
 
-        return self._mongo_driver.find(query.to_mongo_query(), sort, limit)
+        fields = query.fields
+        if fields is not None and query.is_paged:
+            fields = fields + [field for field in ["_timestamp", "_id"]
+                               if field not in fields]
+
+        return self._mongo_driver.find(query.to_mongo_query(), sort, limit,
+                                       fields, query.after)
 
     def group(self, group_by, query, sort=None, limit=None, collect=None):
         if sort:
@@ -139,12 +512,59 @@ class Repository(object):
         obj['_updated_at'] = timeutils.now()
         self._mongo_driver.save(obj)
 
+    def save_all(self, objs, written=None):
+        """Save a list of documents in chunks of bulk upserts
+
+        Raises a PartialWriteError listing the documents that could not be
+        written. With ordered bulk writes nothing after the first failure
+        is written.
+
+        written: called with the documents of each chunk that were written,
+                 as soon as the chunk is, so that they are known even when
+                 a later chunk fails
+        """
+        updated_at = timeutils.now()
+        for obj in objs:
+            obj['_updated_at'] = updated_at
+            if '_id' not in obj:
+                obj['_id'] = ObjectId()
+
+        stored, errors = 0, []
+        chunk_size = self._bulk_write_chunk_size
+        for offset in range(0, len(objs), chunk_size):
+            chunk = objs[offset:offset + chunk_size]
+            chunk_stored, chunk_errors = self._mongo_driver.save_all(
+                chunk, self._ordered_bulk_writes)
+            if written is not None:
+                failed = set(index for index, _ in chunk_errors)
+                written([obj for index, obj in enumerate(chunk)
+                         if index not in failed][:chunk_stored])
+
+            stored += chunk_stored
+            errors += [(offset + index, message)
+                       for index, message in chunk_errors]
+
+            if errors and self._ordered_bulk_writes:
+                break
+
+        if errors:
+            raise PartialWriteError(stored, len(objs), errors)
+
     def multi_group(self, key1, key2, query,
                     sort=None, limit=None, collect=None):
-        if key1 == key2:
+        return self.nested_group([key1, key2], query, sort, limit, collect)
+
+    def nested_group(self, keys, query, sort=None, limit=None, collect=None):
+        """Group on each of the keys in turn, in a single database query
+
+        Each group has a `_subgroup` of the groups of the next key, down to
+        the groups of the last key. Sort and limit apply to the outermost
+        groups.
+        """
+        if len(set(keys)) != len(keys):
             raise GroupingError("Cannot group on two equal keys")
         results = self._group(
-            [key1, key2],
+            keys,
             query.to_mongo_query(),
             sort,
             limit,
@@ -159,30 +579,78 @@ class Repository(object):
         return query
 
     def _group(self, keys, query, sort=None, limit=None, collect=None):
-        collect_fields = unique_collect_fields(collect)
-        results = self._mongo_driver.group(keys, query, list(collect_fields))
+        collect_fields = list(unique_collect_fields(collect))
+        summaries = sorted(unique_summaries(collect))
+        with explain.stage("mongo"):
+            if self._query_engine == "aggregate":
+                results = self._aggregate(keys, query, collect_fields,
+                                          sort, limit, summaries)
+            else:
+                results = self._mongo_driver.group(keys, query,
+                                                   collect_fields,
+                                                   summaries=summaries)
+        explain.record(mongo_groups=len(results))
+
+        with explain.stage("nested_merge"):
+            results = nested_merge(keys, collect, results)
+
+        with explain.stage("sort_and_limit"):
+            return sort_and_limit(results, sort, limit)
+
+    def _aggregate(self, keys, query, collect_fields, sort, limit,
+                   summaries):
+        """Run the grouping as an aggregation pipeline
+
+        Sort and limit are only handed to the database for groups sorted
+        on their first key or on the count; everything else, such as
+        sorting on collected values, is still sorted and limited after the
+        results have been merged.
+        """
+        if sort and sort[0] in [keys[0], "_count"]:
+            return self._mongo_driver.aggregate(keys, query, collect_fields,
+                                                sort, limit,
+                                                summaries=summaries)
+        return self._mongo_driver.aggregate(keys, query, collect_fields,
+                                            summaries=summaries)
+
+
+def sort_and_limit(results, sort=None, limit=None):
+    """Sort a list of merged groups and cut it down to the limit"""
+    if sort:
+        sorters = {
+            "ascending": lambda a, b: cmp(a, b),
+            "descending": lambda a, b: cmp(b, a)
+        }
+        sorter = sorters[sort[1]]
+        try:
+            results.sort(cmp=sorter, key=lambda a: a[sort[0]])
+        except KeyError:
+            raise InvalidSortError('Invalid sort key {0}'.format(sort[0]))
+    if limit:
+        results = results[:limit]
 
-        results = nested_merge(keys, collect, results)
+    return results
 
-        if sort:
-            sorters = {
-                "ascending": lambda a, b: cmp(a, b),
-                "descending": lambda a, b: cmp(b, a)
-            }
-            sorter = sorters[sort[1]]
-            try:
-                results.sort(cmp=sorter, key=lambda a: a[sort[0]])
-            except KeyError:
-                raise InvalidSortError('Invalid sort key {0}'.format(sort[0]))
-        if limit:
-            results = results[:limit]
 
-        return results
+def unique_collect_fields(collect):
+    """Return the unique set of field names whose values are collected."""
+    return set([collect_field for collect_field, method in collect
+                if summary_of(method) is None])
 
 
-def unique_collect_fields(collect):
-    """Return the unique set of field names to collect."""
-    return set([collect_field for collect_field, _ in collect])
+def unique_summaries(collect):
+    """Return the unique set of field and summary pairs to collect."""
+    return set([(collect_field, summary_of(method))
+                for collect_field, method in collect
+                if summary_of(method) is not None])
+
+
+def _is_binned(summaries):
+    return any(summary == "sketch" for _, summary in summaries)
+
+
+def _bin_key(field, part):
+    return "_bin_{0}:{1}".format(part, field)
 
 
 class GroupingError(ValueError):
@@ -191,3 +659,13 @@ class GroupingError(ValueError):
 
 class InvalidSortError(ValueError):
     pass
+
+
+class PartialWriteError(Exception):
+    def __init__(self, stored, total, errors):
+        self.message = "{0} of {1} records could not be stored".format(
+            total - stored, total)
+        super(PartialWriteError, self).__init__(self.message)
+        self.stored = stored
+        self.total = total
+        self.errors = errors
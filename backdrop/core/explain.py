@@ -0,0 +1,96 @@
+"""
+Explanations of how queries are run
+
+While a query is being explained, each stage it goes through is timed and
+the database operations it makes are recorded. The explanation is kept per
+thread, so stages and records are ignored when nothing is being explained.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+_local = threading.local()
+
+
+class Explanation(object):
+    def __init__(self):
+        self.stages = []
+        self.details = {}
+
+    def add_stage(self, name, seconds):
+        self.stages.append({"stage": name, "ms": round(seconds * 1000, 3)})
+
+    def record(self, **details):
+        self.details.update(details)
+
+    def as_dict(self):
+        return dict(self.details, stages=self.stages)
+
+
+def current():
+    return getattr(_local, "explanation", None)
+
+
+def is_explaining():
+    return current() is not None
+
+
+@contextmanager
+def explaining():
+    """Explain everything done in this thread within the block"""
+    _local.explanation = Explanation()
+    try:
+        yield _local.explanation
+    finally:
+        _local.explanation = None
+
+
+@contextmanager
+def stage(name):
+    """Time a stage of the query being explained, if there is one"""
+    explanation = current()
+    if explanation is None:
+        yield
+        return
+
+    start = time.time()
+    try:
+        yield
+    finally:
+        explanation.add_stage(name, time.time() - start)
+
+
+def record(**details):
+    explanation = current()
+    if explanation is not None:
+        explanation.record(**details)
+
+
+def summarise_plan(plan):
+    """The index used and the number of documents examined by a query plan
+
+    Understands the explain output of MongoDB 2.x as well as the
+    executionStats of later versions.
+    """
+    if "executionStats" in plan:
+        stats = plan["executionStats"]
+        return {
+            "index": _index_name(plan["queryPlanner"]["winningPlan"]),
+            "keys_examined": stats.get("totalKeysExamined"),
+            "documents_examined": stats.get("totalDocsExamined"),
+            "documents_returned": stats.get("nReturned"),
+        }
+    return {
+        "index": plan.get("cursor"),
+        "keys_examined": plan.get("nscanned"),
+        "documents_examined": plan.get("nscannedObjects"),
+        "documents_returned": plan.get("n"),
+    }
+
+
+def _index_name(plan):
+    while plan is not None:
+        if "indexName" in plan:
+            return plan["indexName"]
+        plan = plan.get("inputStage")
+    return "COLLSCAN"
@@ -0,0 +1,117 @@
+"""
+Index buckets for the queries that are made of them
+
+The read app records a sample of the shapes of the queries made of each
+bucket: which fields they filter on, group on, sort on and whether they ask
+for a range of timestamps. Indexes are proposed from the commonest shapes
+with equality fields first, then the fields grouped on, then the sort
+field, then the _timestamp range, and built in the background by the
+build_indexes task.
+"""
+import json
+import random
+import pymongo
+from pymongo.errors import PyMongoError
+from flask import logging
+from backdrop.core import timeutils
+
+log = logging.getLogger(__name__)
+
+
+def query_shape(query):
+    """The parts of a query that decide which index can answer it"""
+    if query.is_raw:
+        sort = query.sort_by[0] if query.sort_by else "_timestamp"
+    else:
+        sort = None
+    group = query.group_by_keys
+    if query.period:
+        group.append(query.period.start_at_key)
+    return {
+        "equality": sorted(set(key for key, _ in query.filter_by)),
+        "group": group,
+        "sort": sort,
+        "range": bool(query.start_at or query.end_at or query.after),
+    }
+
+
+def propose_index(shape):
+    """The index keys for a query shape, or None if it needs no index"""
+    keys = list(shape["equality"])
+    # shapes recorded before grouping was part of them have no group
+    for key in shape.get("group", []):
+        if key not in keys:
+            keys.append(key)
+    if shape["sort"] is not None and shape["sort"] not in keys:
+        keys.append(shape["sort"])
+    if shape["range"] and "_timestamp" not in keys:
+        keys.append("_timestamp")
+    return keys or None
+
+
+def propose_indexes(shapes, existing):
+    """Indexes for the shapes that no existing index starts with
+
+    `existing` is a list of the keys of the indexes a bucket has.
+    """
+    proposed = []
+    for shape in shapes:
+        keys = propose_index(shape)
+        if keys is None:
+            continue
+        if any(index[:len(keys)] == keys for index in existing + proposed):
+            continue
+        proposed.append(keys)
+    return proposed
+
+
+class QueryShapes(object):
+    """Counts of the shapes of the queries made of each bucket
+
+    Only a `sample_rate` fraction of queries are recorded, so that reads
+    do not each cost a write.
+    """
+    def __init__(self, db, sample_rate=1.0):
+        self._mongo_driver = db.get_collection("query_shapes")
+        self._sample_rate = sample_rate
+
+    def record(self, bucket_name, query):
+        if random.random() >= self._sample_rate:
+            return
+        shape = query_shape(query)
+        try:
+            self._mongo_driver.update(
+                {"_id": _shape_id(bucket_name, shape)},
+                {"$set": {"bucket": bucket_name,
+                          "shape": shape,
+                          "last_seen": timeutils.now()},
+                 "$inc": {"count": 1}},
+                upsert=True)
+        except PyMongoError as e:
+            log.warning("Could not record query shape: %s" % e)
+
+    def for_bucket(self, bucket_name, min_count=1):
+        """The shapes seen at least min_count times, commonest first"""
+        documents = self._mongo_driver.find(
+            {"bucket": bucket_name, "count": {"$gte": min_count}},
+            ["count", "descending"], None)
+        return [document["shape"] for document in documents]
+
+
+def _shape_id(bucket_name, shape):
+    return "{0}:{1}".format(bucket_name, json.dumps(shape, sort_keys=True))
+
+
+def build_indexes(db, bucket_config, shapes, min_count=1):
+    """Build the indexes proposed for a bucket in the background
+
+    Returns the keys of every index the bucket now has, other than _id.
+    """
+    mongo_driver = db.get_collection(bucket_config.name)
+    existing = mongo_driver.index_keys()
+    for keys in propose_indexes(
+            shapes.for_bucket(bucket_config.name, min_count), existing):
+        log.info("Building index on %s for %s" % (keys, bucket_config.name))
+        mongo_driver.ensure_index(
+            [(key, pymongo.ASCENDING) for key in keys], background=True)
+    return [keys for keys in mongo_driver.index_keys() if keys != ["_id"]]
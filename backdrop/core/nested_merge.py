@@ -1,157 +1,328 @@
-from operator import itemgetter, add
-import itertools
+"""
+Merging of the groups from the database into nested groups
 
+The database returns a group for each distinct combination of the keys
+grouped on. `nested_merge` nests them under a group for each value of the
+keys before the last, in a single pass over the groups: each group is
+hashed into its place in the nesting, and its collected values are added
+to an accumulator per collect method in each of the groups above it.
+Each level of groups is then sorted once.
+"""
+from operator import itemgetter
+import re
+from backdrop.core import sketch
 
-def nested_merge(keys, collect, data):
-    if len(keys) > 1:
-        data = group_by(data, keys)
-        data = apply_counts(data)
-
-    data = apply_collect(data, collect)
-    data = sort_all(data, keys)
+PERCENTILE_METHOD = re.compile(r'^(median|p[1-9][0-9]?)$')
 
-    return data
+# methods whose values are picked out by the database
+PICKED_METHODS = ["min", "max", "first", "last"]
 
 
-def group_by(data, keys):
-    """Recursively group an array of results by a list of keys
+def nested_merge(keys, collect, data):
+    """Nest a list of groups from the database under each of the keys
 
-    data: a list of dictionaries as returned by MongoDriver.group
-    keys: a list of keys to group by
-    """
-    key = keys[0]
-    getter = itemgetter(key)
-    data = sorted(data, key=getter)
-    if len(keys) > 1:
-        data = [
-            {
-                key: value,
-                "_subgroup": group_by(
-                    remove_key_from_all(subgroups, key),
-                    keys[1:]
-                )
-            }
-            for value, subgroups in itertools.groupby(data, getter)
-        ]
-    return data
-
-
-def remove_key_from_all(groups, key):
-    """Remove a key from each group in a list of groups
-
-    groups: a list of groups (dictionaries)
-    key: the key to remove
+    keys: the keys grouped on, outermost first
+    collect: a list of collect fields, each being a tuple of field name and
+             collection method
+    data: a list of dictionaries as returned by MongoDriver.group, one for
+          each distinct combination of keys. They are updated in place.
     """
-    return [remove_key(group, key) for group in groups]
-
+    collectors = [_Collector(key, method) for key, method in collect]
+    outer_keys = list(enumerate(keys[:-1]))
+    groups = _new_level(len(keys))
+    for doc in data:
+        raws = [collector.raw(doc) for collector in collectors]
+
+        level = groups
+        for depth, key in outer_keys:
+            node = _get_node(level, key, doc.pop(key), collectors,
+                             len(keys) - depth - 1)
+            node.add(doc["_count"], raws)
+            level = node.subgroups
+
+        for collector, raw in zip(collectors, raws):
+            doc[collector.collect_key] = collector.accumulator.reduce(raw)
+        _remove_collected_keys(doc, collectors)
+        level.append(doc)
+
+    return _finish_level(groups, keys, collectors)
+
+
+class _Collector(object):
+    """How one collect field is read from, and written to, groups"""
+    def __init__(self, key, method):
+        self.key = key
+        self.collect_key = collect_key(key, method)
+        self.is_default = method == 'default'
+
+        summary = summary_of(method)
+        self.raw_key = key if summary is None else summary_key(key, summary)
+        self.raw_default = [] if summary is None else None
+        self.accumulator = accumulator_for(method)
+
+    def raw(self, doc):
+        return doc.get(self.raw_key, self.raw_default)
+
+
+class _Node(object):
+    """A group of groups, with the accumulators of their collected values"""
+    def __init__(self, key, value, collectors, depth):
+        self.group = {key: value, "_count": 0}
+        self.subgroups = _new_level(depth)
+        self.collectors = collectors
+        self.accumulators = [collector.accumulator.empty()
+                             for collector in collectors]
+
+    def add(self, count, raws):
+        self.group["_count"] += count
+        for accumulator, raw in zip(self.accumulators, raws):
+            accumulator.add(raw)
+
+    def finish(self, keys):
+        group = self.group
+        group["_subgroup"] = _finish_level(self.subgroups, keys,
+                                           self.collectors)
+        group["_group_count"] = len(group["_subgroup"])
+        for collector, accumulator in zip(self.collectors,
+                                          self.accumulators):
+            group[collector.collect_key] = accumulator.value()
+        _remove_collected_keys(group, self.collectors)
+        return group
+
+
+def _new_level(depth):
+    # groups from the database go in a list, as they are already distinct;
+    # the groups above them are hashed on their value
+    return [] if depth == 1 else {}
+
+
+def _get_node(level, key, value, collectors, depth):
+    try:
+        return level[value]
+    except KeyError:
+        node = level[value] = _Node(key, value, collectors, depth)
+        return node
+    except TypeError:
+        # array and embedded document keys are hashed on their contents
+        hashable = _hashable(value)
+        if hashable not in level:
+            level[hashable] = _Node(key, value, collectors, depth)
+        return level[hashable]
+
+
+def _hashable(value):
+    if isinstance(value, list):
+        return tuple(_hashable(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _hashable(v)) for k, v in value.items()))
+    return value
+
+
+def _finish_level(level, keys, collectors):
+    """Sort a level of groups on its key, finishing the groups in it"""
+    if isinstance(level, list):
+        groups = level
+    else:
+        groups = [node.finish(keys[1:]) for node in level.itervalues()]
+    groups.sort(key=itemgetter(keys[0]))
+    return groups
 
-def remove_key(doc, key):
-    del doc[key]
-    return doc
 
+def _remove_collected_keys(group, collectors):
+    for collector in collectors:
+        group.pop(collector.raw_key, None)
 
-def apply_counts(groups):
-    """Add the _count and _group_count fields to a list of groups"""
-    return [
-        apply_counts_to_group(group)
-        for group in groups
-    ]
+    # Hack in the old way
+    for collector in collectors:
+        if collector.is_default:
+            group[collector.key] = group[collector.collect_key]
 
 
-def apply_counts_to_group(group):
-    """Add the _count and _group_count fields to a group"""
-    if '_subgroup' in group:
-        subgroups = apply_counts(group['_subgroup'])
-        group['_subgroup'] = subgroups
-        group['_count'] = sum(subgroup['_count'] for subgroup in subgroups)
-        group['_group_count'] = len(subgroups)
-    return group
+def collect_key(key, method):
+    if method == 'default':
+        method = 'set'
+    return '{0}:{1}'.format(key, method)
 
 
-def apply_collect(groups, collect):
-    """Apply collected values to a list of groups
+def summary_of(method):
+    """The summary of a field that the database makes for a method
 
-    groups: a list of groups (dictionaries)
-    collect: a list of collect fields, each being a tuple of field name and
-             collection method
+    None for methods that need all of the field's values.
     """
-    return [
-        apply_collect_to_group(group, collect)
-        for group in groups
-    ]
-
+    if PERCENTILE_METHOD.match(method):
+        return "sketch"
+    if method in PICKED_METHODS:
+        return method
+    return None
 
-def apply_collect_to_group(group, collect):
-    group = group.copy()
-    # calculate collected values
-    for key, method in collect:
-        group[collect_key(key, method)] = collect_value(group, key, method)
 
-    # apply collect to subgroups
-    if '_subgroup' in group:
-        group['_subgroup'] = apply_collect(group['_subgroup'], collect)
+def summary_key(key, summary):
+    return '_{0}:{1}'.format(summary, key)
 
-    # remove left over collect keys
-    for key, _ in collect:
-        group = remove_collected_key(group, key)
 
-    # Hack in the old way
-    for key, method in collect:
-        if method == 'default':
-            group[key] = group[collect_key(key, method)]
-    return group
+def percentile_of(method):
+    if method == "median":
+        return 0.5
+    return int(method[1:]) / 100.0
 
 
-def collect_key(key, method):
-    if method == 'default':
-        method = 'set'
-    return '{0}:{1}'.format(key, method)
+def accumulator_for(method):
+    """An empty accumulator of the collected values for a method
 
-
-def collect_value(group, key, method):
-    return reduce_collected_values(collect_all_values(group, key), method)
+    Accumulators `add` the raw values, or the summary, of the groups from
+    the database and give the `value` collected from all of them. They
+    `reduce` the raw values of a single group without being changed.
+    """
+    if PERCENTILE_METHOD.match(method):
+        return PercentileAccumulator(percentile_of(method))
+    if method not in ACCUMULATORS:
+        raise ValueError("Unknown collection method")
+    return ACCUMULATORS[method]()
 
 
-def collect_all_values(group, key):
-    collect_values_for_key = lambda subgroup: collect_all_values(subgroup, key)
-    if key in group:
-        return group[key]
-    elif '_subgroup' in group:
-        return reduce(add, map(collect_values_for_key, group['_subgroup']))
+class SumAccumulator(object):
+    def __init__(self):
+        self.total = 0
 
+    def empty(self):
+        return SumAccumulator()
 
-def reduce_collected_values(values, method):
-    if "sum" == method:
+    def reduce(self, values):
         try:
             return sum(values)
         except TypeError:
             raise InvalidOperationError("Unable to sum that data")
-    elif "count" == method:
+
+    def add(self, values):
+        self.total += self.reduce(values)
+
+    def value(self):
+        return self.total
+
+
+class CountAccumulator(object):
+    def __init__(self):
+        self.count = 0
+
+    def empty(self):
+        return CountAccumulator()
+
+    def reduce(self, values):
         return len(values)
-    elif "set" == method:
-        return sorted(list(set(values)))
-    elif "mean" == method:
+
+    def add(self, values):
+        self.count += len(values)
+
+    def value(self):
+        return self.count
+
+
+class MeanAccumulator(object):
+    def __init__(self):
+        self.total = 0
+        self.count = 0
+
+    def empty(self):
+        return MeanAccumulator()
+
+    def _sum(self, values):
         try:
-            return sum(values) / float(len(values))
+            return sum(values)
         except TypeError:
             raise InvalidOperationError("Unable to find the mean of that data")
-    elif "default" == method:
-        return reduce_collected_values(values, "set")
-    else:
-        raise ValueError("Unknown collection method")
 
+    def reduce(self, values):
+        return self._sum(values) / float(len(values))
+
+    def add(self, values):
+        self.total += self._sum(values)
+        self.count += len(values)
+
+    def value(self):
+        return self.total / float(self.count)
 
-def remove_collected_key(group, key):
-    if key in group:
-        del group[key]
-    return group
 
+class SetAccumulator(object):
+    def __init__(self):
+        self.values = set()
 
-def sort_all(data, keys):
-    if len(keys) > 1:
-        for i, group in enumerate(data):
-            data[i]['_subgroup'] = sort_all(group['_subgroup'], keys[1:])
-    return sorted(data, key=itemgetter(keys[0]))
+    def empty(self):
+        return SetAccumulator()
+
+    def reduce(self, values):
+        return sorted(set(values))
+
+    def add(self, values):
+        self.values.update(values)
+
+    def value(self):
+        return sorted(self.values)
+
+
+class PercentileAccumulator(object):
+    def __init__(self, percentile):
+        self.percentile = percentile
+        self.sketch = sketch.empty()
+
+    def empty(self):
+        return PercentileAccumulator(self.percentile)
+
+    def reduce(self, summary):
+        if summary["e"]:
+            raise InvalidOperationError(
+                "Unable to find percentiles of that data")
+        return sketch.quantile(summary, self.percentile)
+
+    def add(self, summary):
+        sketch.merge_into(self.sketch, summary)
+
+    def value(self):
+        return self.reduce(self.sketch)
+
+
+class PickAccumulator(object):
+    """Keeps the one value chosen by `choose` from a pair of values
+
+    The database leaves None for groups without values.
+    """
+    def __init__(self, choose):
+        self.choose = choose
+        self.picked = None
+
+    def empty(self):
+        return self.__class__(self.choose)
+
+    def reduce(self, summary):
+        return summary
+
+    def add(self, summary):
+        if summary is not None:
+            self.picked = summary if self.picked is None \
+                else self.choose(self.picked, summary)
+
+    def value(self):
+        return self.reduce(self.picked)
+
+
+class PairPickAccumulator(PickAccumulator):
+    """Picks from timestamp and value pairs, and gives the value"""
+    def reduce(self, summary):
+        return summary[1] if summary is not None else None
+
+
+ACCUMULATORS = {
+    "sum": SumAccumulator,
+    "count": CountAccumulator,
+    "mean": MeanAccumulator,
+    "set": SetAccumulator,
+    "default": SetAccumulator,
+    "min": lambda: PickAccumulator(min),
+    "max": lambda: PickAccumulator(max),
+    "first": lambda: PairPickAccumulator(
+        lambda a, b: min(a, b, key=itemgetter(0))),
+    "last": lambda: PairPickAccumulator(
+        lambda a, b: max(a, b, key=itemgetter(0))),
+}
 
 
 class InvalidOperationError(TypeError):
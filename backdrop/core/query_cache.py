@@ -0,0 +1,288 @@
+"""
+A cache of query results
+
+Results are cached against the bucket name, a canonical form of the query
+and the bucket's version. The version is bumped every time records are
+stored in the bucket, so cached results are not served after a write,
+unless stale results are asked for; the stale entries are left to fall out
+of the store.
+"""
+import cPickle as pickle
+import datetime
+import hashlib
+import json
+import sqlite3
+import sys
+import threading
+from collections import OrderedDict
+from flask import logging
+from backdrop.core import timeutils
+from backdrop.core.timeseries import Period
+
+log = logging.getLogger(__name__)
+
+QUERY_CACHE_STORES = ["memory", "shared"]
+
+
+class BucketVersions(object):
+    """A version number for each bucket, bumped each time it is stored to
+
+    Versions are bumped after the records are stored, so a version read
+    from a replica set member is never ahead of the records that member
+    has. Versions read from the primary are the latest, but the records
+    read from a secondary may be behind them.
+
+    Versions asked for as cached are kept per process for cache_ttl
+    seconds; a cache_ttl of zero turns the cache off.
+    """
+    def __init__(self, db, cache_ttl=0):
+        self._mongo_driver = db.get_collection("bucket_versions")
+        self._primary = db.get_collection("bucket_versions",
+                                          read_from_primary=True)
+        self._cache_ttl = datetime.timedelta(seconds=cache_ttl)
+        self._cached = {}
+
+    def get(self, bucket_name, read_from_primary=True, cached=False):
+        """The version of a bucket and the time it was last stored to
+
+        Buckets that have not been stored to are version 0 and have no
+        time. Without read_from_primary, the version is read with the
+        read preference of the records. Cached versions may be up to
+        cache_ttl seconds behind.
+        """
+        if not (cached and self._cache_ttl):
+            return self._read(bucket_name, read_from_primary)
+
+        key = (bucket_name, read_from_primary)
+        now = timeutils.now()
+        entry = self._cached.get(key)
+        if entry is not None and entry[0] > now:
+            return entry[1]
+
+        value = self._read(bucket_name, read_from_primary)
+        self._cached[key] = (now + self._cache_ttl, value)
+        return value
+
+    def _read(self, bucket_name, read_from_primary):
+        mongo_driver = self._primary if read_from_primary \
+            else self._mongo_driver
+        document = mongo_driver.find_one({"_id": bucket_name})
+        if document is None:
+            return 0, None
+        return document["version"], document.get("updated_at")
+
+    def bump(self, bucket_name):
+        self._mongo_driver.update({"_id": bucket_name},
+                                  {"$inc": {"version": 1},
+                                   "$set": {"updated_at": timeutils.now()}},
+                                  upsert=True)
+
+
+def cache_key(bucket_name, version, query):
+    """A key that is the same for every query asking for the same results"""
+    fields = query._asdict()
+    fields["filter_by"] = sorted(fields["filter_by"])
+    fields["collect"] = sorted(fields["collect"])
+    return json.dumps([bucket_name, version, _canonical(fields)],
+                      sort_keys=True)
+
+
+def query_etag(bucket_name, version, query):
+    """An etag that changes when the query or the bucket's data does"""
+    return hashlib.sha1(cache_key(bucket_name, version, query)).hexdigest()
+
+
+def _canonical(value):
+    if isinstance(value, Period):
+        return value.name
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, dict):
+        return dict((k, _canonical(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    return value
+
+
+class MemoryStore(object):
+    """A least recently used store that is local to the process"""
+    def __init__(self, max_size):
+        self._max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.pop(key, None)
+            if value is not None:
+                self._entries[key] = value
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+
+class SqliteStore(object):
+    """A least recently used store in a sqlite file
+
+    The file can be shared by every worker process on a host. Errors from
+    sqlite, such as the database being locked by another worker, are
+    logged and treated as a cache miss.
+    """
+    def __init__(self, max_size, path):
+        self._max_size = max_size
+        self._path = path
+        self._local = threading.local()
+        self._execute("CREATE TABLE IF NOT EXISTS query_cache "
+                      "(key TEXT PRIMARY KEY, value BLOB, used_at REAL)")
+
+    def get(self, key):
+        rows = self._execute(
+            "SELECT value FROM query_cache WHERE key = ?", key)
+        if not rows:
+            return None
+        self._execute("UPDATE query_cache SET used_at = julianday('now') "
+                      "WHERE key = ?", key)
+        return pickle.loads(str(rows[0][0]))
+
+    def set(self, key, value):
+        self._execute("INSERT OR REPLACE INTO query_cache VALUES "
+                      "(?, ?, julianday('now'))",
+                      key, buffer(pickle.dumps(value, -1)))
+        self._execute("DELETE FROM query_cache WHERE key IN "
+                      "(SELECT key FROM query_cache ORDER BY used_at DESC "
+                      "LIMIT -1 OFFSET ?)", self._max_size)
+
+    def _connection(self):
+        if not hasattr(self._local, "connection"):
+            self._local.connection = sqlite3.connect(self._path, timeout=1)
+        return self._local.connection
+
+    def _execute(self, statement, *params):
+        try:
+            with self._connection() as connection:
+                return connection.execute(statement, params).fetchall()
+        except sqlite3.Error as e:
+            log.warning("Query cache error: %s" % e)
+            return []
+
+
+class SingleFlight(object):
+    """Runs a function once for all of the callers that want it at once
+
+    Callers asking for a key that is already being loaded wait for that
+    load and share its result, or its exception, rather than starting
+    another. Loads are only shared within a process.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def is_running(self, key):
+        with self._lock:
+            return key in self._flights
+
+    def do(self, key, function):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if leader:
+            try:
+                flight.result = function()
+            except Exception:
+                flight.error = sys.exc_info()
+            finally:
+                with self._lock:
+                    del self._flights[key]
+                flight.done.set()
+        else:
+            flight.done.wait()
+
+        if flight.error is not None:
+            raise flight.error[0], flight.error[1], flight.error[2]
+        return flight.result
+
+
+class _Flight(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class QueryCache(object):
+    """Query results cached against the bucket version they were read at
+
+    Identical queries that miss at the same time share a single load. With
+    stale_while_revalidate, a query whose bucket has been written to since
+    it was last loaded is answered with the last results while they are
+    refreshed in the background.
+    """
+    def __init__(self, store, stale_while_revalidate=False):
+        self._store = store
+        self._flights = SingleFlight()
+        self._stale_while_revalidate = stale_while_revalidate
+
+    def get(self, bucket_name, version, query, load):
+        """Return the results for a query and the version they are from
+
+        The results are cached, or loaded and cached. `load` returns the
+        results along with a version, no later than `version`, that they
+        are at least as recent as, and they are cached under that version.
+        Results from an earlier version are stale.
+        """
+        key = cache_key(bucket_name, version, query)
+        value = self._store.get(key)
+        if value is not None:
+            return version, value
+
+        if self._stale_while_revalidate:
+            latest = self._store.get(cache_key(bucket_name, None, query))
+            if latest is not None and latest[0] < version:
+                self._refresh(key, bucket_name, query, load)
+                return latest
+
+        return self._flights.do(
+            key, lambda: self._load(bucket_name, query, load))
+
+    def _load(self, bucket_name, query, load):
+        version, value = load()
+        self._store.set(cache_key(bucket_name, version, query), value)
+        if self._stale_while_revalidate:
+            self._store.set(cache_key(bucket_name, None, query),
+                            (version, value))
+        return version, value
+
+    def _refresh(self, key, bucket_name, query, load):
+        if self._flights.is_running(key):
+            return
+
+        def refresh():
+            try:
+                self._flights.do(key, lambda: self._load(
+                    bucket_name, query, load))
+            except Exception as e:
+                log.exception(e)
+
+        thread = threading.Thread(target=refresh)
+        thread.daemon = True
+        thread.start()
+
+
+def create_query_cache(store, max_size, path=None,
+                       stale_while_revalidate=False):
+    """Create a query cache with one of QUERY_CACHE_STORES, or None"""
+    if store is None:
+        return None
+    if store not in QUERY_CACHE_STORES:
+        raise ValueError("Unknown query cache store {0}".format(store))
+    if store == "memory":
+        return QueryCache(MemoryStore(max_size), stale_while_revalidate)
+    return QueryCache(SqliteStore(max_size, path), stale_while_revalidate)
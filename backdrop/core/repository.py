@@ -1,4 +1,7 @@
+from datetime import timedelta
+from backdrop.core import timeutils
 from backdrop.core.bucket import BucketConfig
+from backdrop.core.database import PAGING_INDEX
 from backdrop.core.user import UserConfig
 
 
@@ -32,25 +35,62 @@ class _Repository(object):
         return self.model_cls(**doc)
 
 
+class _ConfigCache(object):
+    """A per process cache of configs that expire after ttl seconds
+
+    A ttl of zero turns the cache off. Lookups that find nothing are
+    not cached.
+    """
+    def __init__(self, ttl):
+        self._ttl = timedelta(seconds=ttl)
+        self._entries = {}
+
+    def get(self, key, load):
+        if not self._ttl:
+            return load()
+
+        now = timeutils.now()
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > now:
+            return entry[1]
+
+        value = load()
+        if value is not None:
+            self._entries[key] = (now + self._ttl, value)
+        return value
+
+    def clear(self):
+        self._entries = {}
+
+
 class BucketConfigRepository(object):
-    def __init__(self, db):
+    def __init__(self, db, cache_ttl=0):
         self._db = db
         self._repository = _Repository(db, BucketConfig, "buckets", "name")
+        self._cache = _ConfigCache(cache_ttl)
 
     def save(self, bucket_config, create_bucket=True):
         self._repository.save(bucket_config)
+        self._cache.clear()
 
-        if bucket_config.realtime and create_bucket:
-            self._db.create_capped_collection(bucket_config.name,
-                                              bucket_config.capped_size)
+        if create_bucket:
+            if bucket_config.realtime:
+                self._db.create_capped_collection(bucket_config.name,
+                                                  bucket_config.capped_size)
+            self._db.get_collection(bucket_config.name).ensure_index(
+                PAGING_INDEX)
 
     def retrieve(self, name):
-        return self._repository.retrieve(name)
+        return self._cache.get(
+            ("name", name),
+            lambda: self._repository.retrieve(name))
 
     def get_bucket_for_query(self, data_group, data_type):
-        return self._repository.find_first_instance_of(
-            {"data_group": data_group,
-             "data_type": data_type})
+        return self._cache.get(
+            ("data", data_group, data_type),
+            lambda: self._repository.find_first_instance_of(
+                {"data_group": data_group,
+                 "data_type": data_type}))
 
 
 class UserConfigRepository(object):
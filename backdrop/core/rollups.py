@@ -0,0 +1,290 @@
+"""
+Period rollups of the records in a bucket
+
+A bucket with rollups keeps one document per period, and per value of each
+of its rollup group_by fields, holding the number of records and the count
+and sum of its rollup fields. The documents are updated as records are
+stored, so period queries that only need those numbers can be answered
+without grouping the records themselves.
+
+Storing a record with the _id of a stored record replaces it, so the stored
+record is taken back out of the rollups. Only numbers that can be taken out
+again are kept, which is why there is no min or max.
+
+Rollups are marked dirty when records may have been stored without being
+rolled up, or a bulk update of the rollups failed part of the way through.
+Dirty rollups are not used to answer queries until they are rebuilt.
+"""
+from collections import defaultdict
+from operator import itemgetter
+from flask import logging
+import pymongo
+from backdrop.core import timeutils
+from backdrop.core.database import sort_and_limit
+from backdrop.core.nested_merge import collect_key, InvalidOperationError
+from backdrop.core.timeseries import PERIODS
+
+log = logging.getLogger(__name__)
+
+ROLLUP_METHODS = ["sum", "count", "mean"]
+
+# the _id of the document in a rollup collection marking it as dirty
+DIRTY_ID = "_dirty"
+
+
+def rollup_collection_name(bucket_name):
+    return "_rollups_{0}".format(bucket_name)
+
+
+class Rollups(object):
+    def __init__(self, db, bucket_name, fields=None, group_by=None):
+        self._db = db
+        self._collection_name = rollup_collection_name(bucket_name)
+        self._mongo_driver = db.get_collection(self._collection_name)
+        # the records being replaced are read from where they are written
+        self._records = db.get_collection(bucket_name, read_from_primary=True)
+        self.fields = fields or []
+        self.group_by = group_by or []
+
+    def stored_records(self, documents):
+        """The stored records that storing the documents would replace,
+        by _id"""
+        ids = [document["_id"] for document in documents if "_id" in document]
+        if not ids:
+            return {}
+        records = self._records.find({"_id": {"$in": ids}},
+                                     ["_id", "ascending"], None)
+        return dict((record["_id"], record) for record in records)
+
+    def update(self, documents, replaced=None):
+        """Add a list of stored documents to the rollups
+
+        replaced: the records, by _id, that the documents were stored over,
+                  which are taken out of the rollups
+
+        The bulk update is not retried, as it is not idempotent, so the
+        rollups are marked dirty if it fails.
+        """
+        try:
+            _write_deltas(self._mongo_driver,
+                          self._deltas(documents, replaced))
+        except Exception:
+            self.mark_dirty()
+            raise
+
+    def mark_dirty(self):
+        """Stop using the rollups until they are rebuilt"""
+        log.error("Rollups %s no longer match their records, and need "
+                  "rebuilding" % self._collection_name)
+        try:
+            self._mongo_driver.update({"_id": DIRTY_ID},
+                                      {"$set": {"at": timeutils.now()}},
+                                      upsert=True)
+        except Exception:
+            log.exception("Could not mark rollups %s dirty"
+                          % self._collection_name)
+
+    def is_dirty(self):
+        return self._mongo_driver.find_one({"_id": DIRTY_ID}) is not None
+
+    def rebuild(self, documents, chunk_size=1000):
+        """Recalculate the rollups from all of the documents in the bucket
+
+        The rollups are built in a collection of their own, which then
+        replaces the current rollups, so queries never see them part built.
+        Records stored while the documents are read may be missed, or
+        counted twice, so writes to the bucket must be stopped first.
+        Rebuilt rollups are no longer dirty.
+        """
+        building = self._db.get_collection(self._collection_name + "_rebuild")
+        building.remove({})
+
+        built, chunk = False, []
+        for document in documents:
+            chunk.append(document)
+            if len(chunk) == chunk_size:
+                built = _write_deltas(building, self._deltas(chunk)) or built
+                chunk = []
+        built = _write_deltas(building, self._deltas(chunk)) or built
+
+        if built:
+            building.rename(self._collection_name)
+        else:
+            self.clear()
+
+    def _deltas(self, documents, replaced=None):
+        deltas = defaultdict(_RollupDelta)
+        replaced = dict(replaced or {})
+        for document in documents:
+            if "_id" in document:
+                # a document stored twice replaces itself
+                previous = replaced.get(document["_id"])
+                replaced[document["_id"]] = document
+                if previous is not None:
+                    self._add(deltas, previous, -1)
+            self._add(deltas, document, 1)
+        return deltas
+
+    def _add(self, deltas, document, sign):
+        if "_timestamp" not in document:
+            return
+        for period in PERIODS:
+            for group_key in [None] + self.group_by:
+                # records without a value are not grouped on, as with the
+                # grouping of the records themselves
+                if group_key is not None and document.get(group_key) is None:
+                    continue
+                rollup_key = (period.name,
+                              group_key,
+                              document.get(group_key),
+                              document[period.start_at_key])
+                deltas[rollup_key].add(document, self.fields, sign)
+
+    def clear(self):
+        self._mongo_driver.remove({})
+
+    def can_answer(self, query):
+        """Whether a query can be answered from the rollups alone"""
+        if not query.period or query.filter_by:
+            return False
+        keys = query.group_by_keys
+        if len(keys) > 1 or (keys and keys[0] not in self.group_by):
+            return False
+        for timestamp in [query.start_at, query.end_at]:
+            if timestamp and query.period.start(timestamp) != timestamp:
+                return False
+        if not all(field in self.fields and method in ROLLUP_METHODS
+                   for field, method in query.collect):
+            return False
+        return not self.is_dirty()
+
+    def group(self, group_by, query, sort=None, limit=None, collect=None):
+        period_key = query.period.start_at_key
+        groups = [
+            _group_from_rollup(rollup, period_key, collect or [])
+            for rollup in self._find(query, None)]
+
+        return sort_and_limit(groups, sort, limit)
+
+    def multi_group(self, key1, key2, query,
+                    sort=None, limit=None, collect=None):
+        collect = collect or []
+        rollups = sorted(self._find(query, key1),
+                         key=itemgetter("group_value", "_start_at"))
+
+        groups = []
+        for rollup in rollups:
+            if not groups or groups[-1][key1] != rollup["group_value"]:
+                groups.append({key1: rollup["group_value"],
+                               "_count": 0,
+                               "_subgroup": [],
+                               "stats": {}})
+            group = groups[-1]
+            group["_count"] += rollup["_count"]
+            group["_subgroup"].append(
+                _group_from_rollup(rollup, key2, collect))
+            _merge_stats(group["stats"], rollup.get("stats", {}))
+
+        for group in groups:
+            group["_group_count"] = len(group["_subgroup"])
+            stats = group.pop("stats")
+            group.update(_collected_values(stats, collect))
+
+        return sort_and_limit(groups, sort, limit)
+
+    def _find(self, query, group_key):
+        # rollups of records that have all been replaced are left empty
+        mongo_query = {"period": query.period.name, "group_key": group_key,
+                       "_count": {"$gt": 0}}
+        if query.start_at or query.end_at:
+            mongo_query["_start_at"] = {}
+            if query.start_at:
+                mongo_query["_start_at"]["$gte"] = query.start_at
+            if query.end_at:
+                mongo_query["_start_at"]["$lt"] = query.end_at
+        return self._mongo_driver.find(mongo_query,
+                                       ["_start_at", "ascending"], None)
+
+
+class _RollupDelta(object):
+    """The changes to make to one rollup document"""
+    def __init__(self):
+        self.increments = defaultdict(int)
+
+    def add(self, document, fields, sign=1):
+        self.increments["_count"] += sign
+        for field in fields:
+            if field not in document:
+                continue
+            value = document[field]
+            self.increments["stats.%s.count" % field] += sign
+            if _is_number(value):
+                self.increments["stats.%s.numeric" % field] += sign
+                self.increments["stats.%s.sum" % field] += sign * value
+
+    def to_update(self):
+        return {"$inc": dict(self.increments)}
+
+
+def _write_deltas(mongo_driver, deltas):
+    """Apply the deltas to a rollup collection, returning whether there
+    were any"""
+    if not deltas:
+        return False
+    mongo_driver.ensure_index(
+        [("period", pymongo.ASCENDING),
+         ("group_key", pymongo.ASCENDING),
+         ("group_value", pymongo.ASCENDING),
+         ("_start_at", pymongo.ASCENDING)],
+        unique=True)
+    mongo_driver.update_all([
+        (_rollup_spec(*key), delta.to_update())
+        for key, delta in deltas.items()])
+    return True
+
+
+def _rollup_spec(period_name, group_key, group_value, start_at):
+    return {
+        "period": period_name,
+        "group_key": group_key,
+        "group_value": group_value,
+        "_start_at": start_at
+    }
+
+
+def _is_number(value):
+    return isinstance(value, (int, long, float)) and \
+        not isinstance(value, bool)
+
+
+def _merge_stats(stats, other):
+    for field, field_stats in other.items():
+        merged = stats.setdefault(field, {})
+        for name, value in field_stats.items():
+            merged[name] = merged.get(name, 0) + value
+
+
+def _group_from_rollup(rollup, key, collect):
+    group = {key: rollup["_start_at"], "_count": rollup["_count"]}
+    group.update(_collected_values(rollup.get("stats", {}), collect))
+    return group
+
+
+def _collected_values(stats, collect):
+    return dict(
+        (collect_key(field, method),
+         _collected_value(stats.get(field, {}), method))
+        for field, method in collect)
+
+
+def _collected_value(stats, method):
+    count = stats.get("count", 0)
+    if method == "count":
+        return count
+    if stats.get("numeric", 0) != count:
+        raise InvalidOperationError(
+            "Unable to find the {0} of that data".format(method))
+    if method == "sum":
+        return stats.get("sum", 0)
+    if method == "mean":
+        return stats["sum"] / float(count) if count else None
@@ -0,0 +1,201 @@
+"""
+Mergeable sketches of the distribution of a field, for percentiles
+
+A sketch counts values in logarithmically sized bins, so any percentile
+read from it is within RELATIVE_ACCURACY of a value that was added, however
+many values there were. Sketches of different groups are merged by adding
+their bins together. The number of bins is bounded by MAX_BINS; past that
+the bins nearest zero are collapsed together.
+
+Sketches are plain dicts so that they can come straight out of a group
+command's reducer, which builds them with the javascript from
+`reducer_code`. An aggregation pipeline instead groups documents on the
+bin of their value, with the expressions from `bin_expressions`, and
+counts them, and the sketch is made from those counts by `from_bins`:
+
+    {"p": {bin: count}, "n": {bin: count}, "z": count of zeros,
+     "c": count of values, "b": number of bins, "e": whether any values
+     were not numbers}
+"""
+import math
+
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+LOG_GAMMA = math.log(GAMMA)
+MAX_BINS = 2048
+
+
+def empty():
+    return {"p": {}, "n": {}, "z": 0, "c": 0, "b": 0, "e": False}
+
+
+def from_values(values):
+    sketch = empty()
+    for value in values:
+        add(sketch, value)
+    return sketch
+
+
+def from_bins(counts):
+    """Make a sketch from counts of values in bins
+
+    Each bin is a dict with the sign "s" of its values, which is "p", "n",
+    "z" for zeros or "e" for values that are not numbers, the index "i" of
+    the bin and the count "c" of values in it. Bins without a sign counted
+    documents without a value, and are left out.
+    """
+    sketch = empty()
+    for counted in counts:
+        sign, count = counted.get("s"), counted["c"]
+        if sign is None:
+            continue
+        if sign == "e":
+            sketch["e"] = True
+            continue
+        sketch["c"] += count
+        if sign == "z":
+            sketch["z"] += count
+            continue
+        bins = sketch[sign]
+        index = int(counted["i"])
+        bins[index] = bins.get(index, 0) + count
+    sketch["b"] = len(sketch["p"]) + len(sketch["n"])
+    _collapse(sketch)
+    return sketch
+
+
+def add(sketch, value):
+    if value is None:
+        return
+    if isinstance(value, bool) or not isinstance(value, (int, long, float)):
+        sketch["e"] = True
+        return
+
+    sketch["c"] += 1
+    if value == 0:
+        sketch["z"] += 1
+        return
+
+    bins = sketch["p"] if value > 0 else sketch["n"]
+    index = _index(abs(value))
+    if index not in bins:
+        bins[index] = 0
+        sketch["b"] += 1
+    bins[index] += 1
+    _collapse(sketch)
+
+
+def merge(sketches):
+    """Merge sketches into a new one"""
+    merged = empty()
+    for sketch in sketches:
+        merge_into(merged, sketch)
+    return merged
+
+
+def merge_into(sketch, other):
+    """Add the values of another sketch to a sketch"""
+    sketch["e"] = sketch["e"] or other["e"]
+    sketch["c"] += other["c"]
+    sketch["z"] += other["z"]
+    for sign in ["p", "n"]:
+        bins = sketch[sign]
+        for index, count in other[sign].items():
+            # bins from javascript have string keys
+            index = int(index)
+            bins[index] = bins.get(index, 0) + count
+    sketch["b"] = len(sketch["p"]) + len(sketch["n"])
+    _collapse(sketch)
+
+
+def quantile(sketch, q):
+    """An estimate of the q quantile of the values, or None without values"""
+    if sketch["c"] == 0:
+        return None
+
+    rank = q * (sketch["c"] - 1)
+    seen = 0
+    for index in sorted(sketch["n"], key=int, reverse=True):
+        seen += sketch["n"][index]
+        if seen > rank:
+            return -_value(int(index))
+    seen += sketch["z"]
+    if seen > rank:
+        return 0.0
+    for index in sorted(sketch["p"], key=int):
+        seen += sketch["p"][index]
+        if seen > rank:
+            return _value(int(index))
+    return _value(max(int(index) for index in sketch["p"]))
+
+
+def _index(value):
+    return int(math.ceil(math.log(value) / LOG_GAMMA))
+
+
+def _value(index):
+    # the middle of the bin, in relative terms
+    return 2 * GAMMA ** index / (GAMMA + 1)
+
+
+def _collapse(sketch):
+    while sketch["b"] > MAX_BINS:
+        bins = sketch["p"] if len(sketch["p"]) > 1 else sketch["n"]
+        lowest, next_lowest = sorted(bins, key=int)[:2]
+        bins[next_lowest] += bins.pop(lowest)
+        sketch["b"] -= 1
+
+
+def bin_expressions(field):
+    """Aggregation expressions for the sign and bin index of a field
+
+    The sign is None for documents without a value, and the index is None
+    for values that are zero or not numbers, as for `from_bins`. Numbers
+    are the only values that sort between null and the empty string.
+    """
+    value = "$" + field
+    is_number = {"$and": [{"$gt": [value, None]}, {"$lt": [value, ""]}]}
+    sign = {"$cond": [
+        {"$eq": [{"$ifNull": [value, None]}, None]}, None,
+        {"$cond": [is_number,
+                   {"$cond": [{"$gt": [value, 0]}, "p",
+                              {"$cond": [{"$lt": [value, 0]}, "n", "z"]}]},
+                   "e"]}]}
+    index = {"$cond": [
+        {"$and": [is_number, {"$ne": [value, 0]}]},
+        {"$ceil": {"$divide": [{"$ln": {"$abs": value}}, LOG_GAMMA]}},
+        None]}
+    return sign, index
+
+
+def reducer_code(field, key):
+    """Javascript adding the current document's field to a sketch
+
+    The code is part of a group command's reducer, in which `current` is
+    the document and `previous` the group, holding the sketch at `key`.
+    """
+    return _REDUCER.format(field=field, key=key, log_gamma=repr(LOG_GAMMA),
+                           max_bins=MAX_BINS)
+
+
+_REDUCER = """\
+(function (s, v) {{
+  if (v === undefined || v === null) {{ return; }}
+  if (v instanceof NumberLong) {{ v = v.toNumber(); }}
+  else if (v instanceof NumberInt) {{ v = Number(v); }}
+  if (typeof v !== 'number') {{ s.e = true; return; }}
+  s.c++;
+  if (v === 0) {{ s.z++; return; }}
+  var bins = v > 0 ? s.p : s.n;
+  var i = Math.ceil(Math.log(Math.abs(v)) / {log_gamma});
+  if (bins[i] === undefined) {{ bins[i] = 0; s.b++; }}
+  bins[i]++;
+  while (s.b > {max_bins}) {{
+    var b = Object.keys(s.p).length > 1 ? s.p : s.n;
+    var keys = Object.keys(b).map(Number).sort(function (x, y) {{
+      return x - y; }});
+    b[keys[1]] += b[keys[0]];
+    delete b[keys[0]];
+    s.b--;
+  }}
+}})(previous['{key}'], current['{field}']);"""
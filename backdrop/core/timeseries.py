@@ -1,5 +1,5 @@
 from datetime import timedelta, time
-import time as _time
+import threading
 from dateutil.relativedelta import relativedelta, MO
 import pytz
 
@@ -97,20 +97,111 @@ def parse_period(period_name):
             return period
 
 
-def _time_to_index(dt):
-    return _time.mktime(dt.replace(tzinfo=pytz.utc).timetuple())
+# period range tables are kept until they hold this many periods in all;
+# each period costs a few hundred bytes with the default entries it keeps
+MAX_TABLED_PERIODS = 20000
+
+# sparse timeseries are only filled when at least this fraction of their
+# periods have data
+SPARSE_FRACTION = 0.5
+
+_range_tables = {}
+_tabled_periods = [0]
+_range_tables_lock = threading.Lock()
+
+
+class PeriodRangeTable(object):
+    """The periods of a range, and the position of each by its start
+
+    Tables are shared between requests. The entries of the default last
+    asked for are kept, as the groups of a query share their default, but
+    only copies of them are handed out.
+    """
+    def __init__(self, period, start, end):
+        self.limits = list(period.range(start, end))
+        self.positions = dict((limits[0], position)
+                              for position, limits in enumerate(self.limits))
+        self._default_entries = (None, [])
+
+    def __len__(self):
+        return len(self.limits)
+
+    def default_entries(self, default):
+        """A new entry of the default and the limits of each period"""
+        key = tuple(sorted(default.items()))
+        kept_key, entries = self._default_entries
+        if kept_key != key:
+            entries = [_merge(default, _period_limits(*limits))
+                       for limits in self.limits]
+            # replaced in one assignment as other threads may be reading
+            self._default_entries = (key, entries)
+        return map(dict, entries)
+
+
+def period_range_table(period, start, end):
+    """The table of a range of periods, shared between requests"""
+    key = (period.name, start, end)
+    table = _range_tables.get(key)
+    if table is not None:
+        return table
+
+    table = PeriodRangeTable(period, start, end)
+    if len(table) > MAX_TABLED_PERIODS:
+        return table
+    with _range_tables_lock:
+        # another thread may have tabled the same range meanwhile
+        if key in _range_tables:
+            return _range_tables[key]
+        if _tabled_periods[0] + len(table) > MAX_TABLED_PERIODS:
+            _range_tables.clear()
+            _tabled_periods[0] = 0
+        _range_tables[key] = table
+        _tabled_periods[0] += len(table)
+    return table
 
 
 def timeseries(start, end, period, data, default):
-    data_by_start_at = _index_by_start_at(data)
-
-    def entry(start, end):
-        time_index = _time_to_index(start)
-        if time_index in data_by_start_at:
-            return data_by_start_at[time_index]
+    """The data for each period from start to end
+
+    Periods without data get an entry of the default and the period's
+    limits.
+    """
+    return fill_timeseries(start, end, period, [data], default)[0]
+
+
+def fill_timeseries(start, end, period, series, default, sparse=False):
+    """Each of a list of series of data, with every period from start to end
+
+    The periods of the range are worked out once for all of the series.
+    Each series starts as its own list of default entries, and its data is
+    put in place by the position of the period it starts, taking its start
+    to be in UTC. When sparse, series with data for fewer than
+    SPARSE_FRACTION of the periods are not filled, and only have their
+    data that starts a period, in order.
+    """
+    table = period_range_table(period, start, end)
+    positions = table.positions
+    min_filled = SPARSE_FRACTION * len(table) if sparse else 0
+
+    filled = []
+    for data in series:
+        aligned = {}
+        for datum in data:
+            start_at = datum["_start_at"]
+            if start_at.tzinfo is not pytz.UTC:
+                start_at = start_at.replace(tzinfo=pytz.UTC)
+            position = positions.get(start_at)
+            if position is not None:
+                aligned[position] = datum
+
+        if len(aligned) < min_filled:
+            filled.append([aligned[index] for index in sorted(aligned)])
         else:
-            return _merge(default, _period_limits(start, end))
-    return [entry(start, end) for start, end in period.range(start, end)]
+            values = table.default_entries(default)
+            for index, datum in aligned.iteritems():
+                values[index] = datum
+            filled.append(values)
+    return filled
 
 
 def _period_limits(start, end):
@@ -120,16 +211,6 @@ def _period_limits(start, end):
     }
 
 
-def _index_by_start_at(data):
-    return dict((_time_to_index(d["_start_at"]), d) for d in data)
-
-
-def _period_range(start, stop, period):
-    while start < stop:
-        yield (start, start + period)
-        start += period
-
-
 def _merge(first, second):
     return dict(first.items() + second.items())
 
@@ -8,7 +8,7 @@ from collections import namedtuple
 import datetime
 import re
 import bson
-from dateutil import parser
+from dateutil import parser, tz
 import pytz
 
 RESERVED_KEYWORDS = (
@@ -18,25 +18,58 @@ RESERVED_KEYWORDS = (
 VALID_KEY = re.compile('^[a-z_][a-z0-9_]+$')
 
 
-def _is_real_date(value):
-    try:
-        parser.parse(value).astimezone(pytz.UTC)
-        return True
-    except ValueError:
-        return False
+TIME_PATTERN = re.compile(
+    "[0-9]{4}-[0-9]{2}-[0-9]{2}"
+    "T[0-9]{2}:[0-9]{2}:[0-9]{2}"
+    "(?:[+-][0-9]{2}:?[0-9]{2}|Z)"
+)
+EXACT_TIME_PATTERN = re.compile(
+    "^([0-9]{4})-([0-9]{2})-([0-9]{2})"
+    "T([0-9]{2}):([0-9]{2}):([0-9]{2})"
+    "(?:([+-])([0-9]{2}):?([0-9]{2})|Z)$"
+)
 
 
 def _is_valid_format(value):
-    time_pattern = re.compile(
-        "[0-9]{4}-[0-9]{2}-[0-9]{2}"
-        "T[0-9]{2}:[0-9]{2}:[0-9]{2}"
-        "(?:[+-][0-9]{2}:?[0-9]{2}|Z)"
-    )
-    return bool(time_pattern.match(value))
+    return bool(TIME_PATTERN.match(value))
+
+
+def _parse_exact_time(match):
+    (year, month, day, hour, minute, second,
+     sign, offset_hours, offset_minutes) = match.groups()
+    offset = 0
+    if sign is not None:
+        offset = int(offset_hours) * 3600 + int(offset_minutes) * 60
+        if sign == "-":
+            offset = -offset
+    timezone = tz.tzoffset(None, offset) if offset else tz.tzutc()
+    return datetime.datetime(int(year), int(month), int(day), int(hour),
+                             int(minute), int(second), tzinfo=timezone)
+
+
+def parse_datetime_string(value):
+    """Parse a datetime string, or return None if it is not a valid one
+
+    Strings that are exactly in the expected format are parsed directly,
+    which is much quicker than dateutil; anything else that starts with
+    the expected format is left to dateutil.
+    """
+    match = EXACT_TIME_PATTERN.match(value)
+    try:
+        if match:
+            time = _parse_exact_time(match)
+        elif _is_valid_format(value):
+            time = parser.parse(value)
+        else:
+            return None
+        time.astimezone(pytz.UTC)
+        return time
+    except ValueError:
+        return None
 
 
 def value_is_valid_datetime_string(value):
-    return _is_valid_format(value) and _is_real_date(value)
+    return parse_datetime_string(value) is not None
 
 
 def value_is_valid(value):
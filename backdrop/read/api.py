@@ -1,18 +1,29 @@
-import datetime
 import json
+from functools import wraps
+from multiprocessing.pool import ThreadPool
 from os import getenv
-from bson import ObjectId
 
-from flask import Flask, jsonify, request, redirect
+from flask import Flask, jsonify, request, redirect, Response
 from flask_featureflags import FeatureFlag
+from werkzeug.datastructures import MultiDict
+from werkzeug.urls import url_encode
 from backdrop.core.log_handler \
     import create_request_logger, create_response_logger
 from backdrop.read.query import Query
+from backdrop.read import formats
+from backdrop.read.request_args import ParsedRequestArgs
+from backdrop.read.response import SimpleData
+from backdrop.read.serialiser import JsonEncoder, JsonSerialiser, \
+    encode_json
 
 from .validation import validate_request_args
-from ..core import database, log_handler, cache_control
+from ..core import database, log_handler, cache_control, compression, \
+    explain
 from ..core.bucket import Bucket
 from ..core.database import InvalidOperationError
+from ..core.index_advisor import QueryShapes
+from ..core.query_cache import create_query_cache, MemoryStore, \
+    BucketVersions, SingleFlight, cache_key, query_etag
 from ..core.repository import BucketConfigRepository
 
 
@@ -32,24 +43,39 @@ app.config.from_object(
 db = database.Database(
     app.config['MONGO_HOST'],
     app.config['MONGO_PORT'],
-    app.config['DATABASE_NAME']
+    app.config['DATABASE_NAME'],
+    replica_set=app.config['MONGO_REPLICA_SET'],
+    read_preference=app.config['MONGO_READ_PREFERENCE'],
+    max_pool_size=app.config['MONGO_MAX_POOL_SIZE'],
+    query_engine=app.config['QUERY_ENGINE']
 )
 
-bucket_repository = BucketConfigRepository(db)
+bucket_repository = BucketConfigRepository(
+    db, cache_ttl=app.config['BUCKET_CONFIG_CACHE_TTL'])
+
+bucket_versions = BucketVersions(
+    db, cache_ttl=app.config['BUCKET_VERSION_CACHE_TTL'])
+
+query_cache = create_query_cache(
+    app.config['QUERY_CACHE'],
+    app.config['QUERY_CACHE_SIZE'],
+    app.config['QUERY_CACHE_PATH'],
+    app.config['QUERY_CACHE_STALE_WHILE_REVALIDATE'])
+
+query_flights = SingleFlight()
+
+query_shapes = QueryShapes(
+    db, sample_rate=app.config['QUERY_SHAPE_SAMPLE_RATE'])
 
 setup_logging()
 
 app.before_request(create_request_logger(app))
 app.after_request(create_response_logger(app))
+app.after_request(compression.gzip_responses(
+    MemoryStore(app.config['GZIP_CACHE_SIZE']),
+    min_size=app.config['GZIP_MIN_SIZE']))
 
 
-class JsonEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, ObjectId):
-            return str(obj)
-        if isinstance(obj, datetime.datetime):
-            return obj.isoformat()
-        return json.JSONEncoder.default(self, obj)
 app.json_encoder = JsonEncoder
 
 
@@ -76,17 +102,31 @@ def log_error_and_respond(message, status_code):
     return jsonify(status='error', message=message), status_code
 
 
+def explainable(func):
+    """Explain how the query of a request is run, if it asks for that"""
+    @wraps(func)
+    def new_func(*args, **kwargs):
+        if request.args.get('explain') != 'true':
+            return func(*args, **kwargs)
+        with explain.explaining():
+            return func(*args, **kwargs)
+    return new_func
+
+
 @app.route('/data/<data_group>/<data_type>', methods=['GET', 'OPTIONS'])
+@explainable
 def data(data_group, data_type):
-    bucket_config = bucket_repository.get_bucket_for_query(data_group,
-                                                           data_type)
+    with explain.stage('config'):
+        bucket_config = bucket_repository.get_bucket_for_query(data_group,
+                                                               data_type)
     return fetch(bucket_config)
 
 
 @app.route('/<bucket_name>', methods=['GET', 'OPTIONS'])
-@cache_control.etag
+@explainable
 def query(bucket_name):
-    bucket_config = bucket_repository.retrieve(name=bucket_name)
+    with explain.stage('config'):
+        bucket_config = bucket_repository.retrieve(name=bucket_name)
     return fetch(bucket_config)
 
 
@@ -101,30 +141,338 @@ def fetch(bucket_config):
         response.headers['Access-Control-Max-Age'] = '86400'
         response.headers['Access-Control-Allow-Headers'] = 'cache-control'
     else:
-        result = validate_request_args(request.args,
-                                       bucket_config.raw_queries_allowed)
+        try:
+            with explain.stage('validation'):
+                query = parse_query(bucket_config, request.args)
+        except QueryError as e:
+            return log_error_and_respond(e.message, e.status_code)
+
+        if explain.is_explaining():
+            if not explain_allowed(bucket_config):
+                return log_error_and_respond('explain is not allowed', 403)
+            try:
+                response = explain_query(bucket_config, query)
+            except QueryError as e:
+                return log_error_and_respond(e.message, e.status_code)
+            response.headers['Access-Control-Allow-Origin'] = '*'
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+
+        output_format = request.args.get('format', 'json')
+
+        # the etag only depends on the query and the bucket's version, so
+        # conditional requests are answered without running the query
+        version, updated_at = get_bucket_version(bucket_config)
+        etag = response_etag(bucket_config, version, query, output_format)
+
+        if cache_control.not_modified(etag, updated_at):
+            response = Response(status=304)
+        else:
+            try:
+                result_version, result = run_query(bucket_config, version,
+                                                   query)
+            except QueryError as e:
+                return log_error_and_respond(e.message, e.status_code)
+
+            response = format_response(result, query, output_format)
+
+            if result_version != version:
+                # stale results, served while they are refreshed, are
+                # tagged with the version they are from and are not kept
+                etag = response_etag(bucket_config, result_version, query,
+                                     output_format)
+                updated_at = None
+                response.headers['Cache-Control'] = 'no-cache'
+
+        response.set_etag(etag)
+        if updated_at is not None:
+            response.last_modified = updated_at
+
+    # allow requests from any origin
+    response.headers['Access-Control-Allow-Origin'] = '*'
 
-        if not result.is_valid:
-            return log_error_and_respond(result.message, 400)
+    if 'Cache-Control' not in response.headers:
+        response.headers['Cache-Control'] = \
+            "max-age=%d, must-revalidate" % bucket_config.max_age
 
-        bucket = Bucket(db, bucket_config)
+    return response
 
-        try:
-            result_data = bucket.query(Query.parse(request.args)).data()
-        except InvalidOperationError:
-            return log_error_and_respond('invalid collect for that data', 400)
 
-        response = jsonify(data=result_data)
+def response_etag(bucket_config, version, query, output_format):
+    etag = query_etag(bucket_config.name, version, query)
+    if output_format != 'json':
+        # each format is a different representation of the results
+        etag = '%s-%s' % (etag, output_format)
+    return etag
+
+
+@app.route('/_batch', methods=['POST', 'OPTIONS'])
+@cache_control.nocache
+def batch():
+    """Run a list of queries concurrently and return all of their results
+
+    Each query names a bucket, either as "bucket" or as "data_group" and
+    "data_type", and has the usual query parameters as "query". Each result
+    has its own status, so one bad query does not fail the others.
+    """
+    if request.method == 'OPTIONS':
+        response = app.make_default_options_response()
+        response.headers['Access-Control-Max-Age'] = '86400'
+        response.headers['Access-Control-Allow-Headers'] = \
+            'cache-control, content-type'
+    else:
+        queries = (request.get_json(silent=True) or {}).get('queries')
+        if not isinstance(queries, list):
+            return log_error_and_respond('expected a list of queries', 400)
+        if len(queries) > app.config['BATCH_MAX_QUERIES']:
+            return log_error_and_respond(
+                'a batch can have at most %d queries'
+                % app.config['BATCH_MAX_QUERIES'], 400)
+
+        response = json_response(
+            {'data': batch_pool().map(run_batch_query, queries)})
 
-    # allow requests from any origin
     response.headers['Access-Control-Allow-Origin'] = '*'
 
-    response.headers['Cache-Control'] = "max-age=%d, must-revalidate" % \
-                                        bucket_config.max_age
+    return response
+
 
+_batch_pool = None
+
+
+def batch_pool():
+    # created on first use so that each worker process gets its own threads
+    global _batch_pool
+    if _batch_pool is None:
+        _batch_pool = ThreadPool(app.config['BATCH_THREADS'])
+    return _batch_pool
+
+
+def run_batch_query(spec):
+    try:
+        if not isinstance(spec, dict):
+            raise QueryError('invalid query', 400)
+        if 'bucket' in spec:
+            bucket_config = bucket_repository.retrieve(name=spec['bucket'])
+        else:
+            bucket_config = bucket_repository.get_bucket_for_query(
+                spec.get('data_group'), spec.get('data_type'))
+        if bucket_config is None or not bucket_config.queryable:
+            raise QueryError('bucket not found', 404)
+
+        request_args = request_args_from(spec.get('query', {}))
+        for name in ['format', 'explain']:
+            if name in request_args:
+                raise QueryError('%s is not supported in a batch' % name, 400)
+        query = parse_query(bucket_config, request_args)
+        # raw results are read into memory, rather than streamed
+        max_raw_limit = app.config['BATCH_MAX_RAW_LIMIT']
+        if query.is_raw and not 0 < query.limit <= max_raw_limit:
+            raise QueryError('raw queries in a batch need a limit of at '
+                             'most %d' % max_raw_limit, 400)
+        version, _ = get_bucket_version(bucket_config)
+        _, result = run_query(bucket_config, version, query)
+        if isinstance(result, SimpleData):
+            result = result.data()
+
+        return {'status': 'ok', 'data': result}
+    except QueryError as e:
+        app.logger.error(e.message)
+        return {'status': 'error', 'code': e.status_code,
+                'message': e.message}
+    except Exception as e:
+        app.logger.exception(e)
+        return {'status': 'error', 'code': 500,
+                'message': 'Internal Server Error'}
+
+
+def request_args_from(params):
+    """Turn a dict of query parameters into request style arguments"""
+    if not isinstance(params, dict):
+        raise QueryError('invalid query', 400)
+    request_args = MultiDict()
+    for name, values in params.items():
+        if not isinstance(values, list):
+            values = [values]
+        for value in values:
+            request_args.add(name, unicode(value))
+    return request_args
+
+
+class QueryError(Exception):
+    def __init__(self, message, status_code):
+        super(QueryError, self).__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+def parse_query(bucket_config, request_args):
+    """Validate the request arguments of a query and parse them
+
+    Raises a QueryError for invalid queries.
+    """
+    request_args = ParsedRequestArgs(request_args)
+    result = validate_request_args(request_args,
+                                   bucket_config.raw_queries_allowed)
+
+    if not result.is_valid:
+        raise QueryError(result.message, 400)
+
+    return Query.parse(request_args)
+
+
+def get_bucket_version(bucket_config):
+    """The version of a bucket that is asked for, read as its records are
+
+    Only realtime buckets have their version read from the primary every
+    time; the versions of the others are cached briefly.
+    """
+    return bucket_versions.get(bucket_config.name,
+                               read_from_primary=bucket_config.realtime,
+                               cached=not bucket_config.realtime)
+
+
+def run_query(bucket_config, version, query):
+    """Run a query of a bucket that is at the given version
+
+    Returns the version the results are from, which is an earlier one for
+    stale cached results and for results read from a replica set member
+    that is behind, along with the SimpleData of a raw query, so
+    that it can be streamed, or the response data of any other query.
+    Identical queries that run at the same time share their results.
+    Raises a QueryError for queries that cannot be run on the bucket's
+    data.
+    """
+    bucket = Bucket(db, bucket_config)
+
+    def load():
+        # the version is read from the member that the records are read
+        # from, so that results are not tagged or cached with a version
+        # they predate
+        with db.pinned_reads():
+            loaded_version, _ = bucket_versions.get(
+                bucket_config.name, read_from_primary=bucket_config.realtime)
+            result = execute_query(bucket, query)
+            if isinstance(result, SimpleData):
+                # the cursor stays on the member its query is sent to
+                result.start()
+            else:
+                result = result.data()
+        return min(version, loaded_version), result
+
+    try:
+        if not query.is_raw:
+            if query_cache is not None:
+                return query_cache.get(bucket_config.name, version, query,
+                                       load)
+            return query_flights.do(
+                cache_key(bucket_config.name, version, query), load)
+
+        return load()
+    except InvalidOperationError:
+        raise QueryError('invalid collect for that data', 400)
+
+
+def execute_query(bucket, query):
+    query_shapes.record(bucket.bucket_name, query)
+    return bucket.query(query)
+
+
+def explain_allowed(bucket_config):
+    """Whether the bucket, or the caller's token, allows explaining"""
+    if bucket_config.name in app.config['EXPLAIN_BUCKETS']:
+        return True
+    authorization = request.headers.get('Authorization', '')
+    return authorization.startswith('Bearer ') and \
+        authorization[len('Bearer '):] in app.config['EXPLAIN_TOKENS']
+
+
+def explain_query(bucket_config, query):
+    """Run a query, bypassing the query cache, and describe how it ran
+
+    The response has the usual data along with an explanation of the
+    database operation, its query plan and the time taken by each stage.
+    """
+    explanation = explain.current()
+    bucket = Bucket(db, bucket_config)
+
+    try:
+        result = execute_query(bucket, query)
+        with explain.stage('read_documents' if query.is_raw else 'data'):
+            data = result.data()
+    except InvalidOperationError:
+        raise QueryError('invalid collect for that data', 400)
+
+    explanation.record(returned=len(data))
+
+    with explain.stage('encode'):
+        encoded = encode_json(data)
+
+    return Response('{"data":%s,"explain":%s}' % (
+        encoded, encode_json(explanation.as_dict())),
+        mimetype='application/json')
+
+
+def format_response(result, query, output_format):
+    """Make the response for the results of a query in the given format
+
+    Raw query results are streamed, in any format. CSV and newline
+    delimited JSON have nowhere after the data for the next page token, so
+    pages of raw results in them are read before the response is made and
+    the token is given in a Link header.
+    """
+    if output_format == 'json':
+        if isinstance(result, SimpleData):
+            return Response(stream_json(result), mimetype='application/json')
+        return json_response({'data': result})
+
+    next_page = None
+    if isinstance(result, SimpleData):
+        rows, columns = result, query.fields
+        if query.is_paged:
+            rows = result.data()
+            next_page = result.next_page()
+    else:
+        rows = list(formats.flatten(result))
+        columns = formats.columns_of(rows)
+
+    response = Response(formats.stream(output_format, rows, columns),
+                        mimetype=formats.MIMETYPES[output_format])
+    if next_page is not None:
+        response.headers['Link'] = '<%s>; rel="next"' % next_page_url(
+            next_page)
     return response
 
 
+def next_page_url(next_page):
+    args = request.args.copy()
+    args['after'] = next_page
+    return '%s?%s' % (request.base_url, url_encode(args))
+
+
+def json_response(data):
+    return Response(encode_json(data), mimetype='application/json')
+
+
+def stream_json(result):
+    """Encode raw query results as a JSON response one document at a time
+
+    The token for the next page, if there is one, follows the data as it is
+    only known once the last document has been read.
+    """
+    serialiser = JsonSerialiser()
+    yield '{"data": ['
+    for i, document in enumerate(result):
+        if i > 0:
+            yield ','
+        yield serialiser.encode(document)
+    yield ']'
+    next_page = result.next_page()
+    if next_page is not None:
+        yield ', "next": %s' % json.dumps(next_page)
+    yield '}'
+
+
 def start(port):
     app.debug = True
     app.run(host='0.0.0.0', port=port)
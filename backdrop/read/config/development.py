@@ -1,6 +1,24 @@
 DATABASE_NAME = "backdrop"
 MONGO_HOST = 'localhost'
 MONGO_PORT = 27017
+MONGO_REPLICA_SET = None
+MONGO_READ_PREFERENCE = "secondaryPreferred"
+MONGO_MAX_POOL_SIZE = 100
+BUCKET_CONFIG_CACHE_TTL = 60
+BUCKET_VERSION_CACHE_TTL = 1
+QUERY_ENGINE = "group"
+BATCH_THREADS = 8
+BATCH_MAX_QUERIES = 20
+BATCH_MAX_RAW_LIMIT = 1000
+QUERY_CACHE = "memory"
+QUERY_CACHE_SIZE = 1000
+QUERY_CACHE_PATH = "/tmp/backdrop_query_cache.db"
+QUERY_CACHE_STALE_WHILE_REVALIDATE = False
+QUERY_SHAPE_SAMPLE_RATE = 0.01
+GZIP_MIN_SIZE = 500
+GZIP_CACHE_SIZE = 1000
+EXPLAIN_BUCKETS = []
+EXPLAIN_TOKENS = []
 LOG_LEVEL = "DEBUG"
 RAW_QUERIES_ALLOWED = {
   "government_annotations": True,
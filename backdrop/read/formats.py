@@ -0,0 +1,117 @@
+"""
+CSV and newline delimited JSON output of query results
+
+Rows are written out as they are iterated over, so the documents of a raw
+query go straight from the cursor to the response. Grouped and period
+results are flattened to a row per group, or per period of each group.
+"""
+import csv
+import datetime
+import itertools
+from StringIO import StringIO
+from bson import ObjectId
+from backdrop.read.serialiser import JsonSerialiser
+
+MIMETYPES = {
+    'json': 'application/json',
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+FORMATS = sorted(MIMETYPES)
+
+# rows are written out in chunks of about this many bytes
+CHUNK_SIZE = 8192
+
+
+def flatten(data):
+    """Flatten grouped or period results to one row each
+
+    The periods of a period grouped result each become a row, along with
+    the fields of their group, as do the subgroups of results grouped on
+    more than one field.
+    """
+    for group in data:
+        if 'values' in group or '_subgroup' in group:
+            nested = 'values' if 'values' in group else '_subgroup'
+            fields = [(key, value) for key, value in group.items()
+                      if key != nested]
+            for inner in flatten(group[nested]):
+                row = dict(fields)
+                row.update(inner)
+                yield row
+        else:
+            yield group
+
+
+def columns_of(rows):
+    """The columns needed for all of the rows, in order"""
+    return sorted(set(key for row in rows for key in row))
+
+
+def stream(output_format, rows, columns=None):
+    if output_format == 'csv':
+        return stream_csv(rows, columns)
+    if output_format == 'ndjson':
+        return stream_ndjson(rows)
+    raise ValueError("Unknown format {0}".format(output_format))
+
+
+def stream_csv(rows, columns=None):
+    """Write rows as CSV with a header
+
+    Without columns, the columns are those of the first row, and fields
+    that only later rows have are left out.
+    """
+    rows = iter(rows)
+    if columns is None:
+        first = next(rows, None)
+        if first is None:
+            return
+        columns = sorted(first)
+        rows = itertools.chain([first], rows)
+
+    serialiser = JsonSerialiser()
+    buf = StringIO()
+    writer = csv.writer(buf)
+    writer.writerow([_cell(column, serialiser) for column in columns])
+    for row in rows:
+        writer.writerow([_cell(row.get(column), serialiser)
+                         for column in columns])
+        if buf.tell() >= CHUNK_SIZE:
+            yield _drain(buf)
+    yield _drain(buf)
+
+
+def stream_ndjson(rows):
+    """Write rows as JSON objects, one to a line"""
+    serialiser = JsonSerialiser()
+    buf = StringIO()
+    for row in rows:
+        buf.write(serialiser.encode(row))
+        buf.write('\n')
+        if buf.tell() >= CHUNK_SIZE:
+            yield _drain(buf)
+    yield _drain(buf)
+
+
+def _drain(buf):
+    data = buf.getvalue()
+    buf.seek(0)
+    buf.truncate()
+    return data
+
+
+def _cell(value, serialiser):
+    if value is None:
+        return ''
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, (bool, float, list, dict)):
+        # the same representation as in JSON output
+        return serialiser.encode(value)
+    return value
@@ -0,0 +1,41 @@
+"""
+Tokens for paging through raw queries
+
+A token holds the _timestamp and _id of the last document of a page, so
+the next page starts straight after it.
+
+Tokens come from clients and their values go into a database query, so
+only a datetime, or no timestamp, and an ObjectId or scalar _id are
+accepted; anything else, such as a query operator, is not a valid token.
+"""
+import datetime
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from bson import json_util, ObjectId
+
+_ID_TYPES = (ObjectId, basestring, int, long, float)
+
+
+def encode_page_token(document):
+    return urlsafe_b64encode(json_util.dumps(
+        [document.get("_timestamp"), document["_id"]]))
+
+
+def decode_page_token(token):
+    """Return the _timestamp and _id held by a page token
+
+    Raises ValueError if the token is not one this module made.
+    """
+    try:
+        values = json_util.loads(urlsafe_b64decode(str(token)))
+    except (TypeError, ValueError):
+        raise ValueError("Invalid page token")
+    if not isinstance(values, list) or len(values) != 2:
+        raise ValueError("Invalid page token")
+
+    timestamp, _id = values
+    if timestamp is not None and \
+            not isinstance(timestamp, datetime.datetime):
+        raise ValueError("Invalid page token")
+    if isinstance(_id, bool) or not isinstance(_id, _ID_TYPES):
+        raise ValueError("Invalid page token")
+    return timestamp, _id
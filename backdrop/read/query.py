@@ -1,8 +1,10 @@
 from collections import namedtuple
 
 import pytz
+from backdrop.core import explain
 from backdrop.core.timeseries import parse_period
 from backdrop.core.timeutils import parse_time_as_utc
+from backdrop.read.request_args import ParsedRequestArgs
 from backdrop.read.response import *
 
 
@@ -17,13 +19,26 @@ def if_present(func, value):
 
 
 def parse_request_args(request_args):
+    """Parse valid request arguments into the arguments of a Query
+
+    Given ParsedRequestArgs, the timestamps and page token parsed while
+    validating them are used rather than being parsed again.
+    """
+    request_args = ParsedRequestArgs.wrap(request_args)
     args = dict()
 
-    args['start_at'] = if_present(parse_time_as_utc,
-                                  request_args.get('start_at'))
+    def parse_time(name):
+        if name not in request_args:
+            return None
+        timestamp = request_args.timestamp(name)
+        if timestamp is None:
+            # not a datetime string in the expected format
+            return parse_time_as_utc(request_args[name])
+        return parse_time_as_utc(timestamp)
+
+    args['start_at'] = parse_time('start_at')
 
-    args['end_at'] = if_present(parse_time_as_utc,
-                                request_args.get('end_at'))
+    args['end_at'] = parse_time('end_at')
 
     def boolify(value):
         return {
@@ -41,7 +56,8 @@ def parse_request_args(request_args):
     args['period'] = if_present(parse_period,
                                 request_args.get('period'))
 
-    args['group_by'] = request_args.get('group_by')
+    group_by = request_args.comma_separated('group_by')
+    args['group_by'] = group_by[0] if len(group_by) == 1 else group_by or None
 
     args['sort_by'] = if_present(lambda sort_by: sort_by.split(':', 1),
                                  request_args.get('sort_by'))
@@ -55,12 +71,23 @@ def parse_request_args(request_args):
         else:
             args['collect'].append((collect_arg, 'default'))
 
+    args['fields'] = None
+    for fields_arg in request_args.getlist('fields'):
+        args['fields'] = (args['fields'] or []) + fields_arg.split(',')
+
+    args['after'] = None
+    if 'after' in request_args:
+        args['after'] = request_args.page_token()
+
+    args['sparse'] = request_args.get('sparse') == 'true'
+
     return args
 
 
 _Query = namedtuple(
     '_Query',
-    'start_at end_at filter_by period group_by sort_by limit collect'
+    'start_at end_at filter_by period group_by sort_by limit collect fields '
+    'after sparse'
 )
 
 
@@ -68,15 +95,39 @@ class Query(_Query):
     @classmethod
     def create(cls,
                start_at=None, end_at=None, filter_by=None, period=None,
-               group_by=None, sort_by=None, limit=None, collect=None):
+               group_by=None, sort_by=None, limit=None, collect=None,
+               fields=None, after=None, sparse=False):
         return Query(start_at, end_at, filter_by or [], period,
-                     group_by, sort_by, limit, collect or [])
+                     group_by, sort_by, limit, collect or [], fields, after,
+                     sparse)
 
     @classmethod
     def parse(cls, request_args):
         args = parse_request_args(request_args)
         return Query(**args)
 
+    @property
+    def group_by_keys(self):
+        """The fields grouped on, outermost first
+
+        group_by is either a single field or a list of them.
+        """
+        if not self.group_by:
+            return []
+        if isinstance(self.group_by, basestring):
+            return [self.group_by]
+        return list(self.group_by)
+
+    @property
+    def is_raw(self):
+        return not (self.group_by or self.period)
+
+    @property
+    def is_paged(self):
+        """Whether the results are a page that can be followed by another"""
+        return self.is_raw and bool(self.limit) and \
+            (not self.sort_by or self.sort_by[0] == "_timestamp")
+
     def to_mongo_query(self):
 
         mongo_query = {}
@@ -106,26 +157,43 @@ class Query(_Query):
 
     def __execute_period_group_query(self, repository):
         period_key = self.__get_period_key()
+        keys = self.group_by_keys
+
+        if len(keys) == 1:
+            cursor = repository.multi_group(
+                keys[0], period_key, self,
+                sort=self.sort_by, limit=self.limit,
+                collect=self.collect
+            )
+        else:
+            cursor = repository.nested_group(
+                keys + [period_key], self,
+                sort=self.sort_by, limit=self.limit,
+                collect=self.collect
+            )
 
-        cursor = repository.multi_group(
-            self.group_by, period_key, self,
-            sort=self.sort_by, limit=self.limit,
-            collect=self.collect
-        )
-
-        results = PeriodGroupedData(cursor, period=self.period)
+        with explain.stage("build_response"):
+            results = PeriodGroupedData(cursor, period=self.period)
 
         if self.start_at and self.end_at:
-            results.fill_missing_periods(
-                self.start_at, self.end_at, collect=self.collect)
+            with explain.stage("fill_missing_periods"):
+                results.fill_missing_periods(
+                    self.start_at, self.end_at, collect=self.collect,
+                    sparse=self.sparse)
 
         return results
 
     def __execute_grouped_query(self, repository):
-        cursor = repository.group(self.group_by, self, self.sort_by,
-                                  self.limit, self.collect)
+        keys = self.group_by_keys
+        if len(keys) == 1:
+            cursor = repository.group(keys[0], self, self.sort_by,
+                                      self.limit, self.collect)
+        else:
+            cursor = repository.nested_group(keys, self, self.sort_by,
+                                             self.limit, self.collect)
 
-        results = GroupedData(cursor)
+        with explain.stage("build_response"):
+            results = GroupedData(cursor)
         return results
 
     def __execute_period_query(self, repository):
@@ -136,11 +204,13 @@ class Query(_Query):
             sort=sort, limit=self.limit, collect=self.collect
         )
 
-        results = PeriodData(cursor, period=self.period)
+        with explain.stage("build_response"):
+            results = PeriodData(cursor, period=self.period)
 
         if self.start_at and self.end_at:
-            results.fill_missing_periods(
-                self.start_at, self.end_at, collect=self.collect)
+            with explain.stage("fill_missing_periods"):
+                results.fill_missing_periods(
+                    self.start_at, self.end_at, collect=self.collect)
 
         return results
 
@@ -148,5 +218,6 @@ class Query(_Query):
         cursor = repository.find(
             self, sort=self.sort_by, limit=self.limit)
 
-        results = SimpleData(cursor)
+        results = SimpleData(cursor,
+                             page_size=self.limit if self.is_paged else None)
         return results
@@ -0,0 +1,63 @@
+"""
+The arguments of a read request, along with the values parsed from them
+
+Validation and Query.parse both look at the timestamps and page token of
+a request; each is parsed once here and the parsed value is shared.
+"""
+from backdrop.core.validation import parse_datetime_string
+from backdrop.read.page_token import decode_page_token
+
+
+class ParsedRequestArgs(object):
+    def __init__(self, request_args):
+        self.request_args = request_args
+        self._timestamps = {}
+        self._page_token = None
+
+    @classmethod
+    def wrap(cls, request_args):
+        if isinstance(request_args, cls):
+            return request_args
+        return cls(request_args)
+
+    def __contains__(self, name):
+        return name in self.request_args
+
+    def __getitem__(self, name):
+        return self.request_args[name]
+
+    def get(self, name, default=None):
+        return self.request_args.get(name, default)
+
+    def getlist(self, name):
+        if name not in self.request_args:
+            return []
+        if not hasattr(self.request_args, 'getlist'):
+            # a plain dict has one value for each argument
+            return [self.request_args[name]]
+        return self.request_args.getlist(name)
+
+    def keys(self):
+        return self.request_args.keys()
+
+    def comma_separated(self, name):
+        """The values of every argument with the name, split on commas"""
+        return [value for argument in self.getlist(name)
+                for value in argument.split(',')]
+
+    def timestamp(self, name):
+        """The argument as a datetime, or None if it is not a valid one"""
+        if name not in self._timestamps:
+            value = self.request_args.get(name)
+            self._timestamps[name] = \
+                parse_datetime_string(value) if value else None
+        return self._timestamps[name]
+
+    def page_token(self):
+        """The _timestamp and _id of the after token
+
+        Raises ValueError if it is not a valid token.
+        """
+        if self._page_token is None:
+            self._page_token = decode_page_token(self.request_args['after'])
+        return self._page_token
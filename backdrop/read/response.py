@@ -1,7 +1,9 @@
 import datetime
+import itertools
 import pytz
 from backdrop.core.nested_merge import collect_key
-from backdrop.core.timeseries import timeseries, PERIODS
+from backdrop.read.page_token import encode_page_token
+from backdrop.core.timeseries import timeseries, fill_timeseries, PERIODS
 from dateutil.relativedelta import relativedelta
 
 
@@ -25,19 +27,47 @@ def create_period_group(doc, period):
 
 
 class SimpleData(object):
-    def __init__(self, cursor):
-        self._data = []
-        for doc in cursor:
-            self.__add(doc)
-
-    def __add(self, document):
+    """Documents from a raw query, read from the cursor as they are needed
+
+    Iterating over the data goes through the cursor, so it can only be done
+    once when it is backed by a database cursor.
+    """
+    def __init__(self, cursor, page_size=None):
+        self._cursor = cursor
+        self._page_size = page_size
+        self._count = 0
+        self._last = None
+        self._started = []
+
+    def __iter__(self):
+        for document in itertools.chain(self._started, self._cursor):
+            self._count += 1
+            self._last = document
+            yield self.__fix_timezone(document)
+
+    def start(self):
+        """Send the query now, by reading the first document"""
+        self._cursor = iter(self._cursor)
+        self._started = list(itertools.islice(self._cursor, 1))
+
+    def next_page(self):
+        """A token for the page after this one, once it has been read
+
+        Returns None if the results are not paged or this page was not
+        full, so there is no page after it.
+        """
+        if self._page_size is None or self._count < self._page_size:
+            return None
+        return encode_page_token(self._last)
+
+    def __fix_timezone(self, document):
         if "_timestamp" in document:
             document["_timestamp"] = \
                 document["_timestamp"].replace(tzinfo=pytz.utc)
-        self._data.append(document)
+        return document
 
     def data(self):
-        return tuple(self._data)
+        return tuple(self)
 
 
 class PeriodData(object):
@@ -86,6 +116,11 @@ class GroupedData(object):
 
 
 class PeriodGroupedData(object):
+    """Groups with the values of each period in them
+
+    When grouped on more than one field, groups keep a `_subgroup` of the
+    groups of the next field, and only the innermost groups have values.
+    """
     def __init__(self, cursor, period):
         self._period = period
         self._data = []
@@ -95,30 +130,55 @@ class PeriodGroupedData(object):
     def _create_subgroup(self, subgroup):
         return create_period_group(subgroup, self._period)
 
-    def _add(self, group):
+    def _create_group(self, group):
         if '_subgroup' not in group:
             raise ValueError("Expected group to have key '_subgroup'")
 
+        subgroups = group["_subgroup"]
         datum = {}
-        datum['values'] = [
-            self._create_subgroup(subgroup) for subgroup in group["_subgroup"]]
+        if any('_subgroup' in subgroup for subgroup in subgroups):
+            datum['_subgroup'] = [
+                self._create_group(subgroup) for subgroup in subgroups]
+        else:
+            datum['values'] = [
+                self._create_subgroup(subgroup) for subgroup in subgroups]
         datum.update(
             (key, value) for key, value in group.items() if key != '_subgroup')
 
-        self._data.append(datum)
+        return datum
+
+    def _add(self, group):
+        self._data.append(self._create_group(group))
 
     def data(self):
         return tuple(self._data)
 
-    def fill_missing_periods(self, start_date, end_date, collect=None):
+    def fill_missing_periods(self, start_date, end_date, collect=None,
+                             sparse=False):
+        """Fill in the periods without values of every innermost group
+
+        When sparse, groups with values for less than half of the periods
+        are left with only those values.
+        """
         default = {"_count": 0}
         if collect:
             default.update((collect_key(k, v), None) for k, v in collect)
-        for i, _ in enumerate(self._data):
-            self._data[i]['values'] = timeseries(
-                start=start_date,
-                end=end_date,
-                period=self._period,
-                data=self._data[i]['values'],
-                default=default
-            )
+        groups = list(self._innermost_groups(self._data))
+        filled = fill_timeseries(
+            start=start_date,
+            end=end_date,
+            period=self._period,
+            series=[group['values'] for group in groups],
+            default=default,
+            sparse=sparse
+        )
+        for group, values in zip(groups, filled):
+            group['values'] = values
+
+    def _innermost_groups(self, groups):
+        for group in groups:
+            if '_subgroup' in group:
+                for subgroup in self._innermost_groups(group['_subgroup']):
+                    yield subgroup
+            else:
+                yield group
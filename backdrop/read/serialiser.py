@@ -0,0 +1,68 @@
+"""
+JSON encoding of read API responses
+
+Responses are encoded compactly so that the C encoder is used rather than
+the pure Python one that indenting falls back to. The C encoder still calls
+back into Python for every datetime and ObjectId, so datetimes are formatted
+once each: period and grouped data repeat the same _start_at and _end_at
+values on every group, so formatted timestamps are kept and looked up
+rather than formatted again.
+
+Formatting the datetimes in a copy of the data before encoding it, so that
+the encoder never calls back, was measured to be slower than the callbacks,
+as it copies every document in Python.
+"""
+import datetime
+import json
+from bson import ObjectId
+
+# bounds the formatted timestamps kept while streaming a large raw query
+MAX_TIMESTAMPS = 10000
+
+
+class JsonEncoder(json.JSONEncoder):
+    def default(self, obj):
+        if isinstance(obj, ObjectId):
+            return str(obj)
+        if isinstance(obj, datetime.datetime):
+            return obj.isoformat()
+        return json.JSONEncoder.default(self, obj)
+
+
+class JsonSerialiser(object):
+    """Encodes read API response data as JSON
+
+    A serialiser is meant for a single response; it is not thread safe.
+    """
+    def __init__(self, max_timestamps=MAX_TIMESTAMPS):
+        self._timestamps = {}
+        self._max_timestamps = max_timestamps
+        self._encoder = json.JSONEncoder(separators=(',', ':'),
+                                         default=self._default)
+
+    def encode(self, value):
+        return self._encoder.encode(value)
+
+    def _default(self, obj):
+        if isinstance(obj, datetime.datetime):
+            return self._format_timestamp(obj)
+        if isinstance(obj, ObjectId):
+            return str(obj)
+        raise TypeError(repr(obj) + " is not JSON serializable")
+
+    def _format_timestamp(self, timestamp):
+        # equal instants with different offsets are formatted differently;
+        # the offset comes first so naive and aware timestamps are never
+        # compared
+        key = (timestamp.utcoffset(), timestamp)
+        formatted = self._timestamps.get(key)
+        if formatted is None:
+            if len(self._timestamps) >= self._max_timestamps:
+                self._timestamps.clear()
+            formatted = self._timestamps[key] = timestamp.isoformat()
+        return formatted
+
+
+def encode_json(value):
+    """Encode read API response data as compact JSON"""
+    return JsonSerialiser().encode(value)
@@ -1,79 +1,79 @@
 from datetime import time
-from dateutil import parser
 import pytz
-import api
+from backdrop.core.nested_merge import PERCENTILE_METHOD, PICKED_METHODS
 from backdrop.core.timeseries import PERIODS
-from ..core.validation import value_is_valid_datetime_string, valid, \
-    invalid, key_is_valid
+from backdrop.read.formats import FORMATS
+from backdrop.read.request_args import ParsedRequestArgs
+from ..core.validation import valid, invalid, key_is_valid
 import re
 
+COLLECT_METHODS = ["sum", "count", "set", "mean"] + PICKED_METHODS
+
 
 class Validator(object):
-    def __init__(self, request_args, **context):
+    """A check of the arguments of read requests
+
+    Validators are made once, with their context, and check the arguments
+    of each request in turn. Making one with request_args checks those
+    arguments straight away.
+    """
+    def __init__(self, request_args=None, **context):
+        self.context = context
         self.errors = []
-        self.validate(request_args, context)
+        if request_args is not None:
+            self.errors = self.check(ParsedRequestArgs.wrap(request_args))
 
     def invalid(self):
         return len(self.errors) > 0
 
-    def add_error(self, message):
-        self.errors.append(invalid(message))
+    def check(self, request_args):
+        """The errors in the arguments, as invalid results"""
+        return [invalid(message)
+                for message in self.validate(request_args, self.context)]
 
     def validate(self, request_args, context):
+        """Generate the error messages for the arguments"""
         raise NotImplementedError
 
 
-class MultiValueValidator(Validator):
-    def param_name(self, context):
-        return context.get('param_name')
-
-    def validate_field_value(self, context):
-        return context.get('validate_field_value')
-
-    def validate(self, request_args, context):
-        if self.param_name(context) in request_args:
-            validate_field_value = self.validate_field_value(context)
-            for value in request_args.getlist(self.param_name(context)):
-                validate_field_value(value, request_args, context)
-
-
 class ParameterValidator(Validator):
-    def __init__(self, request_args):
-        self.allowed_parameters = set([
-            'start_at',
-            'end_at',
-            'filter_by',
-            'period',
-            'group_by',
-            'sort_by',
-            'limit',
-            'collect'
-        ])
-        super(ParameterValidator, self).__init__(request_args)
+    allowed_parameters = frozenset([
+        'start_at',
+        'end_at',
+        'filter_by',
+        'period',
+        'group_by',
+        'sort_by',
+        'limit',
+        'collect',
+        'fields',
+        'after',
+        'format',
+        'explain',
+        'sparse'
+    ])
 
     def _unrecognised_parameters(self, request_args):
         return set(request_args.keys()) - self.allowed_parameters
 
     def validate(self, request_args, context):
         if len(self._unrecognised_parameters(request_args)) > 0:
-            self.add_error("An unrecognised parameter was provided")
+            yield "An unrecognised parameter was provided"
 
 
 class DatetimeValidator(Validator):
     def validate(self, request_args, context):
         if context['param_name'] in request_args:
-            if not value_is_valid_datetime_string(
-                    request_args[context['param_name']]):
-                self.add_error('%s is not a valid datetime'
-                               % context['param_name'])
+            if request_args.timestamp(context['param_name']) is None:
+                yield '%s is not a valid datetime' % context['param_name']
 
 
 class PeriodQueryValidator(Validator):
     def validate(self, request_args, context):
         if 'start_at' in request_args or 'end_at' in request_args:
             if not ('start_at' in request_args and 'end_at' in request_args):
-                self.add_error("both 'start_at' and 'end_at' are required "
-                               "for a period query")
+                yield ("both 'start_at' and 'end_at' are required "
+                       "for a period query")
 
 
 class PositiveIntegerValidator(Validator):
@@ -83,37 +83,27 @@ class PositiveIntegerValidator(Validator):
                 if int(request_args[context['param_name']]) < 0:
                     raise ValueError()
             except ValueError:
-                self.add_error("%s must be a positive integer"
-                               % context['param_name'])
+                yield "%s must be a positive integer" % context['param_name']
 
 
 class FilterByValidator(Validator):
     def validate(self, request_args, context):
-        MultiValueValidator(
-            request_args,
-            param_name='filter_by',
-            validate_field_value=self.validate_field_value)
-
-    def validate_field_value(self, value, request_args, context):
-        if value.find(':') < 0:
-            self.add_error(
-                'filter_by must be a field name and value separated by '
-                'a colon (:) eg. authority:Westminster')
-        if not key_is_valid(value.split(':', 1)[0]):
-            self.add_error(
-                'Cannot filter by an invalid field name'
-            )
-        if value.startswith('$'):
-            self.add_error(
-                'filter_by must not start with a $')
+        for value in request_args.getlist('filter_by'):
+            if value.find(':') < 0:
+                yield ('filter_by must be a field name and value separated '
+                       'by a colon (:) eg. authority:Westminster')
+            if not key_is_valid(value.split(':', 1)[0]):
+                yield 'Cannot filter by an invalid field name'
+            if value.startswith('$'):
+                yield 'filter_by must not start with a $'
 
 
 class ParameterMustBeThisValidator(Validator):
     def validate(self, request_args, context):
         if context['param_name'] in request_args:
             if request_args[context['param_name']] != context['must_be_this']:
-                self.add_error('Unrecognised grouping for period. '
-                               'Supported periods include: week')
+                yield ('Unrecognised grouping for period. '
+                       'Supported periods include: week')
 
 
 class ParameterMustBeOneOfTheseValidator(Validator):
@@ -123,41 +113,45 @@ class ParameterMustBeOneOfTheseValidator(Validator):
 
         if param_to_check in request_args:
             if request_args[param_to_check] not in allowed_params:
-                self.add_error("'{param}' must be one of {allowed}".format(
+                yield "'{param}' must be one of {allowed}".format(
                     param=param_to_check,
                     allowed=str(allowed_params)
-                ))
+                )
 
 
 class SortByValidator(Validator):
+    DIRECTION = re.compile(r'^.+:(ascending|descending)$')
+
     def _unrecognised_direction(self, sort_by):
-        return not re.match(r'^.+:(ascending|descending)$', sort_by)
+        return not self.DIRECTION.match(sort_by)
 
     def validate(self, request_args, context):
         if 'sort_by' in request_args:
             if 'period' in request_args and 'group_by' not in request_args:
-                self.add_error("Cannot sort for period queries without "
-                               "group_by. Period queries are always sorted "
-                               "by time.")
+                yield ("Cannot sort for period queries without "
+                       "group_by. Period queries are always sorted "
+                       "by time.")
             if request_args['sort_by'].find(':') < 0:
-                self.add_error(
-                    'sort_by must be a field name and sort direction separated'
-                    ' by a colon (:) eg. authority:ascending')
+                yield ('sort_by must be a field name and sort direction '
+                       'separated by a colon (:) eg. authority:ascending')
             if self._unrecognised_direction(request_args['sort_by']):
-                self.add_error('Unrecognised sort direction. Supported '
-                               'directions include: ascending, descending')
+                yield ('Unrecognised sort direction. Supported '
+                       'directions include: ascending, descending')
             if not key_is_valid(request_args['sort_by'].split(':', 1)[0]):
-                self.add_error('Cannot sort by an invalid field name')
+                yield 'Cannot sort by an invalid field name'
 
 
 class GroupByValidator(Validator):
     def validate(self, request_args, context):
-        if 'group_by' in request_args:
-            if not key_is_valid(request_args['group_by']):
-                self.add_error('Cannot group by an invalid field name')
-            if request_args['group_by'].startswith('_'):
-                self.add_error('Cannot group by internal fields, '
-                               'internal fields start with an underscore')
+        group_by = request_args.comma_separated('group_by')
+        for field in group_by:
+            if not key_is_valid(field):
+                yield 'Cannot group by an invalid field name'
+            if field.startswith('_'):
+                yield ('Cannot group by internal fields, '
+                       'internal fields start with an underscore')
+        if len(set(group_by)) != len(group_by):
+            yield 'Cannot group by the same field twice'
 
 
 class ParamDependencyValidator(Validator):
@@ -165,33 +159,61 @@ class ParamDependencyValidator(Validator):
         if context['param_name'] in request_args:
             if all(param not in request_args
                    for param in context['depends_on']):
-                self.add_error(
-                    '%s can be use only with either %s'
-                    % (context['param_name'], context['depends_on']))
+                yield '%s can be use only with either %s' % (
+                    context['param_name'], context['depends_on'])
 
 
 class CollectValidator(Validator):
     def validate(self, request_args, context):
-        MultiValueValidator(
-            request_args,
-            param_name='collect',
-            validate_field_value=self.validate_field_value)
-
-    def validate_field_value(self, value, request_args, _):
-        if ":" in value:
-            value, operator = value.split(":")
-            if operator not in ["sum", "count", "set", "mean"]:
-                self.add_error("Unknown collection method")
-
-        if not key_is_valid(value):
-            self.add_error('Cannot collect an invalid field name')
-        if value.startswith('_'):
-            self.add_error('Cannot collect internal fields, '
-                           'internal fields start '
-                           'with an underscore')
-        if value == request_args.get('group_by'):
-            self.add_error("Cannot collect by a field that is "
-                           "used for group_by")
+        for value in request_args.getlist('collect'):
+            if ":" in value:
+                value, operator = value.split(":")
+                if operator not in COLLECT_METHODS and \
+                        not PERCENTILE_METHOD.match(operator):
+                    yield "Unknown collection method"
+
+            if not key_is_valid(value):
+                yield 'Cannot collect an invalid field name'
+            if value.startswith('_'):
+                yield ('Cannot collect internal fields, '
+                       'internal fields start '
+                       'with an underscore')
+            if value in request_args.comma_separated('group_by'):
+                yield ("Cannot collect by a field that is "
+                       "used for group_by")
+
+
+class FieldsValidator(Validator):
+    def validate(self, request_args, context):
+        for value in request_args.getlist('fields'):
+            if 'group_by' in request_args or 'period' in request_args:
+                yield 'fields can only be used for raw queries'
+            for field in value.split(','):
+                if not key_is_valid(field):
+                    yield 'Cannot select an invalid field name'
+
+
+class AfterValidator(Validator):
+    def validate(self, request_args, context):
+        if 'after' not in request_args:
+            return
+        if 'group_by' in request_args or 'period' in request_args:
+            yield 'after can only be used for raw queries'
+        sort_by = request_args.get('sort_by')
+        if sort_by is not None and sort_by.split(':')[0] != '_timestamp':
+            yield 'after can only be used when sorting by _timestamp'
+        try:
+            request_args.page_token()
+        except ValueError:
+            yield 'after is not a valid page token'
+
+
+class SparseValidator(Validator):
+    def validate(self, request_args, context):
+        if 'sparse' not in request_args:
+            return
+        if 'group_by' not in request_args or 'period' not in request_args:
+            yield 'sparse can only be used with both group_by and period'
 
 
 class RawQueryValidator(Validator):
@@ -204,93 +226,113 @@ class RawQueryValidator(Validator):
 
     def validate(self, request_args, context):
         if self._is_a_raw_query(request_args):
-            self.add_error("querying for raw data is not allowed")
-
-
-def _is_valid_date(string):
-    return string and value_is_valid_datetime_string(string)
+            yield "querying for raw data is not allowed"
 
 
 class TimeSpanValidator(Validator):
     def validate(self, request_args, context):
-        if self._is_valid_date_query(request_args):
-            start_at = parser.parse(request_args['start_at'])
-            end_at = parser.parse(request_args['end_at'])
+        if request_args.get('period') == 'hour':
+            return
+        start_at = request_args.timestamp('start_at')
+        end_at = request_args.timestamp('end_at')
+        if start_at is not None and end_at is not None:
             delta = end_at - start_at
             if delta.days < context['length']:
-                self.add_error('The minimum time span for a query is 7 days')
-
-    def _is_valid_date_query(self, request_args):
-        return _is_valid_date(request_args.get('start_at')) \
-            and _is_valid_date(request_args.get('end_at')) \
-            and request_args.get('period') != 'hour'
+                yield 'The minimum time span for a query is 7 days'
 
 
 class MidnightValidator(Validator):
     def validate(self, request_args, context):
-        timestamp = request_args.get(context['param_name'])
-        if _is_valid_date(timestamp) and request_args.get('period') != 'hour':
-            dt = parser.parse(timestamp).astimezone(pytz.UTC)
-            if dt.time() != time(0):
-                self.add_error('%s must be midnight' % context['param_name'])
+        timestamp = request_args.timestamp(context['param_name'])
+        if timestamp is not None and request_args.get('period') != 'hour':
+            if timestamp.astimezone(pytz.UTC).time() != time(0):
+                yield '%s must be midnight' % context['param_name']
 
 
 class MondayValidator(Validator):
     def validate(self, request_args, context):
         if request_args.get('period') == 'week':
-            timestamp = request_args.get(context['param_name'])
-            if _is_valid_date(timestamp):
-                if (parser.parse(timestamp)).weekday() != 0:
-                    self.add_error('%s must be a monday'
-                                   % context['param_name'])
+            timestamp = request_args.timestamp(context['param_name'])
+            if timestamp is not None and timestamp.weekday() != 0:
+                yield '%s must be a monday' % context['param_name']
 
 
 class FirstOfMonthValidator(Validator):
     def validate(self, request_args, context):
-
         if request_args.get('period') == 'month':
-            timestamp = request_args.get(context['param_name'])
-            if _is_valid_date(timestamp):
-                if (parser.parse(timestamp)).day != 1:
-                    self.add_error('\'%s\' must be the first of the month for '
-                                   'period=month queries'
-                                   % context['param_name'])
+            timestamp = request_args.timestamp(context['param_name'])
+            if timestamp is not None and timestamp.day != 1:
+                yield ('\'%s\' must be the first of the month for '
+                       'period=month queries' % context['param_name'])
 
 
-def validate_request_args(request_args, raw_queries_allowed=False):
+def _compile(raw_queries_allowed):
+    """The validators for requests to buckets that do or do not allow raw
+    queries, in the order that they are checked in"""
     validators = [
-        ParameterValidator(request_args),
-        PeriodQueryValidator(request_args),
-        DatetimeValidator(request_args, param_name='start_at'),
-        DatetimeValidator(request_args, param_name='end_at'),
-        FilterByValidator(request_args),
+        ParameterValidator(),
+        PeriodQueryValidator(),
+        DatetimeValidator(param_name='start_at'),
+        DatetimeValidator(param_name='end_at'),
+        FilterByValidator(),
         ParameterMustBeOneOfTheseValidator(
-            request_args,
             param_name='period',
             must_be_one_of_these=[period.name for period in PERIODS]
         ),
-        SortByValidator(request_args),
-        GroupByValidator(request_args),
-        PositiveIntegerValidator(request_args, param_name='limit'),
-        ParamDependencyValidator(request_args, param_name='collect',
+        ParameterMustBeOneOfTheseValidator(
+            param_name='format',
+            must_be_one_of_these=FORMATS
+        ),
+        ParameterMustBeOneOfTheseValidator(
+            param_name='explain',
+            must_be_one_of_these=['true']
+        ),
+        ParameterMustBeOneOfTheseValidator(
+            param_name='sparse',
+            must_be_one_of_these=['true']
+        ),
+        SortByValidator(),
+        GroupByValidator(),
+        PositiveIntegerValidator(param_name='limit'),
+        ParamDependencyValidator(param_name='collect',
                                  depends_on=['group_by', 'period']),
-        CollectValidator(request_args),
+        CollectValidator(),
+        FieldsValidator(),
+        AfterValidator(),
+        SparseValidator(),
     ]
 
     if not raw_queries_allowed:
         validators += [
-            RawQueryValidator(request_args),
-            TimeSpanValidator(request_args, length=7),
-            MidnightValidator(request_args, param_name='start_at'),
-            MidnightValidator(request_args, param_name='end_at'),
-            MondayValidator(request_args, param_name="start_at"),
-            MondayValidator(request_args, param_name="end_at"),
-            FirstOfMonthValidator(request_args, param_name="start_at"),
-            FirstOfMonthValidator(request_args, param_name="end_at")
+            RawQueryValidator(),
+            TimeSpanValidator(length=7),
+            MidnightValidator(param_name='start_at'),
+            MidnightValidator(param_name='end_at'),
+            MondayValidator(param_name="start_at"),
+            MondayValidator(param_name="end_at"),
+            FirstOfMonthValidator(param_name="start_at"),
+            FirstOfMonthValidator(param_name="end_at")
         ]
 
-    for validator in validators:
-        if validator.invalid():
-            return validator.errors[0]
+    return validators
+
+
+VALIDATORS = {
+    True: _compile(raw_queries_allowed=True),
+    False: _compile(raw_queries_allowed=False),
+}
+
+
+def validate_request_args(request_args, raw_queries_allowed=False):
+    """Return the first error in the request arguments, or a valid result
+
+    The arguments may be ParsedRequestArgs, so that the values parsed
+    while validating them can be used to parse the query.
+    """
+    request_args = ParsedRequestArgs.wrap(request_args)
+    for validator in VALIDATORS[bool(raw_queries_allowed)]:
+        errors = validator.check(request_args)
+        if errors:
+            return errors[0]
 
     return valid()
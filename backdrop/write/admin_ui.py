@@ -3,6 +3,7 @@ from flask import flash, session, render_template, redirect, \
     request, abort
 from admin_ui_helper import url_for
 from backdrop.core.bucket import Bucket
+from backdrop.core.database import PartialWriteError
 from backdrop.core.errors import ParseError, ValidationError
 from backdrop.core.upload import create_parser
 from backdrop.core.upload.filters import first_sheet_filter
@@ -152,7 +153,8 @@ def setup(app, db, bucket_repository, user_repository):
         except (VirusSignatureError,
                 FileUploadException,
                 ParseError,
-                ValidationError) as e:
+                ValidationError,
+                PartialWriteError) as e:
             message = e.message
             app.logger.error(message)
             return _invalid_upload(message)
@@ -14,6 +14,7 @@ from backdrop.write import admin_ui
 
 from ..core.errors import ParseError, ValidationError
 from ..core import database, log_handler, cache_control
+from ..core.database import PartialWriteError
 
 from .validation import bearer_token_is_valid
 
@@ -41,10 +42,16 @@ app.config['USER_SCOPE'] = "/_user"
 db = database.Database(
     app.config['MONGO_HOST'],
     app.config['MONGO_PORT'],
-    app.config['DATABASE_NAME']
+    app.config['DATABASE_NAME'],
+    replica_set=app.config['MONGO_REPLICA_SET'],
+    read_preference=app.config['MONGO_READ_PREFERENCE'],
+    max_pool_size=app.config['MONGO_MAX_POOL_SIZE'],
+    bulk_write_chunk_size=app.config['BULK_WRITE_CHUNK_SIZE'],
+    ordered_bulk_writes=app.config['ORDERED_BULK_WRITES']
 )
 
-bucket_repository = BucketConfigRepository(db)
+bucket_repository = BucketConfigRepository(
+    db, cache_ttl=app.config['BUCKET_CONFIG_CACHE_TTL'])
 user_repository = UserConfigRepository(db)
 
 setup_logging()
@@ -110,6 +117,12 @@ def post_to_bucket(bucket_name):
         return jsonify(status='ok')
     except (ParseError, ValidationError) as e:
         return jsonify(status="error", message=str(e)), 400
+    except PartialWriteError as e:
+        statsd.incr("write_api.partial_write", bucket=g.bucket_name)
+        return jsonify(status="error", message=str(e),
+                       stored=e.stored,
+                       errors=[{"index": index, "message": message}
+                               for index, message in e.errors]), 400
 
 
 def load_json(data):
@@ -1,6 +1,12 @@
 DATABASE_NAME = "backdrop"
 MONGO_HOST = 'localhost'
 MONGO_PORT = 27017
+MONGO_REPLICA_SET = None
+MONGO_READ_PREFERENCE = "primary"
+MONGO_MAX_POOL_SIZE = 100
+BUCKET_CONFIG_CACHE_TTL = 60
+BULK_WRITE_CHUNK_SIZE = 1000
+ORDERED_BULK_WRITES = True
 LOG_LEVEL = "DEBUG"
 SINGLE_SIGN_ON = True
 SECRET_KEY = "something unique and secret"
@@ -1,6 +1,12 @@
 DATABASE_NAME = "backdrop_test"
 MONGO_HOST = 'localhost'
 MONGO_PORT = 27017
+MONGO_REPLICA_SET = None
+MONGO_READ_PREFERENCE = "primary"
+MONGO_MAX_POOL_SIZE = 100
+BUCKET_CONFIG_CACHE_TTL = 0
+BULK_WRITE_CHUNK_SIZE = 1000
+ORDERED_BULK_WRITES = True
 SINGLE_SIGN_ON = True
 SECRET_KEY = "something unique and secret"
 BACKDROP_ADMIN_UI_HOST = "http://backdrop-admin.dev.gov.uk"
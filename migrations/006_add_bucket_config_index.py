@@ -0,0 +1,13 @@
+"""
+Index bucket configs on data_group and data_type
+"""
+import logging
+import pymongo
+
+log = logging.getLogger(__name__)
+
+
+def up(db):
+    db["buckets"].ensure_index([("data_group", pymongo.ASCENDING),
+                                ("data_type", pymongo.ASCENDING)])
+    log.info("indexed buckets on data_group and data_type")
@@ -0,0 +1,20 @@
+"""
+Index all buckets on _timestamp and _id for paging through raw queries
+
+Buckets created from now on are indexed when they are created.
+"""
+import logging
+import pymongo
+
+log = logging.getLogger(__name__)
+
+
+def up(db):
+    collection_names = db.collection_names()
+    for bucket in db["buckets"].find({}, ["name"]):
+        name = bucket["name"]
+        if name not in collection_names:
+            continue
+        log.info("Indexing bucket: {0}".format(name))
+        db[name].ensure_index([("_timestamp", pymongo.ASCENDING),
+                               ("_id", pymongo.ASCENDING)])
@@ -1,13 +1,16 @@
 import json
 import os
+import sys
 from invoke import task
 from os import getenv
 from backdrop.core import database
 from backdrop.core.user import UserConfig
 from backdrop.write.api import app
-from backdrop.core.bucket import BucketConfig
+from backdrop.core.bucket import Bucket, BucketConfig
+from backdrop.core.index_advisor import QueryShapes, build_indexes
 from backdrop.core.repository import BucketConfigRepository,\
     UserConfigRepository
+from backdrop.read.query import Query
 
 
 def environment():
@@ -21,14 +24,22 @@ def get_database():
     return database.Database(
         app.config['MONGO_HOST'],
         app.config['MONGO_PORT'],
-        app.config['DATABASE_NAME']
+        app.config['DATABASE_NAME'],
+        replica_set=app.config['MONGO_REPLICA_SET']
     )
 
 
+def retrieve_bucket_config(repository, name):
+    config = repository.retrieve(name)
+    if config is None:
+        sys.exit("There is no bucket named {0}".format(name))
+    return config
+
+
 @task
 def create_bucket(name, datagroup, datatype, rawqueries=False, token=None,
                   autoids=None, uploadformat=None, uploadfilters=None,
-                  queryable=True, realtime=False):
+                  queryable=True, realtime=False, queryengine=None):
     """Create a new bucket configuration in the database."""
     db = get_database()
 
@@ -36,12 +47,52 @@ def create_bucket(name, datagroup, datatype, rawqueries=False, token=None,
                           raw_queries_allowed=rawqueries, bearer_token=token,
                           upload_format=uploadformat,
                           upload_filters=uploadfilters, auto_ids=autoids,
-                          queryable=queryable, realtime=realtime)
+                          queryable=queryable, realtime=realtime,
+                          query_engine=queryengine)
     repository = BucketConfigRepository(db)
 
     repository.save(config)
 
 
+@task
+def rebuild_rollups(name):
+    """Recalculate the period rollups of a bucket from its records.
+
+    Writes to the bucket must be stopped while the rollups are rebuilt.
+    Run this when the rollups have been logged as needing rebuilding; they
+    are not used for queries until they are.
+    """
+    db = get_database()
+
+    config = retrieve_bucket_config(BucketConfigRepository(db), name)
+    if not config.rollups:
+        sys.exit("Bucket {0} does not keep rollups".format(name))
+    bucket = Bucket(db, config)
+
+    bucket.rebuild_rollups(bucket.repository.find(Query.create()))
+
+
+@task
+def index_buckets(name=None, mincount=10):
+    """Build indexes for the queries commonly made of buckets."""
+    db = get_database()
+
+    repository = BucketConfigRepository(db)
+    shapes = QueryShapes(db)
+    if name is None:
+        names = [bucket["name"] for bucket in
+                 db.get_collection("buckets").find({}, ["name", "ascending"],
+                                                   None, ["name"])]
+    else:
+        names = [name]
+
+    for bucket_name in names:
+        config = retrieve_bucket_config(repository, bucket_name)
+        indexes = build_indexes(db, config, shapes, int(mincount))
+        repository.save(config._replace(indexes=indexes),
+                        create_bucket=False)
+
+
 @task
 def allow_access(email, bucket):
     """Give a user access to a bucket."""
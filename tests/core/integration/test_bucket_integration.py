@@ -78,3 +78,40 @@ class TestBucketIntegration(unittest.TestCase):
             has_entry('_start_at', d_tz(2013, 1, 28)),
             has_entry('_start_at', d_tz(2013, 2, 25))
         ))
+
+
+class TestBucketRollupsIntegration(unittest.TestCase):
+    def setUp(self):
+        self.db = database.Database(HOST, PORT, DB_NAME)
+        self.bucket = bucket.Bucket(self.db, BucketConfig(
+            BUCKET, data_group="group", data_type="type",
+            rollups={"fields": ["value"], "group_by": ["channel"]}))
+        self.mongo_database = MongoClient(HOST, PORT)[DB_NAME]
+
+    def tearDown(self):
+        self.mongo_database[BUCKET].drop()
+        self.mongo_database["_rollups_" + BUCKET].drop()
+
+    def answers(self, query):
+        return (query.execute(self.bucket.rollups).data(),
+                query.execute(self.bucket.repository).data())
+
+    def test_records_stored_again_are_not_counted_twice(self):
+        self.bucket.store([
+            Record({"_id": "a", "_timestamp": d_tz(2013, 4, 2),
+                    "channel": "web", "value": 5}),
+            Record({"_id": "b", "_timestamp": d_tz(2013, 4, 3),
+                    "channel": "web", "value": 1}),
+        ])
+        self.bucket.store(
+            Record({"_id": "a", "_timestamp": d_tz(2013, 4, 9),
+                    "channel": "phone", "value": 7}))
+
+        query = Query.create(period=WEEK, group_by="channel",
+                             collect=[("value", "sum")])
+        from_rollups, from_records = self.answers(query)
+
+        assert_that(from_rollups, is_(from_records))
+        assert_that(from_rollups, contains(
+            has_entries({"channel": "phone", "_count": 1, "value:sum": 7}),
+            has_entries({"channel": "web", "_count": 1, "value:sum": 1})))
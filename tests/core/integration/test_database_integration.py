@@ -4,6 +4,7 @@ from abc import ABCMeta
 from hamcrest import *
 from pymongo import MongoClient
 
+from backdrop.core import sketch
 from backdrop.core.database import Repository, GroupingError, \
     InvalidSortError, MongoDriver, Database
 from backdrop.read.query import Query
@@ -44,6 +45,21 @@ class TestMongoDriver(unittest.TestCase):
 
         assert_that(saved_documents, only_contains(updated_document))
 
+    def test_save_all(self):
+        self.mongo_driver.save({"_id": "event1", "title": "I'm an event"})
+
+        stored, errors = self.mongo_driver.save_all([
+            {"_id": "event1", "title": "I'm another event"},
+            {"_id": "event2", "title": "I'm a new event"},
+        ])
+
+        assert_that(stored, is_(2))
+        assert_that(errors, is_([]))
+        assert_that(self.mongo_collection.find(), contains_inanyorder(
+            {"_id": "event1", "title": "I'm another event"},
+            {"_id": "event2", "title": "I'm a new event"},
+        ))
+
     def test_find_one(self):
         self._setup_people()
 
@@ -221,12 +237,101 @@ class TestMongoDriver(unittest.TestCase):
             {"instrument": "cello", "type": "string", "range": "low"})
 
 
+class TestMongoDriverAggregate(unittest.TestCase):
+    def setUp(self):
+        self.mongo_driver = MongoDriver(MongoClient(HOST, PORT)[DB_NAME][BUCKET])
+
+        self.mongo_collection = MongoClient(HOST, PORT)[DB_NAME][BUCKET]
+        self.mongo_collection.drop()
+
+    def test_aggregate(self):
+        self._setup_musical_instruments()
+
+        results = self.mongo_driver.aggregate(keys=["type"], query={},
+                                              collect_fields=[])
+
+        assert_that(results, contains_inanyorder(
+            {"_count": 2, "type": "wind"},
+            {"_count": 3, "type": "string"}
+        ))
+
+    def test_aggregate_and_collect_additional_properties(self):
+        self._setup_musical_instruments()
+        self.mongo_collection.save({"instrument": "triangle",
+                                    "type": "percussion"})
+
+        results = self.mongo_driver.aggregate(keys=["type"], query={},
+                                              collect_fields=["range"])
+
+        assert_that(results, contains_inanyorder(
+            has_entries({"_count": 2, "type": "wind",
+                         "range": contains_inanyorder("high", "low")}),
+            has_entries({"_count": 3, "type": "string",
+                         "range": contains_inanyorder("high", "high", "low")}),
+            has_entries({"_count": 1, "type": "percussion", "range": []}),
+        ))
+
+    def test_aggregate_with_sort_and_limit(self):
+        self._setup_musical_instruments()
+
+        results = self.mongo_driver.aggregate(keys=["type"], query={},
+                                              collect_fields=[],
+                                              sort=["_count", "descending"],
+                                              limit=1)
+
+        assert_that(results, contains(
+            has_entries({"_count": 3, "type": "string"})
+        ))
+
+    def test_aggregate_sketches_the_same_as_group(self):
+        self._setup_musical_instruments()
+        for size in [0, -2, 3L, 3.5, 1000, "big"]:
+            self.mongo_collection.save({"type": "wind", "size": size})
+
+        aggregated = self.mongo_driver.aggregate(
+            keys=["type"], query={}, collect_fields=["range"],
+            summaries=[("size", "sketch")])
+        grouped = self.mongo_driver.group(
+            keys=["type"], query={}, collect_fields=["range"],
+            summaries=[("size", "sketch")])
+
+        for results in [aggregated, grouped]:
+            for result in results:
+                result["range"].sort()
+                result["_sketch:size"] = sketch.merge(
+                    [result["_sketch:size"]])
+        assert_that(aggregated, contains_inanyorder(*grouped))
+
+    def test_aggregate_ignores_documents_without_grouping_keys(self):
+        self._setup_musical_instruments()
+        self.mongo_collection.save({"instrument": "kazoo"})
+
+        results = self.mongo_driver.aggregate(keys=["type"], query={},
+                                              collect_fields=[])
+
+        assert_that(results, has_length(2))
+
+    def _setup_musical_instruments(self):
+        self.mongo_collection.save(
+            {"instrument": "flute", "type": "wind", "range": "high"})
+        self.mongo_collection.save(
+            {"instrument": "contrabassoon", "type": "wind", "range": "low"})
+        self.mongo_collection.save(
+            {"instrument": "violin", "type": "string", "range": "high"})
+        self.mongo_collection.save(
+            {"instrument": "viola", "type": "string", "range": "high"})
+        self.mongo_collection.save(
+            {"instrument": "cello", "type": "string", "range": "low"})
+
+
 class RepositoryIntegrationTest(unittest.TestCase):
     __metaclass__ = ABCMeta
 
+    query_engine = "group"
+
     def setUp(self):
         mongo = MongoDriver(MongoClient(HOST, PORT)[DB_NAME][BUCKET])
-        self.repo = Repository(mongo)
+        self.repo = Repository(mongo, query_engine=self.query_engine)
 
         self.mongo_collection = MongoClient(HOST, PORT)[DB_NAME][BUCKET]
         self.mongo_collection.drop()
@@ -496,6 +601,11 @@ class TestRepositoryIntegration_Grouping(RepositoryIntegrationTest):
             ))
 
 
+class TestRepositoryIntegration_GroupingWithAggregation(
+        TestRepositoryIntegration_Grouping):
+    query_engine = "aggregate"
+
+
 class TestRepositoryIntegration_MultiGroupWithMissingFields(RepositoryIntegrationTest):
     def test_query_for_data_with_different_missing_fields_no_results(self):
         self.mongo_collection.save({
@@ -733,6 +843,11 @@ class TestRepositoryIntegration_Sorting(RepositoryIntegrationTest):
         assert_that(result, has_item(has_entry("_count", 1)))
 
 
+class TestRepositoryIntegration_SortingWithAggregation(
+        TestRepositoryIntegration_Sorting):
+    query_engine = "aggregate"
+
+
 class TestDatabase(unittest.TestCase):
     def setUp(self):
         self.db = Database('localhost', 27017, 'backdrop_test')
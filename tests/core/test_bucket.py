@@ -2,9 +2,11 @@ import unittest
 from hamcrest import *
 from hamcrest import assert_that, is_
 from nose.tools import *
-from mock import Mock, call
+from mock import Mock
 from backdrop.core import bucket
 from backdrop.core.bucket import BucketConfig
+from pymongo.errors import AutoReconnect
+from backdrop.core.database import PartialWriteError
 from backdrop.core.records import Record
 from backdrop.read.query import Query
 from backdrop.core.timeseries import WEEK, MONTH
@@ -51,12 +53,27 @@ class TestBucket(unittest.TestCase):
 
         self.bucket.store(my_records)
 
-        self.mock_repository.save.assert_has_calls([
-            call({'name': "Groucho"}),
-            call({"name": "Harpo"}),
-            call({"name": "Chico"})
+        self.mock_repository.save_all.assert_called_once_with([
+            {'name': "Groucho"},
+            {"name": "Harpo"},
+            {"name": "Chico"}
         ])
 
+    def test_realtime_buckets_are_read_from_the_primary(self):
+        bucket.Bucket(self.mock_database,
+                      BucketConfig("realtime_bucket", data_group="group",
+                                   data_type="type", realtime=True))
+
+        self.mock_database.get_repository.assert_called_with(
+            "realtime_bucket", None, read_from_primary=True)
+
+    def test_storing_bumps_the_bucket_version(self):
+        self.bucket.store([Record({"name": "Zeppo"})])
+
+        update = self.mock_database.get_collection.return_value.update
+        assert_that(update.call_args[0][0], is_({"_id": "test_bucket"}))
+        assert_that(update.call_args[0][1]["$inc"], is_({"version": 1}))
+
     def test_filter_by_query(self):
         self.bucket.query(Query.create(filter_by=[['name', 'Chico']]))
         self.mock_repository.find.assert_called_once()
@@ -621,3 +638,152 @@ class TestBucketConfig(object):
 
         bucket = BucketConfig("default", "group", "type", realtime=True)
         assert_that(bucket.max_age, is_(120))
+
+
+class TestBucketWithRollups(unittest.TestCase):
+    def setUp(self):
+        self.mock_repository = mock_repository()
+        self.mock_database = mock_database(self.mock_repository)
+        self.config = BucketConfig("test_bucket", data_group="group",
+                                   data_type="type",
+                                   rollups={"fields": ["value"]})
+        self.bucket = bucket.Bucket(self.mock_database, self.config)
+        self.bucket.rollups = Mock()
+        self.bucket.rollups.stored_records.return_value = {}
+        self.mock_repository.save_all.side_effect = self.save_in_chunks()
+
+    def save_in_chunks(self, chunk_size=2, fail_at=None, error=None):
+        """Write documents in chunks, as the repository does, until the
+        chunk at fail_at raises error"""
+        def save_all(documents, written):
+            for offset in range(0, len(documents), chunk_size):
+                if offset == fail_at:
+                    raise error
+                written(documents[offset:offset + chunk_size])
+        return save_all
+
+    def test_stored_records_are_added_to_the_rollups(self):
+        my_records = [Record({"value": 1}), Record({"value": 2})]
+
+        self.bucket.store(my_records)
+
+        self.bucket.rollups.update.assert_called_once_with(
+            [{"value": 1}, {"value": 2}], {})
+
+    def test_each_chunk_is_rolled_up_as_it_is_written(self):
+        self.bucket.store([Record({"value": i}) for i in range(3)])
+
+        assert_that(
+            [c[0][0] for c in self.bucket.rollups.update.call_args_list],
+            is_([[{"value": 0}, {"value": 1}], [{"value": 2}]]))
+
+    def test_records_stored_again_in_a_later_chunk_replace_the_first(self):
+        replaced = []
+        self.bucket.rollups.update.side_effect = \
+            lambda documents, stored: replaced.append(dict(stored))
+
+        self.bucket.store([Record({"_id": "a", "value": 1}),
+                           Record({"_id": "b", "value": 2}),
+                           Record({"_id": "a", "value": 3})])
+
+        assert_that(replaced[1]["a"], is_({"_id": "a", "value": 1}))
+
+    def test_rollups_are_dirty_when_a_write_fails_part_way(self):
+        self.mock_repository.save_all.side_effect = self.save_in_chunks(
+            fail_at=2, error=AutoReconnect())
+
+        assert_raises(AutoReconnect, self.bucket.store,
+                      [Record({"value": i}) for i in range(3)])
+
+        self.bucket.rollups.update.assert_called_once_with(
+            [{"value": 0}, {"value": 1}], {})
+        assert_that(self.bucket.rollups.mark_dirty.called, is_(True))
+
+    def test_rollups_are_dirty_when_they_cannot_be_updated(self):
+        self.bucket.rollups.update.side_effect = AutoReconnect()
+
+        assert_raises(AutoReconnect, self.bucket.store,
+                      Record({"value": 1}))
+
+        assert_that(self.bucket.rollups.mark_dirty.called, is_(True))
+
+    def test_replaced_records_are_read_before_storing(self):
+        self.bucket.rollups.stored_records.side_effect = \
+            lambda documents: {"saved": self.mock_repository.save.called}
+
+        self.bucket.store(Record({"_id": "a", "value": 1}))
+
+        assert_that(self.bucket.rollups.update.call_args[0][0],
+                    is_([{"_id": "a", "value": 1}]))
+        assert_that(self.bucket.rollups.update.call_args[0][1],
+                    has_entry("saved", False))
+
+    def test_records_that_were_not_stored_are_not_rolled_up(self):
+        self.mock_repository.save_all.side_effect = self.save_in_chunks(
+            fail_at=2, error=PartialWriteError(2, 3, [(2, "too big")]))
+
+        assert_raises(PartialWriteError, self.bucket.store,
+                      [Record({"value": i}) for i in range(3)])
+
+        self.bucket.rollups.update.assert_called_once_with(
+            [{"value": 0}, {"value": 1}], {})
+        assert_that(self.bucket.rollups.mark_dirty.called, is_(False))
+
+    def test_queries_are_answered_from_rollups_when_they_can_be(self):
+        self.bucket.rollups.can_answer.return_value = True
+        self.bucket.rollups.group.return_value = []
+
+        self.bucket.query(Query.create(period=WEEK))
+
+        assert_that(self.bucket.rollups.group.called, is_(True))
+        assert_that(self.mock_repository.group.called, is_(False))
+
+    def test_queries_go_to_the_records_otherwise(self):
+        self.bucket.rollups.can_answer.return_value = False
+
+        self.bucket.query(Query.create(period=WEEK))
+
+        assert_that(self.bucket.rollups.group.called, is_(False))
+        assert_that(self.mock_repository.group.called, is_(True))
+
+    def test_rebuilding_rollups(self):
+        documents = iter([{"value": i} for i in range(5)])
+
+        self.bucket.rebuild_rollups(documents, chunk_size=2)
+
+        self.bucket.rollups.rebuild.assert_called_once_with(documents, 2)
+
+    def test_rollups_cannot_be_rebuilt_for_buckets_without_them(self):
+        self.bucket.rollups = None
+
+        assert_raises(ValueError, self.bucket.rebuild_rollups, iter([]))
+
+
+class TestBucketConfigRollups(unittest.TestCase):
+    def test_rollups_must_be_valid(self):
+        assert_raises(ValueError, BucketConfig, "name", "group", "type",
+                      rollups={"fields": ["$where"]})
+        assert_raises(ValueError, BucketConfig, "name", "group", "type",
+                      rollups={"wibble": ["value"]})
+
+    def test_rollups_are_not_kept_for_buckets_that_are_overwritten(self):
+        assert_raises(ValueError, BucketConfig, "name", "group", "type",
+                      auto_ids=["key"], rollups={"fields": ["value"]})
+        assert_raises(ValueError, BucketConfig, "name", "group", "type",
+                      realtime=True, rollups={"fields": ["value"]})
+
+
+class TestBucketConfigIndexes(unittest.TestCase):
+    def test_indexes_are_lists_of_field_names(self):
+        config = BucketConfig("name", "group", "type",
+                              indexes=[["name", "_timestamp"]])
+
+        assert_that(config.indexes, is_([["name", "_timestamp"]]))
+
+    def test_indexes_must_be_valid(self):
+        assert_raises(ValueError, BucketConfig, "name", "group", "type",
+                      indexes=["name"])
+        assert_raises(ValueError, BucketConfig, "name", "group", "type",
+                      indexes=[[]])
+        assert_raises(ValueError, BucketConfig, "name", "group", "type",
+                      indexes=[["$where"]])
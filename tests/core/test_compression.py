@@ -0,0 +1,112 @@
+import gzip
+import unittest
+from StringIO import StringIO
+from flask import Flask, Response
+from hamcrest import assert_that, is_
+from mock import Mock
+from werkzeug.http import unquote_etag
+from backdrop.core import cache_control
+from backdrop.core.compression import gzip_responses, gzip_bytes, \
+    gzip_stream
+from backdrop.core.query_cache import MemoryStore
+
+BODY = "x" * 1000
+
+
+def gunzip(data):
+    return gzip.GzipFile(fileobj=StringIO(data)).read()
+
+
+class TestGzipResponses(unittest.TestCase):
+    def setUp(self):
+        app = Flask(__name__)
+        self.store = MemoryStore(10)
+        app.after_request(gzip_responses(self.store, min_size=100))
+
+        @app.route('/big')
+        def big():
+            if cache_control.not_modified("big"):
+                response = Response(status=304)
+            else:
+                response = Response(BODY)
+            response.set_etag("big")
+            return response
+
+        @app.route('/streamed')
+        def streamed():
+            return Response(iter(["x"] * 10))
+
+        @app.route('/small')
+        def small():
+            return "x"
+
+        self.app = app.test_client()
+
+    def test_responses_are_compressed_for_clients_that_accept_gzip(self):
+        response = self.app.get('/big',
+                                headers=[('Accept-Encoding', 'gzip')])
+
+        assert_that(response.headers['Content-Encoding'], is_('gzip'))
+        assert_that(response.headers['Vary'], is_('Accept-Encoding'))
+        assert_that(gunzip(response.data), is_(BODY))
+
+    def test_responses_are_not_compressed_for_other_clients(self):
+        response = self.app.get('/big')
+
+        assert_that(response.headers.get('Content-Encoding'), is_(None))
+        assert_that(response.data, is_(BODY))
+
+    def test_small_responses_are_not_compressed(self):
+        response = self.app.get('/small',
+                                headers=[('Accept-Encoding', 'gzip')])
+
+        assert_that(response.headers.get('Content-Encoding'), is_(None))
+
+    def test_bodies_are_only_compressed_once(self):
+        self.store.set = Mock(wraps=self.store.set)
+
+        self.app.get('/big', headers=[('Accept-Encoding', 'gzip')])
+        response = self.app.get('/big', headers=[('Accept-Encoding', 'gzip')])
+
+        assert_that(self.store.set.call_count, is_(1))
+        assert_that(gunzip(response.data), is_(BODY))
+
+    def test_compressed_responses_have_a_weak_etag(self):
+        plain = self.app.get('/big')
+        compressed = self.app.get('/big',
+                                  headers=[('Accept-Encoding', 'gzip')])
+
+        assert_that(unquote_etag(compressed.headers['ETag']),
+                    is_((unquote_etag(plain.headers['ETag'])[0], True)))
+
+    def test_weak_etag_of_compressed_response_is_not_modified(self):
+        compressed = self.app.get('/big',
+                                  headers=[('Accept-Encoding', 'gzip')])
+
+        response = self.app.get('/big', headers=[
+            ('Accept-Encoding', 'gzip'),
+            ('If-None-Match', compressed.headers['ETag'])])
+
+        assert_that(response.status_code, is_(304))
+
+    def test_streamed_responses_are_compressed_as_they_are_sent(self):
+        response = self.app.get('/streamed',
+                                headers=[('Accept-Encoding', 'gzip')])
+
+        assert_that(response.headers['Content-Encoding'], is_('gzip'))
+        assert_that(response.headers.get('Content-Length'), is_(None))
+        assert_that(gunzip(response.data), is_("x" * 10))
+
+    def test_streamed_responses_are_not_compressed_for_other_clients(self):
+        response = self.app.get('/streamed')
+
+        assert_that(response.headers.get('Content-Encoding'), is_(None))
+        assert_that(response.data, is_("x" * 10))
+
+    def test_gzip_stream_encodes_unicode_chunks(self):
+        compressed = "".join(gzip_stream([u"caf\xe9", "s"]))
+
+        assert_that(gunzip(compressed), is_("caf\xc3\xa9s"))
+
+    def test_gzip_bytes_is_repeatable(self):
+        assert_that(gzip_bytes(BODY), is_(gzip_bytes(BODY)))
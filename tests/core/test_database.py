@@ -1,8 +1,14 @@
 import unittest
-from hamcrest import assert_that, is_
-from mock import Mock, patch
-from pymongo.errors import AutoReconnect
-from backdrop.core.database import Repository, InvalidSortError, MongoDriver
+from bson import ObjectId
+from hamcrest import assert_that, is_, has_entries, instance_of, \
+    contains_string
+from mock import Mock, patch, call, ANY
+from nose.tools import assert_raises
+from pymongo import ReadPreference
+from pymongo.errors import AutoReconnect, BulkWriteError
+from backdrop.core import explain, sketch
+from backdrop.core.database import Repository, InvalidSortError, GroupingError, \
+    MongoDriver, PartialWriteError, Database
 from backdrop.read.query import Query
 from tests.support.test_helpers import d_tz
 
@@ -33,6 +39,348 @@ class DatabaseTestCase(unittest.TestCase):
 
         assert_that(self.collection.save.call_count, is_(1))
 
+    def test_save_all_upserts_each_document_on_its_id(self):
+        bulk = self.collection.initialize_ordered_bulk_op.return_value
+        bulk.execute.return_value = {"nUpserted": 1, "nMatched": 1}
+
+        stored, errors = self.driver.save_all([{"_id": 1}, {"_id": 2}])
+
+        bulk.find.assert_has_calls([
+            call({"_id": 1}), call().upsert(),
+            call().upsert().replace_one({"_id": 1}),
+            call({"_id": 2}), call().upsert(),
+            call().upsert().replace_one({"_id": 2}),
+        ])
+        assert_that(bulk.execute.call_count, is_(1))
+        assert_that(stored, is_(2))
+        assert_that(errors, is_([]))
+
+    def test_save_all_can_be_unordered(self):
+        bulk = self.collection.initialize_unordered_bulk_op.return_value
+        bulk.execute.return_value = {"nUpserted": 1, "nMatched": 0}
+
+        self.driver.save_all([{"_id": 1}], ordered=False)
+
+        assert_that(bulk.execute.call_count, is_(1))
+        assert_that(self.collection.initialize_ordered_bulk_op.called,
+                    is_(False))
+
+    def test_save_all_reports_write_errors(self):
+        bulk = self.collection.initialize_ordered_bulk_op.return_value
+        bulk.execute.side_effect = BulkWriteError({
+            "nUpserted": 1, "nMatched": 0,
+            "writeErrors": [{"index": 1, "errmsg": "too big"}]
+        })
+
+        stored, errors = self.driver.save_all([{"_id": 1}, {"_id": 2}])
+
+        assert_that(stored, is_(1))
+        assert_that(errors, is_([(1, "too big")]))
+
+    def test_save_all_retries_on_auto_reconnect(self):
+        bulk = self.collection.initialize_ordered_bulk_op.return_value
+        bulk.execute.side_effect = [AutoReconnect,
+                                    {"nUpserted": 1, "nMatched": 0}]
+
+        self.driver.save_all([{"_id": 1}])
+
+        assert_that(bulk.execute.call_count, is_(2))
+
+    def test_save_all_stops_retrying_after_3_attempts(self):
+        bulk = self.collection.initialize_ordered_bulk_op.return_value
+        bulk.execute.side_effect = AutoReconnect
+
+        self.assertRaises(AutoReconnect, self.driver.save_all, [{"_id": 1}])
+
+        assert_that(bulk.execute.call_count, is_(3))
+
+    def test_find_without_fields_returns_whole_documents(self):
+        self.driver.find({}, ["_timestamp", "ascending"], None)
+
+        self.collection.find.assert_called_once_with({}, None)
+
+    def test_find_with_fields_projects_only_those_fields(self):
+        self.driver.find({}, ["_timestamp", "ascending"], None,
+                         ["name", "_timestamp"])
+
+        self.collection.find.assert_called_once_with(
+            {}, {"name": 1, "_timestamp": 1, "_id": 0})
+
+    def test_find_with_fields_keeps_id_when_asked_for(self):
+        self.driver.find({}, ["_timestamp", "ascending"], None,
+                         ["name", "_id"])
+
+        self.collection.find.assert_called_once_with(
+            {}, {"name": 1, "_id": 1})
+
+    def test_find_sorted_on_timestamp_is_tie_broken_on_id(self):
+        self.driver.find({}, ["_timestamp", "descending"], None)
+
+        self.collection.find.return_value.sort.assert_called_once_with(
+            [("_timestamp", -1), ("_id", -1)])
+
+    def test_find_after_a_document_finds_a_range(self):
+        self.driver.find({"name": "foo"}, ["_timestamp", "ascending"], 10,
+                         after=(d_tz(2014, 1, 1), "abc"))
+
+        self.collection.find.assert_called_once_with({
+            "name": "foo",
+            "$or": [
+                {"_timestamp": {"$gt": d_tz(2014, 1, 1)}},
+                {"_timestamp": d_tz(2014, 1, 1), "_id": {"$gt": "abc"}}
+            ]}, None)
+
+    def test_find_descending_after_a_document_includes_no_timestamps(self):
+        self.driver.find({}, ["_timestamp", "descending"], 10,
+                         after=(d_tz(2014, 1, 1), "abc"))
+
+        self.collection.find.assert_called_once_with({
+            "$or": [
+                {"_timestamp": {"$lt": d_tz(2014, 1, 1)}},
+                {"_timestamp": None},
+                {"_timestamp": d_tz(2014, 1, 1), "_id": {"$lt": "abc"}}
+            ]}, None)
+
+    def test_find_after_a_document_without_a_timestamp(self):
+        self.driver.find({}, ["_timestamp", "ascending"], 10,
+                         after=(None, "abc"))
+
+        self.collection.find.assert_called_once_with({
+            "$or": [
+                {"_timestamp": {"$ne": None}},
+                {"_timestamp": None, "_id": {"$gt": "abc"}}
+            ]}, None)
+
+    def test_find_can_only_page_on_timestamp(self):
+        self.assertRaises(InvalidSortError, self.driver.find,
+                          {}, ["name", "ascending"], 10,
+                          after=(d_tz(2014, 1, 1), "abc"))
+
+    def test_index_keys_lists_the_fields_of_each_index(self):
+        self.collection.index_information.return_value = {
+            "_id_": {"key": [("_id", 1)]},
+            "a_1__timestamp_1": {"key": [("a", 1), ("_timestamp", 1)]}
+        }
+
+        assert_that(sorted(self.driver.index_keys()),
+                    is_([["_id"], ["a", "_timestamp"]]))
+
+    def test_group_records_the_command_and_its_plan_when_explaining(self):
+        self.collection.find.return_value.explain.return_value = {
+            "cursor": "BtreeCursor type_1", "n": 2, "nscanned": 2,
+            "nscannedObjects": 2}
+
+        with explain.explaining() as explanation:
+            self.driver.group(["type"], {"range": "high"}, [])
+
+        self.collection.find.assert_called_once_with(
+            {"range": "high", "type": {"$ne": None}})
+        assert_that(explanation.details["mongo"]["group"], has_entries({
+            "key": ["type"],
+            "condition": {"range": "high", "type": {"$ne": None}}}))
+        assert_that(explanation.details["plan"], has_entries({
+            "index": "BtreeCursor type_1", "documents_examined": 2}))
+
+    def test_group_is_not_explained_otherwise(self):
+        self.driver.group(["type"], {}, [])
+
+        assert_that(self.collection.find.called, is_(False))
+
+    def test_group_sketches_fields_in_the_reducer(self):
+        self.driver.group(["type"], {}, ["size"],
+                          summaries=[("size", "sketch")])
+
+        kwargs = self.collection.group.call_args[1]
+        assert_that(kwargs["initial"], is_({
+            "_count": 0, "size": [], "_sketch:size": sketch.empty()}))
+        assert_that(str(kwargs["reduce"]),
+                    contains_string("(previous['_sketch:size'], "
+                                    "current['size'])"))
+        assert_that(str(kwargs["reduce"]),
+                    contains_string("v instanceof NumberLong"))
+
+    def test_group_picks_values_in_the_reducer(self):
+        self.driver.group(["type"], {}, [], summaries=[("size", "min")])
+
+        kwargs = self.collection.group.call_args[1]
+        assert_that(kwargs["initial"], is_({"_count": 0, "_min:size": None}))
+        assert_that(str(kwargs["reduce"]), contains_string(
+            "current['size'] < previous['_min:size']"))
+
+    def test_aggregate_builds_a_group_pipeline(self):
+        self.collection.aggregate.return_value = []
+
+        self.driver.aggregate(["type"], {"range": "high"}, ["size"])
+
+        self.collection.aggregate.assert_called_once_with([
+            {"$match": {"range": "high", "type": {"$ne": None}}},
+            {"$group": {
+                "_id": {"type": "$type"},
+                "_count": {"$sum": 1},
+                "size": {"$push": "$size"}
+            }}
+        ], cursor={}, allowDiskUse=True)
+
+    def test_aggregate_flattens_group_keys_into_results(self):
+        self.collection.aggregate.return_value = [
+            {"_id": {"type": "wind", "range": "high"}, "_count": 2,
+             "size": [1, 2]}
+        ]
+
+        results = self.driver.aggregate(["type", "range"], {}, ["size"])
+
+        assert_that(results, is_([
+            {"type": "wind", "range": "high", "_count": 2, "size": [1, 2]}
+        ]))
+
+    def test_aggregate_sketches_the_counts_of_binned_values(self):
+        self.collection.aggregate.return_value = [
+            {"_id": {"type": "wind"}, "_count": 4, "_sketch:size": [
+                {"s": "p", "i": 0.0, "c": 1},
+                {"s": "p", "i": float(sketch._index(2)), "c": 2},
+                {"s": None, "i": None, "c": 1}]}
+        ]
+
+        results = self.driver.aggregate(["type"], {}, [],
+                                        summaries=[("size", "sketch")])
+
+        pipeline = self.collection.aggregate.call_args[0][0]
+        sign, index = sketch.bin_expressions("size")
+        assert_that(pipeline[1]["$group"]["_id"], is_({
+            "type": "$type", "_bin_sign:size": sign,
+            "_bin_index:size": index}))
+        assert_that(pipeline[2]["$group"], is_({
+            "_id": {"type": "$_id.type"},
+            "_count": {"$sum": "$_count"},
+            "_sketch:size": {"$push": {"s": "$_id._bin_sign:size",
+                                       "i": "$_id._bin_index:size",
+                                       "c": "$_count"}}}))
+        assert_that(results[0]["_sketch:size"],
+                    is_(sketch.from_values([1, 2, 2])))
+
+    def test_aggregate_merges_values_collected_from_each_bin(self):
+        self.collection.aggregate.return_value = [
+            {"_id": {"type": "wind"}, "_count": 3, "range": [["high"],
+                                                             ["low", "low"]],
+             "_max:size": 2, "_sketch:size": []}
+        ]
+
+        results = self.driver.aggregate(
+            ["type"], {}, ["range"],
+            summaries=[("size", "max"), ("size", "sketch")])
+
+        group = self.collection.aggregate.call_args[0][0][2]["$group"]
+        assert_that(group["range"], is_({"$push": "$range"}))
+        assert_that(group["_max:size"], is_({"$max": "$_max:size"}))
+        assert_that(results[0]["range"], is_(["high", "low", "low"]))
+
+    def test_aggregate_picks_values_in_the_group_stage(self):
+        self.collection.aggregate.return_value = [
+            {"_id": {"type": "wind"}, "_count": 2, "_max:size": 2,
+             "_last:size": {"t": d_tz(2014, 1, 2), "v": 1}}
+        ]
+
+        results = self.driver.aggregate(
+            ["type"], {}, [], summaries=[("size", "max"), ("size", "last")])
+
+        group = self.collection.aggregate.call_args[0][0][1]["$group"]
+        assert_that(group["_max:size"], is_({"$max": "$size"}))
+        assert_that(group["_last:size"]["$max"]["$cond"][1],
+                    is_({"t": "$_timestamp", "v": "$size"}))
+        assert_that(results[0], has_entries({
+            "_max:size": 2, "_last:size": [d_tz(2014, 1, 2), 1]}))
+
+    def test_aggregate_with_sort_and_limit(self):
+        self.collection.aggregate.return_value = []
+
+        self.driver.aggregate(["type"], {}, [],
+                              sort=["_count", "descending"], limit=5)
+
+        pipeline = self.collection.aggregate.call_args[0][0]
+        assert_that(pipeline[2:], is_([
+            {"$sort": {"_count": -1, "_id.type": 1}},
+            {"$limit": 5}
+        ]))
+        assert_that(pipeline[2]["$sort"].keys(), is_(["_count", "_id.type"]))
+
+    def test_aggregate_sorts_on_group_keys(self):
+        self.collection.aggregate.return_value = []
+
+        self.driver.aggregate(["type"], {}, [],
+                              sort=["type", "ascending"])
+
+        pipeline = self.collection.aggregate.call_args[0][0]
+        assert_that(pipeline[2], is_({"$sort": {"_id.type": 1}}))
+
+    def test_aggregate_sorts_and_limits_multi_groups_on_their_first_key(self):
+        self.collection.aggregate.return_value = []
+
+        self.driver.aggregate(["type", "range"], {}, ["size"],
+                              sort=["_count", "descending"], limit=5)
+
+        pipeline = self.collection.aggregate.call_args[0][0]
+        assert_that(pipeline[2:], is_([
+            {"$group": {
+                "_id": {"type": "$_id.type"},
+                "_count": {"$sum": "$_count"},
+                "_subgroup": {"$push": {"_id": "$_id",
+                                        "_count": "$_count",
+                                        "size": "$size"}}
+            }},
+            {"$sort": {"_count": -1, "_id.type": 1}},
+            {"$limit": 5},
+            {"$unwind": "$_subgroup"}
+        ]))
+
+    def test_aggregate_unwinds_multi_groups_into_results(self):
+        self.collection.aggregate.return_value = [
+            {"_id": {"type": "wild"}, "_count": 3,
+             "_subgroup": {"_id": {"type": "wild", "range": "high"},
+                           "_count": 3, "size": [1, 2, 3]}}
+        ]
+
+        results = self.driver.aggregate(["type", "range"], {}, ["size"],
+                                        sort=["_count", "descending"])
+
+        assert_that(results, is_([
+            {"type": "wild", "range": "high", "_count": 3, "size": [1, 2, 3]}
+        ]))
+
+
+class TestDatabase(unittest.TestCase):
+    @patch("pymongo.MongoClient")
+    def test_connects_to_a_single_server(self, mongo_client):
+        Database("localhost", 27017, "backdrop", max_pool_size=10)
+
+        mongo_client.assert_called_once_with(
+            "localhost", port=27017, max_pool_size=10,
+            read_preference=ReadPreference.PRIMARY)
+
+    @patch("pymongo.MongoReplicaSetClient")
+    def test_connects_to_a_replica_set(self, replica_set_client):
+        Database("mongo-1,mongo-2", 27017, "backdrop", replica_set="rs0",
+                 read_preference="secondaryPreferred")
+
+        replica_set_client.assert_called_once_with(
+            "mongo-1,mongo-2", replicaSet="rs0", port=27017,
+            max_pool_size=100,
+            read_preference=ReadPreference.SECONDARY_PREFERRED)
+
+    @patch("pymongo.MongoClient")
+    def test_rejects_unknown_read_preferences(self, mongo_client):
+        self.assertRaises(ValueError, Database, "localhost", 27017,
+                          "backdrop", read_preference="fastest")
+
+    @patch("pymongo.MongoClient")
+    def test_repositories_can_read_from_the_primary(self, mongo_client):
+        db = Database("localhost", 27017, "backdrop",
+                      read_preference="secondaryPreferred")
+        collection = mongo_client.return_value["backdrop"]["bucket"]
+
+        db.get_repository("bucket", read_from_primary=True)
+
+        assert_that(collection.read_preference, is_(ReadPreference.PRIMARY))
+
 
 class TestRepository(unittest.TestCase):
     def setUp(self):
@@ -50,6 +398,79 @@ class TestRepository(unittest.TestCase):
             "_updated_at": d_tz(2013, 4, 9, 13, 32, 5)
         })
 
+    @patch('backdrop.core.timeutils.now')
+    def test_save_all_adds_timestamps_and_ids(self, now):
+        now.return_value = d_tz(2013, 4, 9, 13, 32, 5)
+        self.mongo.save_all.return_value = (2, [])
+
+        self.repo.save_all([{"_id": "groucho"}, {"name": "Harpo"}])
+
+        saved = self.mongo.save_all.call_args[0][0]
+        assert_that(saved[0], is_({
+            "_id": "groucho",
+            "_updated_at": d_tz(2013, 4, 9, 13, 32, 5)
+        }))
+        assert_that(saved[1], has_entries({
+            "_id": instance_of(ObjectId),
+            "name": "Harpo",
+            "_updated_at": d_tz(2013, 4, 9, 13, 32, 5)
+        }))
+
+    def test_save_all_writes_in_chunks(self):
+        repo = Repository(self.mongo, bulk_write_chunk_size=2)
+        self.mongo.save_all.side_effect = lambda objs, ordered: \
+            (len(objs), [])
+
+        repo.save_all([{"_id": i} for i in range(5)])
+
+        assert_that(
+            [[obj["_id"] for obj in c[0][0]]
+             for c in self.mongo.save_all.call_args_list],
+            is_([[0, 1], [2, 3], [4]]))
+
+    def test_save_all_stops_at_first_failed_chunk_when_ordered(self):
+        repo = Repository(self.mongo, bulk_write_chunk_size=2)
+        self.mongo.save_all.side_effect = [(2, []), (1, [(1, "too big")])]
+
+        try:
+            repo.save_all([{"_id": i} for i in range(6)])
+            self.fail("expected a PartialWriteError")
+        except PartialWriteError as e:
+            assert_that(e.stored, is_(3))
+            assert_that(e.total, is_(6))
+            assert_that(e.errors, is_([(3, "too big")]))
+
+        assert_that(self.mongo.save_all.call_count, is_(2))
+
+    def test_save_all_reports_the_documents_written_in_each_chunk(self):
+        repo = Repository(self.mongo, bulk_write_chunk_size=2,
+                          ordered_bulk_writes=False)
+        self.mongo.save_all.side_effect = [(1, [(0, "oops")]),
+                                           AutoReconnect()]
+        written = Mock()
+
+        assert_raises(AutoReconnect, repo.save_all,
+                      [{"_id": i} for i in range(4)], written=written)
+
+        assert_that([[obj["_id"] for obj in c[0][0]]
+                     for c in written.call_args_list], is_([[1]]))
+
+    def test_save_all_carries_on_after_failures_when_unordered(self):
+        repo = Repository(self.mongo, bulk_write_chunk_size=2,
+                          ordered_bulk_writes=False)
+        self.mongo.save_all.side_effect = [(1, [(0, "oops")]), (2, [])]
+
+        try:
+            repo.save_all([{"_id": i} for i in range(4)])
+            self.fail("expected a PartialWriteError")
+        except PartialWriteError as e:
+            assert_that(e.stored, is_(3))
+            assert_that(e.errors, is_([(0, "oops")]))
+
+        self.mongo.save_all.assert_called_with(
+            [{"_id": 2, "_updated_at": ANY}, {"_id": 3, "_updated_at": ANY}],
+            False)
+
     # =========================
     # Tests for repository.find
     # =========================
@@ -61,7 +482,8 @@ class TestRepository(unittest.TestCase):
             sort= ["name", "ascending"])
 
         self.mongo.find.assert_called_once_with({"plays": "guitar"},
-                                                ["name", "ascending"], None)
+                                                ["name", "ascending"], None,
+                                                None, None)
         assert_that(results, is_("a_cursor"))
 
     def test_find_with_descending_sort(self):
@@ -72,7 +494,8 @@ class TestRepository(unittest.TestCase):
             sort= ["name", "descending"])
 
         self.mongo.find.assert_called_once_with({"plays": "guitar"},
-                                                ["name", "descending"], None)
+                                                ["name", "descending"], None,
+                                                None, None)
         assert_that(results, is_("a_cursor"))
 
     def test_find_with_default_sorting(self):
@@ -83,7 +506,7 @@ class TestRepository(unittest.TestCase):
 
         self.mongo.find.assert_called_once_with({"plays": "guitar"},
                                                 ["_timestamp", "ascending"],
-                                                None)
+                                                None, None, None)
         assert_that(results, is_("a_cursor"))
 
     def test_find_with_limit(self):
@@ -94,9 +517,127 @@ class TestRepository(unittest.TestCase):
 
         self.mongo.find.assert_called_once_with({"plays": "guitar"},
                                                 ["_timestamp", "ascending"],
-                                                10)
+                                                10, None, None)
         assert_that(results, is_("a_cursor"))
 
+    def test_find_with_fields(self):
+        self.mongo.find.return_value = "a_cursor"
+
+        self.repo.find(Query.create(fields=["name", "plays"]))
+
+        self.mongo.find.assert_called_once_with({},
+                                                ["_timestamp", "ascending"],
+                                                None, ["name", "plays"], None)
+
+    def test_paged_find_includes_the_fields_needed_for_the_next_page(self):
+        self.mongo.find.return_value = "a_cursor"
+
+        self.repo.find(Query.create(fields=["name"], limit=10), limit=10)
+
+        self.mongo.find.assert_called_once_with(
+            {}, ["_timestamp", "ascending"], 10,
+            ["name", "_timestamp", "_id"], None)
+
+    def test_find_after_a_document(self):
+        self.mongo.find.return_value = "a_cursor"
+        after = (d_tz(2014, 1, 1), "abc")
+
+        self.repo.find(Query.create(after=after))
+
+        self.mongo.find.assert_called_once_with(
+            {}, ["_timestamp", "ascending"], None, None, after)
+
+    def test_group_uses_the_group_command_by_default(self):
+        self.mongo.group.return_value = [{"name": "Max", "_count": 3}]
+
+        results = self.repo.group("name", Query.create())
+
+        self.mongo.group.assert_called_once_with(["name"], {}, [],
+                                                 summaries=[])
+        assert_that(self.mongo.aggregate.called, is_(False))
+        assert_that(results, is_([{"name": "Max", "_count": 3}]))
+
+    def test_group_stages_are_explained(self):
+        self.mongo.group.return_value = [{"name": "Max", "_count": 3}]
+
+        with explain.explaining() as explanation:
+            self.repo.group("name", Query.create())
+
+        assert_that([stage["stage"] for stage in explanation.stages],
+                    is_(["mongo", "nested_merge", "sort_and_limit"]))
+        assert_that(explanation.details["mongo_groups"], is_(1))
+
+    def test_group_with_aggregate_engine(self):
+        repo = Repository(self.mongo, query_engine="aggregate")
+        self.mongo.aggregate.return_value = [{"name": "Max", "_count": 3}]
+
+        results = repo.group("name", Query.create())
+
+        self.mongo.aggregate.assert_called_once_with(["name"], {}, [],
+                                                     summaries=[])
+        assert_that(self.mongo.group.called, is_(False))
+        assert_that(results, is_([{"name": "Max", "_count": 3}]))
+
+    def test_aggregate_engine_hands_sort_and_limit_to_the_database(self):
+        repo = Repository(self.mongo, query_engine="aggregate")
+        self.mongo.aggregate.return_value = []
+
+        repo.group("name", Query.create(), sort=["_count", "descending"],
+                   limit=3)
+
+        self.mongo.aggregate.assert_called_once_with(
+            ["name"], {}, [], ["_count", "descending"], 3, summaries=[])
+
+    def test_aggregate_engine_hands_multi_group_sort_to_the_database(self):
+        repo = Repository(self.mongo, query_engine="aggregate")
+        self.mongo.aggregate.return_value = []
+
+        repo.multi_group("name", "_week_start_at", Query.create(),
+                         sort=["name", "ascending"], limit=3)
+
+        self.mongo.aggregate.assert_called_once_with(
+            ["name", "_week_start_at"], {}, [], ["name", "ascending"], 3,
+            summaries=[])
+
+    def test_nested_group_groups_on_every_key_at_once(self):
+        self.mongo.group.return_value = [
+            {"a": 1, "b": 2, "c": 3, "_count": 1},
+            {"a": 1, "b": 2, "c": 4, "_count": 2},
+        ]
+
+        results = self.repo.nested_group(["a", "b", "c"], Query.create())
+
+        self.mongo.group.assert_called_once_with(["a", "b", "c"], {}, [],
+                                                 summaries=[])
+        assert_that(results, is_([
+            {"a": 1, "_count": 3, "_group_count": 1, "_subgroup": [
+                {"b": 2, "_count": 3, "_group_count": 2, "_subgroup": [
+                    {"c": 3, "_count": 1}, {"c": 4, "_count": 2}]}]}]))
+
+    def test_nested_group_rejects_repeated_keys(self):
+        self.assertRaises(GroupingError, self.repo.nested_group,
+                          ["a", "b", "a"], Query.create())
+
+    def test_aggregate_engine_sorts_collected_values_after_merging(self):
+        repo = Repository(self.mongo, query_engine="aggregate")
+        self.mongo.aggregate.return_value = [
+            {"name": "Max", "_count": 1, "age": [3, 4]},
+            {"name": "Gareth", "_count": 1, "age": [10]},
+        ]
+
+        results = repo.group("name", Query.create(),
+                             sort=["age:sum", "descending"], limit=1,
+                             collect=[("age", "sum")])
+
+        self.mongo.aggregate.assert_called_once_with(["name"], {}, ["age"],
+                                                     summaries=[])
+        assert_that(results, is_([
+            {"name": "Gareth", "_count": 1, "age:sum": 10}
+        ]))
+
+    def test_unknown_query_engine_is_rejected(self):
+        self.assertRaises(ValueError, Repository, self.mongo, "mapreduce")
+
     def test_sort_raises_error_if_sort_does_not_have_two_elements(self):
         self.assertRaises(
             InvalidSortError,
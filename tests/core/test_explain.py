@@ -0,0 +1,70 @@
+import unittest
+from hamcrest import assert_that, is_, none, has_entries
+from backdrop.core import explain
+
+
+class TestExplain(unittest.TestCase):
+    def test_nothing_is_recorded_without_an_explanation(self):
+        with explain.stage("mongo"):
+            explain.record(groups=1)
+
+        assert_that(explain.current(), none())
+
+    def test_stages_are_timed_in_order(self):
+        with explain.explaining() as explanation:
+            with explain.stage("mongo"):
+                pass
+            with explain.stage("encode"):
+                pass
+
+        assert_that([stage["stage"] for stage in explanation.stages],
+                    is_(["mongo", "encode"]))
+        assert_that(explain.current(), none())
+
+    def test_stages_that_fail_are_timed(self):
+        with explain.explaining() as explanation:
+            try:
+                with explain.stage("mongo"):
+                    raise ValueError()
+            except ValueError:
+                pass
+
+        assert_that(len(explanation.stages), is_(1))
+
+    def test_details_are_recorded(self):
+        with explain.explaining() as explanation:
+            explain.record(groups=3)
+
+        assert_that(explanation.as_dict(), is_({"groups": 3, "stages": []}))
+
+
+class TestSummarisePlan(unittest.TestCase):
+    def test_legacy_plans(self):
+        plan = explain.summarise_plan({
+            "cursor": "BtreeCursor _timestamp_1",
+            "n": 10, "nscanned": 12, "nscannedObjects": 11})
+
+        assert_that(plan, is_({
+            "index": "BtreeCursor _timestamp_1",
+            "keys_examined": 12,
+            "documents_examined": 11,
+            "documents_returned": 10}))
+
+    def test_execution_stats(self):
+        plan = explain.summarise_plan({
+            "queryPlanner": {"winningPlan": {
+                "stage": "FETCH",
+                "inputStage": {"stage": "IXSCAN",
+                               "indexName": "_timestamp_1"}}},
+            "executionStats": {"nReturned": 10, "totalKeysExamined": 12,
+                               "totalDocsExamined": 11}})
+
+        assert_that(plan, has_entries({"index": "_timestamp_1",
+                                       "documents_examined": 11}))
+
+    def test_collection_scans(self):
+        plan = explain.summarise_plan({
+            "queryPlanner": {"winningPlan": {"stage": "COLLSCAN"}},
+            "executionStats": {}})
+
+        assert_that(plan["index"], is_("COLLSCAN"))
@@ -0,0 +1,144 @@
+import unittest
+from hamcrest import assert_that, is_, has_entries
+from mock import Mock, patch
+import pymongo
+from backdrop.core.bucket import BucketConfig
+from backdrop.core.index_advisor import query_shape, propose_index, \
+    propose_indexes, QueryShapes, build_indexes
+from backdrop.core.timeseries import WEEK
+from backdrop.read.query import Query
+from tests.support.test_helpers import d_tz
+
+
+class TestQueryShape(unittest.TestCase):
+    def test_raw_queries_are_sorted_on_timestamp_by_default(self):
+        assert_that(query_shape(Query.create()), is_({
+            "equality": [],
+            "group": [],
+            "sort": "_timestamp",
+            "range": False
+        }))
+
+    def test_filters_are_equality_fields(self):
+        shape = query_shape(Query.create(
+            filter_by=[["b", "1"], ["a", "2"], ["a", "3"]],
+            sort_by=["name", "ascending"]))
+
+        assert_that(shape, has_entries({"equality": ["a", "b"],
+                                        "sort": "name"}))
+
+    def test_grouped_queries_have_no_sort(self):
+        shape = query_shape(Query.create(period=WEEK,
+                                         start_at=d_tz(2013, 4, 1)))
+
+        assert_that(shape, is_({
+            "equality": [],
+            "group": ["_week_start_at"],
+            "sort": None,
+            "range": True
+        }))
+
+    def test_group_by_keys_come_before_the_period(self):
+        shape = query_shape(Query.create(group_by=["a", "b"], period=WEEK))
+
+        assert_that(shape["group"], is_(["a", "b", "_week_start_at"]))
+
+
+class TestProposeIndexes(unittest.TestCase):
+    def test_index_has_equality_then_sort_then_range_fields(self):
+        assert_that(propose_index({"equality": ["a", "b"],
+                                   "sort": "name",
+                                   "range": True}),
+                    is_(["a", "b", "name", "_timestamp"]))
+
+    def test_grouped_fields_come_after_the_equality_fields(self):
+        assert_that(propose_index({"equality": ["a", "channel"],
+                                   "group": ["channel", "_week_start_at"],
+                                   "sort": None,
+                                   "range": True}),
+                    is_(["a", "channel", "_week_start_at", "_timestamp"]))
+
+    def test_timestamp_is_not_repeated(self):
+        assert_that(propose_index({"equality": [],
+                                   "sort": "_timestamp",
+                                   "range": True}),
+                    is_(["_timestamp"]))
+
+    def test_unfiltered_grouped_queries_need_no_index(self):
+        assert_that(propose_index({"equality": [],
+                                   "sort": None,
+                                   "range": False}),
+                    is_(None))
+
+    def test_indexes_that_exist_are_not_proposed(self):
+        shapes = [
+            {"equality": [], "sort": "_timestamp", "range": True},
+            {"equality": ["a"], "sort": None, "range": True},
+            {"equality": ["a"], "sort": None, "range": False},
+        ]
+
+        assert_that(propose_indexes(shapes, [["_id"], ["_timestamp", "_id"]]),
+                    is_([["a", "_timestamp"]]))
+
+
+class TestQueryShapes(unittest.TestCase):
+    def setUp(self):
+        self.db = Mock()
+        self.mongo_driver = self.db.get_collection.return_value
+
+    @patch("backdrop.core.timeutils.now")
+    def test_shapes_are_counted(self, now):
+        now.return_value = d_tz(2014, 1, 1)
+        QueryShapes(self.db).record("foo", Query.create())
+
+        self.mongo_driver.update.assert_called_once_with(
+            {"_id": 'foo:{"equality": [], "group": [], "range": false, '
+                    '"sort": "_timestamp"}'},
+            {"$set": {"bucket": "foo",
+                      "shape": {"equality": [], "group": [],
+                                "sort": "_timestamp", "range": False},
+                      "last_seen": d_tz(2014, 1, 1)},
+             "$inc": {"count": 1}},
+            upsert=True)
+
+    def test_shapes_are_sampled(self):
+        QueryShapes(self.db, sample_rate=0).record("foo", Query.create())
+
+        assert_that(self.mongo_driver.update.called, is_(False))
+
+    def test_errors_recording_shapes_are_not_raised(self):
+        self.mongo_driver.update.side_effect = pymongo.errors.AutoReconnect
+
+        QueryShapes(self.db).record("foo", Query.create())
+
+    def test_commonest_shapes_first(self):
+        self.mongo_driver.find.return_value = [{"shape": "common"},
+                                               {"shape": "rare"}]
+
+        shapes = QueryShapes(self.db).for_bucket("foo", 10)
+
+        assert_that(shapes, is_(["common", "rare"]))
+        self.mongo_driver.find.assert_called_once_with(
+            {"bucket": "foo", "count": {"$gte": 10}},
+            ["count", "descending"], None)
+
+
+class TestBuildIndexes(unittest.TestCase):
+    def test_proposed_indexes_are_built_in_the_background(self):
+        db = Mock()
+        mongo_driver = db.get_collection.return_value
+        mongo_driver.index_keys.side_effect = [
+            [["_id"]],
+            [["_id"], ["a", "_timestamp"]]
+        ]
+        shapes = Mock()
+        shapes.for_bucket.return_value = [
+            {"equality": ["a"], "sort": None, "range": True}]
+
+        indexes = build_indexes(db, BucketConfig("foo", "group", "type"),
+                                shapes)
+
+        mongo_driver.ensure_index.assert_called_once_with(
+            [("a", pymongo.ASCENDING), ("_timestamp", pymongo.ASCENDING)],
+            background=True)
+        assert_that(indexes, is_([["a", "_timestamp"]]))
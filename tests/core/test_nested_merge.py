@@ -1,7 +1,10 @@
 import unittest
-from hamcrest import assert_that, is_, contains, has_entries, has_entry
-from backdrop.core.nested_merge import reduce_collected_values, InvalidOperationError, nested_merge, group_by, apply_collect_to_group, collect_all_values
+from hamcrest import assert_that, is_, contains, has_entries, has_entry, \
+    close_to
+from backdrop.core import sketch
+from backdrop.core.nested_merge import InvalidOperationError, nested_merge, accumulator_for
 from backdrop.core.timeseries import WEEK, MONTH
+from tests.support.test_helpers import d
 
 
 def datum(name=None, place=None, age=None, stamp=None, count=1):
@@ -21,6 +24,17 @@ def datum(name=None, place=None, age=None, stamp=None, count=1):
     return result
 
 
+def collect_values(values, method):
+    return accumulator_for(method).reduce(values)
+
+
+def collect_summaries(summaries, method):
+    accumulator = accumulator_for(method)
+    for summary in summaries:
+        accumulator.add(summary)
+    return accumulator.value()
+
+
 class TestNestedMerge(object):
 
     def test_one_level_grouping_with_collect(self):
@@ -90,14 +104,14 @@ class TestNestedMerge(object):
                     ))
 
 
-class TestGroupBy(object):
+class TestGrouping(object):
     def test_one_level_grouping(self):
         data = [
             datum(name='Jill', age=[12, 45]),
             datum(name='Jack', age=[34, 34]),
             datum(name='John', age=[56, 65])
         ]
-        results = group_by(data, ['name'])
+        results = nested_merge(['name'], [], data)
 
         assert_that(results,
                     contains(
@@ -112,62 +126,100 @@ class TestGroupBy(object):
             datum(name='James', place='Kettering', age=[43, 87], count=2),
             datum(name='Jill', place='Keswick', age=[76, 32], count=2),
         ]
-        results = group_by(data, ['name', 'place'])
+        results = nested_merge(['name', 'place'], [], data)
 
         assert_that(results,
                     contains(
                         is_({
                             'name': 'James',
+                            '_count': 2,
+                            '_group_count': 1,
                             '_subgroup': [
                                 {'place': 'Kettering', 'age': [43, 87], '_count': 2}
                             ]}),
                         is_({
                             'name': 'Jill',
+                            '_count': 4,
+                            '_group_count': 2,
                             '_subgroup': [
                                 {'place': 'Keswick', 'age': [76, 32], '_count': 2},
                                 {'place': 'Kettering', 'age': [34, 36], '_count': 2},
                             ]}),
                     ))
 
+    def test_three_level_grouping(self):
+        data = [
+            {'a': 1, 'b': 2, 'c': 3, '_count': 1, 'age': [1]},
+            {'a': 1, 'b': 2, 'c': 4, '_count': 2, 'age': [2, 3]},
+            {'a': 1, 'b': 1, 'c': 3, '_count': 1, 'age': [4]},
+            {'a': 0, 'b': 2, 'c': 3, '_count': 1, 'age': [5]},
+        ]
+        results = nested_merge(['a', 'b', 'c'], [('age', 'sum')], data)
+
+        assert_that(results[1], has_entries({
+            'a': 1, '_count': 4, '_group_count': 2, 'age:sum': 10}))
+        assert_that(results[1]['_subgroup'][1], has_entries({
+            'b': 2, '_count': 3, '_group_count': 2, 'age:sum': 6}))
+        assert_that(results[1]['_subgroup'][1]['_subgroup'], is_([
+            {'c': 3, '_count': 1, 'age:sum': 1},
+            {'c': 4, '_count': 2, 'age:sum': 5},
+        ]))
+
+    def test_array_keys_are_grouped_on_their_contents(self):
+        data = [
+            {'tags': ['a', 'b'], 'place': 'Keswick', '_count': 1},
+            {'tags': ['a', 'b'], 'place': 'Kettering', '_count': 2},
+        ]
+        results = nested_merge(['tags', 'place'], [], data)
+
+        assert_that(results, contains(has_entries({
+            'tags': ['a', 'b'], '_count': 3, '_group_count': 2})))
+
 
-class TestApplyCollectToGroup(object):
+class TestCollect(object):
     def test_single_level_collect_sum(self):
-        group = {'name': 'Joanne', 'age': [34, 56]}
+        data = [{'name': 'Joanne', 'age': [34, 56], '_count': 2}]
 
-        assert_that(apply_collect_to_group(group, [('age', 'sum')]),
+        assert_that(nested_merge(['name'], [('age', 'sum')], data)[0],
                     has_entry('age:sum', 90))
 
     def test_single_level_collect_default(self):
-        group = {'name': 'Joanne', 'age': [34, 56]}
+        data = [{'name': 'Joanne', 'age': [34, 56], '_count': 2}]
 
-        assert_that(apply_collect_to_group(group, [('age', 'default')]),
+        assert_that(nested_merge(['name'], [('age', 'default')], data)[0],
                     is_({
-                        'name': 'Joanne', 'age:set': [34, 56], 'age': [34, 56]}))
+                        'name': 'Joanne', 'age:set': [34, 56], 'age': [34, 56],
+                        '_count': 2}))
 
     def test_double_level_collect_sum(self):
-        group = {'name': 'Joanne', '_subgroup': [
-            {'place': 'Kettering', 'age': [34, 56]},
-            {'place': 'Keswick', 'age': [87, 2]},
-        ]}
+        data = [
+            {'name': 'Joanne', 'place': 'Kettering', 'age': [34, 56],
+             '_count': 2},
+            {'name': 'Joanne', 'place': 'Keswick', 'age': [87, 2],
+             '_count': 2},
+        ]
 
-        collected = apply_collect_to_group(group, [('age', 'sum')])
+        collected = nested_merge(['name', 'place'], [('age', 'sum')], data)[0]
 
         # level one
         assert_that(collected, has_entry('age:sum', 179))
         # level two
         assert_that(collected, has_entry('_subgroup',
                                          contains(
-                                             has_entry('age:sum', 90),
-                                             has_entry('age:sum', 89)
+                                             has_entry('age:sum', 89),
+                                             has_entry('age:sum', 90)
                                          )))
 
     def test_double_level_collect_default(self):
-        group = {'name': 'Joanne', '_subgroup': [
-            {'place': 'Kettering', 'age': [34, 56]},
-            {'place': 'Keswick', 'age': [87, 2]},
-        ]}
+        data = [
+            {'name': 'Joanne', 'place': 'Kettering', 'age': [34, 56],
+             '_count': 2},
+            {'name': 'Joanne', 'place': 'Keswick', 'age': [87, 2],
+             '_count': 2},
+        ]
 
-        collected = apply_collect_to_group(group, [('age', 'default')])
+        collected = nested_merge(['name', 'place'], [('age', 'default')],
+                                 data)[0]
 
         assert_that(collected, has_entries({
             'age:set': [2, 34, 56, 87],
@@ -176,64 +228,117 @@ class TestApplyCollectToGroup(object):
 
         assert_that(collected, has_entry('_subgroup',
                                          contains(
-                                             has_entries({
-                                                 'age:set': [34, 56],
-                                                 'age': [34, 56],
-                                             }),
                                              has_entries({
                                                  'age:set': [2, 87],
                                                  'age': [2, 87],
                                              }),
+                                             has_entries({
+                                                 'age:set': [34, 56],
+                                                 'age': [34, 56],
+                                             }),
                                          )))
 
+    def test_double_level_collect_median_merges_sketches(self):
+        data = [
+            {'name': 'Joanne', 'place': 'Kettering', '_count': 2,
+             '_sketch:age': sketch.from_values([10, 20])},
+            {'name': 'Joanne', 'place': 'Keswick', '_count': 3,
+             '_sketch:age': sketch.from_values([30, 40, 50])},
+        ]
+
+        collected = nested_merge(['name', 'place'], [('age', 'median')],
+                                 data)[0]
+
+        assert_that(round(collected['age:median']), is_(30))
+        assert_that(round(collected['_subgroup'][1]['age:median']), is_(10))
+        assert_that('_sketch:age' in collected['_subgroup'][0], is_(False))
+
+    def test_double_level_collect_picked_values(self):
+        data = [
+            {'name': 'Joanne', 'place': 'Kettering', '_count': 2,
+             '_max:age': 56, '_first:age': [d(2013, 1, 2), 34],
+             '_last:age': None},
+            {'name': 'Joanne', 'place': 'Keswick', '_count': 2,
+             '_max:age': 87, '_first:age': [d(2013, 1, 1), 2],
+             '_last:age': None},
+        ]
+
+        collected = nested_merge(
+            ['name', 'place'],
+            [('age', 'max'), ('age', 'first'), ('age', 'last')], data)[0]
 
-class TestCollectAllValues(object):
-    def test_single_level_collect(self):
-        group = {
-            'age': [5]
-        }
-        assert_that(collect_all_values(group, 'age'), [5])
+        assert_that(collected, has_entries({
+            'age:max': 87, 'age:first': 2, 'age:last': None}))
+        assert_that(collected['_subgroup'][1], is_({
+            'place': 'Kettering', '_count': 2, 'age:max': 56,
+            'age:first': 34, 'age:last': None}))
+
+
+class TestAccumulators(unittest.TestCase):
+    def test_accumulators_collect_the_values_of_every_group(self):
+        for method, expected in [("sum", 10), ("count", 4), ("mean", 2.5),
+                                 ("set", [1, 2, 3, 4])]:
+            accumulator = accumulator_for(method).empty()
+            accumulator.add([1, 2])
+            accumulator.add([3, 4])
 
-    def test_double_level_collect(self):
-        group = {
-            'age': [5],  # This will be discarded as there are sub groups.
-            '_subgroup': [
-                {'age': [1, 2]},
-                {'age': [3, 4]},
-            ]
-        }
-        assert_that(collect_all_values(group, 'age'), [1, 2, 3, 4])
+            assert_that(accumulator.value(), is_(expected))
 
 
-class TestReduceCollectedValues(unittest.TestCase):
+class TestCollectValues(unittest.TestCase):
     def test_sum(self):
         data = [2, 5, 8]
-        response = reduce_collected_values(data, "sum")
+        response = collect_values(data, "sum")
         assert_that(response, is_(15))
 
     def test_count(self):
         data = ['Sheep', 'Elephant', 'Wolf', 'Dog']
-        response = reduce_collected_values(data, "count")
+        response = collect_values(data, "count")
         assert_that(response, is_(4))
 
     def test_set(self):
         data = ['Badger', 'Badger', 'Badger', 'Snake']
-        response = reduce_collected_values(data, "set")
+        response = collect_values(data, "set")
         assert_that(response, is_(['Badger', 'Snake']))
 
     def test_mean(self):
         data = [13, 19, 15, 2]
-        response = reduce_collected_values(data, "mean")
+        response = collect_values(data, "mean")
         assert_that(response, is_(12.25))
 
     def test_unknown_collection_method_raises_error(self):
         self.assertRaises(ValueError,
-                          reduce_collected_values, ['foo'], "unknown")
+                          collect_values, ['foo'], "unknown")
 
     def test_bad_data_for_sum_raises_error(self):
         self.assertRaises(InvalidOperationError,
-                          reduce_collected_values, ['sum', 'this'], "sum")
+                          collect_values, ['sum', 'this'], "sum")
 
     def test_bad_data_for_mean_raises_error(self):
         self.assertRaises(InvalidOperationError,
-                          reduce_collected_values, ['average', 'this'], "mean")
+                          collect_values, ['average', 'this'], "mean")
+
+
+class TestCollectSummaries(unittest.TestCase):
+    def test_percentiles_are_read_from_merged_sketches(self):
+        sketches = [sketch.from_values(range(1, 51)),
+                    sketch.from_values(range(51, 101))]
+
+        assert_that(collect_summaries(sketches, "p90"), close_to(90, 0.9))
+        assert_that(collect_summaries(sketches, "median"), close_to(50, 0.5))
+
+    def test_min_and_max_ignore_groups_without_values(self):
+        assert_that(collect_summaries([3, None, 1], "min"), is_(1))
+        assert_that(collect_summaries([3, None, 1], "max"), is_(3))
+        assert_that(collect_summaries([None], "max"), is_(None))
+
+    def test_first_and_last_are_picked_by_timestamp(self):
+        pairs = [[d(2013, 1, 2), 'b'], [d(2013, 1, 1), 'a'],
+                 [d(2013, 1, 3), 'c']]
+
+        assert_that(collect_summaries(pairs, "first"), is_('a'))
+        assert_that(collect_summaries(pairs, "last"), is_('c'))
+
+    def test_bad_data_for_percentiles_raises_error(self):
+        self.assertRaises(InvalidOperationError, collect_summaries,
+                          [sketch.from_values(['a', 'b'])], "p99")
@@ -0,0 +1,276 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from hamcrest import assert_that, is_, is_not, none
+from mock import Mock, patch
+from backdrop.core.query_cache import BucketVersions, cache_key, \
+    MemoryStore, SqliteStore, QueryCache, SingleFlight, create_query_cache, \
+    query_etag
+from backdrop.core.timeseries import WEEK
+from backdrop.read.query import Query
+from tests.support.test_helpers import d_tz
+
+
+class TestBucketVersions(unittest.TestCase):
+    def setUp(self):
+        self.db = Mock()
+        self.mongo_driver = self.db.get_collection.return_value
+        self.versions = BucketVersions(self.db)
+
+    def test_buckets_that_have_not_been_stored_to_are_version_zero(self):
+        self.mongo_driver.find_one.return_value = None
+
+        assert_that(self.versions.get("foo"), is_((0, None)))
+
+    def test_version_is_read_from_the_collection(self):
+        self.mongo_driver.find_one.return_value = {
+            "_id": "foo", "version": 4, "updated_at": d_tz(2014, 1, 1)}
+
+        assert_that(self.versions.get("foo"), is_((4, d_tz(2014, 1, 1))))
+        self.db.get_collection.assert_any_call("bucket_versions")
+
+    def test_version_is_read_from_the_primary_unless_asked_not_to(self):
+        collections = {}
+        self.db.get_collection.side_effect = lambda name, **kwargs: \
+            collections.setdefault(kwargs.get("read_from_primary"), Mock())
+        versions = BucketVersions(self.db)
+        collections[True].find_one.return_value = {"version": 4}
+        collections[None].find_one.return_value = {"version": 3}
+
+        assert_that(versions.get("foo")[0], is_(4))
+        assert_that(versions.get("foo", read_from_primary=False)[0], is_(3))
+
+    @patch("backdrop.core.timeutils.now")
+    def test_cached_versions_are_read_once_until_they_expire(self, now):
+        versions = BucketVersions(self.db, cache_ttl=5)
+        self.mongo_driver.find_one.return_value = {"version": 4}
+        now.return_value = d_tz(2014, 1, 1, 12, 0, 0)
+
+        versions.get("foo", cached=True)
+        self.mongo_driver.find_one.return_value = {"version": 5}
+        assert_that(versions.get("foo", cached=True)[0], is_(4))
+        assert_that(versions.get("foo")[0], is_(5))
+
+        now.return_value = d_tz(2014, 1, 1, 12, 0, 5)
+        assert_that(versions.get("foo", cached=True)[0], is_(5))
+
+    def test_versions_are_not_cached_without_a_ttl(self):
+        self.mongo_driver.find_one.return_value = {"version": 4}
+        self.versions.get("foo", cached=True)
+        self.mongo_driver.find_one.return_value = {"version": 5}
+
+        assert_that(self.versions.get("foo", cached=True)[0], is_(5))
+
+    @patch("backdrop.core.timeutils.now")
+    def test_bump_increments_the_version(self, now):
+        now.return_value = d_tz(2014, 1, 1)
+
+        self.versions.bump("foo")
+
+        self.mongo_driver.update.assert_called_once_with(
+            {"_id": "foo"},
+            {"$inc": {"version": 1}, "$set": {"updated_at": d_tz(2014, 1, 1)}},
+            upsert=True)
+
+
+class TestCacheKey(unittest.TestCase):
+    def test_identical_queries_have_the_same_key(self):
+        assert_that(
+            cache_key("foo", 1, Query.create(period=WEEK,
+                                             start_at=d_tz(2013, 4, 1))),
+            is_(cache_key("foo", 1, Query.create(period=WEEK,
+                                                 start_at=d_tz(2013, 4, 1)))))
+
+    def test_order_of_filters_and_collects_does_not_matter(self):
+        assert_that(
+            cache_key("foo", 1, Query.create(
+                filter_by=[["a", "1"], ["b", "2"]],
+                collect=[("x", "sum"), ("y", "sum")])),
+            is_(cache_key("foo", 1, Query.create(
+                filter_by=[["b", "2"], ["a", "1"]],
+                collect=[("y", "sum"), ("x", "sum")]))))
+
+    def test_bucket_version_and_query_are_all_part_of_the_key(self):
+        key = cache_key("foo", 1, Query.create(period=WEEK))
+
+        assert_that(cache_key("bar", 1, Query.create(period=WEEK)),
+                    is_not(key))
+        assert_that(cache_key("foo", 2, Query.create(period=WEEK)),
+                    is_not(key))
+        assert_that(cache_key("foo", 1, Query.create(period=WEEK, limit=1)),
+                    is_not(key))
+
+    def test_query_etag_changes_with_the_bucket_version(self):
+        query = Query.create(period=WEEK)
+
+        assert_that(query_etag("foo", 1, query),
+                    is_(query_etag("foo", 1, Query.create(period=WEEK))))
+        assert_that(query_etag("foo", 2, query),
+                    is_not(query_etag("foo", 1, query)))
+
+
+class TestMemoryStore(unittest.TestCase):
+    def test_values_are_stored(self):
+        store = MemoryStore(2)
+        store.set("a", 1)
+
+        assert_that(store.get("a"), is_(1))
+        assert_that(store.get("b"), none())
+
+    def test_least_recently_used_values_are_evicted(self):
+        store = MemoryStore(2)
+        store.set("a", 1)
+        store.set("b", 2)
+        store.get("a")
+        store.set("c", 3)
+
+        assert_that(store.get("a"), is_(1))
+        assert_that(store.get("b"), none())
+        assert_that(store.get("c"), is_(3))
+
+
+class TestSqliteStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "cache.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_values_are_shared_between_stores_on_the_same_file(self):
+        SqliteStore(2, self.path).set("a", ({"_count": 1},))
+
+        assert_that(SqliteStore(2, self.path).get("a"),
+                    is_(({"_count": 1},)))
+
+    def test_store_is_bounded(self):
+        store = SqliteStore(2, self.path)
+        for key in ["a", "b", "c"]:
+            store.set(key, key)
+
+        stored = [key for key in ["a", "b", "c"] if store.get(key)]
+        assert_that(len(stored), is_(2))
+
+    def test_errors_are_treated_as_misses(self):
+        store = SqliteStore(2, self.directory)
+
+        store.set("a", 1)
+        assert_that(store.get("a"), none())
+
+
+class TestQueryCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = QueryCache(MemoryStore(10))
+        self.load = Mock(return_value=(1, ({"_count": 1},)))
+
+    def test_results_are_loaded_once(self):
+        self.cache.get("foo", 1, Query.create(period=WEEK), self.load)
+        result = self.cache.get("foo", 1, Query.create(period=WEEK),
+                                self.load)
+
+        assert_that(result, is_((1, ({"_count": 1},))))
+        assert_that(self.load.call_count, is_(1))
+
+    def test_results_are_reloaded_when_the_bucket_version_changes(self):
+        self.cache.get("foo", 1, Query.create(period=WEEK), self.load)
+        self.load.return_value = (2, ({"_count": 2},))
+        self.cache.get("foo", 2, Query.create(period=WEEK), self.load)
+
+        assert_that(self.load.call_count, is_(2))
+
+    def test_results_are_cached_under_the_version_they_were_loaded_at(self):
+        # as when the records are read from a secondary that is behind
+        result = self.cache.get("foo", 2, Query.create(period=WEEK),
+                                self.load)
+
+        assert_that(result, is_((1, ({"_count": 1},))))
+        self.cache.get("foo", 1, Query.create(period=WEEK), self.load)
+        self.cache.get("foo", 2, Query.create(period=WEEK), self.load)
+        assert_that(self.load.call_count, is_(2))
+
+    def test_results_are_not_stale_by_default(self):
+        self.cache.get("foo", 1, Query.create(period=WEEK), self.load)
+        self.load.return_value = (2, ({"_count": 2},))
+
+        result = self.cache.get("foo", 2, Query.create(period=WEEK),
+                                self.load)
+
+        assert_that(result, is_((2, ({"_count": 2},))))
+
+    def test_stale_results_are_served_while_they_are_refreshed(self):
+        cache = QueryCache(MemoryStore(10), stale_while_revalidate=True)
+        cache.get("foo", 1, Query.create(period=WEEK), self.load)
+        self.load.return_value = (2, ({"_count": 2},))
+
+        with patch("threading.Thread") as thread:
+            result = cache.get("foo", 2, Query.create(period=WEEK),
+                               self.load)
+            refresh = thread.call_args[1]["target"]
+
+        assert_that(result, is_((1, ({"_count": 1},))))
+        assert_that(self.load.call_count, is_(1))
+
+        refresh()
+
+        assert_that(cache.get("foo", 2, Query.create(period=WEEK),
+                              self.load),
+                    is_((2, ({"_count": 2},))))
+        assert_that(self.load.call_count, is_(2))
+
+    def test_no_cache_is_created_without_a_store(self):
+        assert_that(create_query_cache(None, 10), none())
+
+    def test_unknown_stores_are_rejected(self):
+        self.assertRaises(ValueError, create_query_cache, "memcached", 10)
+
+
+class TestSingleFlight(unittest.TestCase):
+    def test_concurrent_calls_share_one_result(self):
+        flights = SingleFlight()
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def slow():
+            calls.append(1)
+            started.set()
+            release.wait()
+            return "result"
+
+        results = []
+        leader = threading.Thread(
+            target=lambda: results.append(flights.do("a", slow)))
+        leader.start()
+        started.wait()
+        followers = [threading.Thread(
+            target=lambda: results.append(flights.do("a", slow)))
+            for _ in range(3)]
+        for follower in followers:
+            follower.start()
+        # give the followers time to join the leader's flight
+        time.sleep(0.1)
+        release.set()
+        for thread in [leader] + followers:
+            thread.join()
+
+        assert_that(results, is_(["result"] * 4))
+        assert_that(len(calls), is_(1))
+
+    def test_calls_after_a_flight_run_again(self):
+        flights = SingleFlight()
+        function = Mock(return_value=1)
+
+        flights.do("a", function)
+        flights.do("a", function)
+
+        assert_that(function.call_count, is_(2))
+        assert_that(flights.is_running("a"), is_(False))
+
+    def test_errors_are_raised(self):
+        flights = SingleFlight()
+
+        self.assertRaises(ValueError, flights.do, "a",
+                          Mock(side_effect=ValueError))
+        assert_that(flights.is_running("a"), is_(False))
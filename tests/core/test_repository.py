@@ -3,9 +3,10 @@ from collections import namedtuple
 from backdrop.core.bucket import BucketConfig
 from backdrop.core.repository import BucketConfigRepository, UserConfigRepository
 from hamcrest import assert_that, equal_to, is_, has_entries, match_equality
-from mock import Mock
+from mock import Mock, patch
 from nose.tools import *
 from backdrop.core.user import UserConfig
+from tests.support.test_helpers import d_tz
 
 
 class TestBucketRepository(unittest.TestCase):
@@ -95,6 +96,24 @@ class TestBucketRepository(unittest.TestCase):
 
         assert not self.db.create_capped_collection.called
 
+    def test_saving_a_bucket_indexes_it_for_paging(self):
+        bucket = BucketConfig("some_bucket",
+                              data_group="data_group", data_type="type")
+
+        self.bucket_repo.save(bucket)
+
+        self.db.get_collection.assert_called_with("some_bucket")
+        self.mongo_collection.ensure_index.assert_called_with(
+            [("_timestamp", 1), ("_id", 1)])
+
+    def test_saving_a_bucket_does_not_index_it_if_creation_flag_is_off(self):
+        bucket = BucketConfig("some_bucket",
+                              data_group="data_group", data_type="type")
+
+        self.bucket_repo.save(bucket, create_bucket=False)
+
+        assert not self.mongo_collection.ensure_index.called
+
     def test_retrieving_non_existent_bucket_returns_none(self):
         self.mongo_collection.find_one.return_value = None
         bucket = self.bucket_repo.retrieve(name="bucket_name")
@@ -102,6 +121,79 @@ class TestBucketRepository(unittest.TestCase):
         assert_that(bucket, is_(None))
 
 
+class TestBucketRepositoryCache(unittest.TestCase):
+    def setUp(self):
+        self.db = Mock()
+        self.mongo_collection = Mock()
+        self.db.get_collection.return_value = self.mongo_collection
+        self.mongo_collection.find_one.side_effect = lambda query: {
+            "_id": "bucket_name",
+            "name": "bucket_name",
+            "data_group": "data_group",
+            "data_type": "type",
+        }
+        self.bucket_repo = BucketConfigRepository(self.db, cache_ttl=60)
+
+    @patch('backdrop.core.timeutils.now')
+    def test_retrieved_configs_are_cached(self, now):
+        now.return_value = d_tz(2013, 4, 9, 13, 32, 5)
+
+        first = self.bucket_repo.retrieve(name="bucket_name")
+        second = self.bucket_repo.retrieve(name="bucket_name")
+
+        assert_that(self.mongo_collection.find_one.call_count, is_(1))
+        assert_that(second, equal_to(first))
+
+    @patch('backdrop.core.timeutils.now')
+    def test_configs_for_queries_are_cached(self, now):
+        now.return_value = d_tz(2013, 4, 9, 13, 32, 5)
+
+        self.bucket_repo.get_bucket_for_query("data_group", "type")
+        self.bucket_repo.get_bucket_for_query("data_group", "type")
+
+        self.mongo_collection.find_one.assert_called_once_with(
+            {"data_group": "data_group", "data_type": "type"})
+
+    @patch('backdrop.core.timeutils.now')
+    def test_cached_configs_expire(self, now):
+        now.return_value = d_tz(2013, 4, 9, 13, 32, 5)
+        self.bucket_repo.retrieve(name="bucket_name")
+
+        now.return_value = d_tz(2013, 4, 9, 13, 33, 6)
+        self.bucket_repo.retrieve(name="bucket_name")
+
+        assert_that(self.mongo_collection.find_one.call_count, is_(2))
+
+    @patch('backdrop.core.timeutils.now')
+    def test_saving_a_config_invalidates_the_cache(self, now):
+        now.return_value = d_tz(2013, 4, 9, 13, 32, 5)
+        self.bucket_repo.retrieve(name="bucket_name")
+
+        self.bucket_repo.save(BucketConfig("bucket_name",
+                                           data_group="data_group",
+                                           data_type="type"))
+        self.bucket_repo.retrieve(name="bucket_name")
+
+        assert_that(self.mongo_collection.find_one.call_count, is_(2))
+
+    def test_missing_configs_are_not_cached(self):
+        self.mongo_collection.find_one.side_effect = None
+        self.mongo_collection.find_one.return_value = None
+
+        self.bucket_repo.retrieve(name="bucket_name")
+        self.bucket_repo.retrieve(name="bucket_name")
+
+        assert_that(self.mongo_collection.find_one.call_count, is_(2))
+
+    def test_cache_is_off_by_default(self):
+        bucket_repo = BucketConfigRepository(self.db)
+
+        bucket_repo.retrieve(name="bucket_name")
+        bucket_repo.retrieve(name="bucket_name")
+
+        assert_that(self.mongo_collection.find_one.call_count, is_(2))
+
+
 class TestUserConfigRepository(object):
     def setUp(self):
         self.db = Mock()
@@ -0,0 +1,305 @@
+import unittest
+from hamcrest import assert_that, is_, has_entries, has_length, contains, \
+    has_entry, is_not, none
+from mock import Mock, call, ANY
+from nose.tools import assert_raises
+from pymongo.errors import AutoReconnect
+from backdrop.core.nested_merge import InvalidOperationError
+from backdrop.core.records import Record
+from backdrop.core.rollups import Rollups
+from backdrop.core.timeseries import WEEK, DAY
+from backdrop.read.query import Query
+from tests.support.test_helpers import d, d_tz
+
+
+def record(timestamp, **fields):
+    fields["_timestamp"] = timestamp
+    return Record(fields).to_mongo()
+
+
+class TestRollupUpdates(unittest.TestCase):
+    def setUp(self):
+        self.db = Mock()
+        self.mongo_driver = self.db.get_collection.return_value
+        self.rollups = Rollups(self.db, "bucket", fields=["value"],
+                               group_by=["channel"])
+
+    def updates(self):
+        return self.mongo_driver.update_all.call_args[0][0]
+
+    def update_for(self, period, group_key, start_at):
+        for spec, update in self.updates():
+            if spec["period"] == period and spec["group_key"] == group_key \
+                    and spec["_start_at"] == start_at:
+                return spec, update
+
+    def test_rollups_are_kept_in_their_own_collection(self):
+        self.db.get_collection.assert_has_calls([
+            call("_rollups_bucket"),
+            call("bucket", read_from_primary=True)])
+
+    def test_records_are_added_to_every_period(self):
+        self.rollups.update([record(d_tz(2013, 4, 2, 13), channel="web")])
+
+        assert_that(self.updates(), has_length(8))
+        spec, update = self.update_for("week", None, d_tz(2013, 4, 1))
+        assert_that(spec, is_({
+            "period": "week",
+            "group_key": None,
+            "group_value": None,
+            "_start_at": d_tz(2013, 4, 1)
+        }))
+        assert_that(update, is_({"$inc": {"_count": 1}}))
+
+    def test_rollups_are_marked_dirty_when_an_update_fails(self):
+        self.mongo_driver.update_all.side_effect = AutoReconnect()
+
+        assert_raises(AutoReconnect, self.rollups.update,
+                      [record(d_tz(2013, 4, 2))])
+
+        self.mongo_driver.update.assert_called_once_with(
+            {"_id": "_dirty"}, {"$set": {"at": ANY}}, upsert=True)
+
+    def test_records_are_added_to_their_group(self):
+        self.rollups.update([record(d_tz(2013, 4, 2, 13), channel="web")])
+
+        spec, _ = self.update_for("day", "channel", d_tz(2013, 4, 2))
+        assert_that(spec, has_entries({"group_value": "web"}))
+
+    def test_records_in_the_same_period_are_combined(self):
+        self.rollups.update([
+            record(d_tz(2013, 4, 2), value=5),
+            record(d_tz(2013, 4, 3), value=2),
+            record(d_tz(2013, 4, 3), value="lots"),
+        ])
+
+        _, update = self.update_for("week", None, d_tz(2013, 4, 1))
+        assert_that(update, is_({
+            "$inc": {
+                "_count": 3,
+                "stats.value.count": 3,
+                "stats.value.numeric": 2,
+                "stats.value.sum": 7
+            }
+        }))
+
+    def test_records_without_timestamps_are_ignored(self):
+        self.rollups.update([Record({"value": 5}).to_mongo()])
+
+        assert_that(self.mongo_driver.update_all.called, is_(False))
+
+    def test_records_without_a_group_value_are_not_grouped(self):
+        # records that were stored before values were validated
+        document = record(d_tz(2013, 4, 2))
+        document["channel"] = None
+        self.rollups.update([document])
+
+        assert_that(self.update_for("week", None, d_tz(2013, 4, 1)),
+                    is_not(none()))
+        assert_that(self.update_for("week", "channel", d_tz(2013, 4, 1)),
+                    none())
+
+    def test_replaced_records_are_taken_out(self):
+        stored = record(d_tz(2013, 4, 2), _id="a", channel="web", value=5)
+        replacement = record(d_tz(2013, 4, 3), _id="a", channel="phone",
+                             value=7)
+
+        self.rollups.update([replacement], replaced={"a": stored})
+
+        _, update = self.update_for("week", None, d_tz(2013, 4, 1))
+        assert_that(update, is_({"$inc": {
+            "_count": 0,
+            "stats.value.count": 0,
+            "stats.value.numeric": 0,
+            "stats.value.sum": 2
+        }}))
+        _, update = self.update_for("day", "channel", d_tz(2013, 4, 2))
+        assert_that(update["$inc"], has_entries({"_count": -1,
+                                                 "stats.value.sum": -5}))
+
+    def test_records_stored_twice_at_once_replace_themselves(self):
+        self.rollups.update([
+            record(d_tz(2013, 4, 2), _id="a", value=5),
+            record(d_tz(2013, 4, 2), _id="a", value=7),
+        ])
+
+        _, update = self.update_for("week", None, d_tz(2013, 4, 1))
+        assert_that(update["$inc"], has_entries({"_count": 1,
+                                                 "stats.value.sum": 7}))
+
+    def test_stored_records_are_read_by_id(self):
+        self.mongo_driver.find.return_value = [{"_id": "a", "value": 5}]
+
+        stored = self.rollups.stored_records([{"_id": "a"}, {"value": 1}])
+
+        self.mongo_driver.find.assert_called_once_with(
+            {"_id": {"$in": ["a"]}}, ["_id", "ascending"], None)
+        assert_that(stored, is_({"a": {"_id": "a", "value": 5}}))
+
+    def test_documents_without_ids_replace_nothing(self):
+        assert_that(self.rollups.stored_records([{"value": 1}]), is_({}))
+        assert_that(self.mongo_driver.find.called, is_(False))
+
+
+class TestRollupRebuilds(unittest.TestCase):
+    def setUp(self):
+        self.db = Mock()
+        self.collections = {}
+        self.db.get_collection.side_effect = lambda name, **kwargs: \
+            self.collections.setdefault(name, Mock())
+        self.rollups = Rollups(self.db, "bucket", fields=["value"])
+
+    def test_rollups_are_built_aside_and_renamed_into_place(self):
+        self.rollups.rebuild(
+            iter([record(d_tz(2013, 4, i + 1), value=i) for i in range(5)]),
+            chunk_size=2)
+
+        building = self.collections["_rollups_bucket_rebuild"]
+        building.remove.assert_called_once_with({})
+        assert_that(building.update_all.call_count, is_(3))
+        building.rename.assert_called_once_with("_rollups_bucket")
+        assert_that(self.collections["_rollups_bucket"].update_all.called,
+                    is_(False))
+
+    def test_rollups_of_an_empty_bucket_are_cleared(self):
+        self.rollups.rebuild(iter([]))
+
+        self.collections["_rollups_bucket"].remove.assert_called_once_with({})
+        assert_that(self.collections["_rollups_bucket_rebuild"].rename.called,
+                    is_(False))
+
+
+class TestRollupQueries(unittest.TestCase):
+    def setUp(self):
+        self.db = Mock()
+        self.mongo_driver = self.db.get_collection.return_value
+        self.mongo_driver.find_one.return_value = None
+        self.rollups = Rollups(self.db, "bucket", fields=["value"],
+                               group_by=["channel"])
+
+    def test_period_queries_can_be_answered(self):
+        assert_that(self.rollups.can_answer(Query.create(period=WEEK)),
+                    is_(True))
+
+    def test_raw_and_grouped_queries_cannot_be_answered(self):
+        assert_that(self.rollups.can_answer(Query.create()), is_(False))
+        assert_that(self.rollups.can_answer(Query.create(group_by="channel")),
+                    is_(False))
+
+    def test_queries_grouped_by_other_fields_cannot_be_answered(self):
+        assert_that(self.rollups.can_answer(
+            Query.create(period=WEEK, group_by="channel")), is_(True))
+        assert_that(self.rollups.can_answer(
+            Query.create(period=WEEK, group_by="browser")), is_(False))
+        assert_that(self.rollups.can_answer(
+            Query.create(period=WEEK, group_by=["channel", "channel"])),
+            is_(False))
+
+    def test_filtered_queries_cannot_be_answered(self):
+        assert_that(self.rollups.can_answer(
+            Query.create(period=WEEK, filter_by=[["channel", "web"]])),
+            is_(False))
+
+    def test_queries_not_on_period_boundaries_cannot_be_answered(self):
+        assert_that(self.rollups.can_answer(
+            Query.create(period=WEEK, start_at=d_tz(2013, 4, 1),
+                         end_at=d_tz(2013, 4, 15))), is_(True))
+        assert_that(self.rollups.can_answer(
+            Query.create(period=WEEK, start_at=d_tz(2013, 4, 2),
+                         end_at=d_tz(2013, 4, 15))), is_(False))
+
+    def test_dirty_rollups_cannot_answer_queries(self):
+        self.mongo_driver.find_one.return_value = {"_id": "_dirty"}
+
+        assert_that(self.rollups.can_answer(Query.create(period=WEEK)),
+                    is_(False))
+
+    def test_only_rolled_up_collects_can_be_answered(self):
+        assert_that(self.rollups.can_answer(
+            Query.create(period=WEEK, collect=[("value", "mean")])),
+            is_(True))
+        assert_that(self.rollups.can_answer(
+            Query.create(period=WEEK, collect=[("value", "set")])),
+            is_(False))
+        assert_that(self.rollups.can_answer(
+            Query.create(period=WEEK, collect=[("other", "sum")])),
+            is_(False))
+
+    def test_period_group(self):
+        self.mongo_driver.find.return_value = [
+            {"_start_at": d(2013, 4, 1), "_count": 3,
+             "stats": {"value": {"count": 2, "numeric": 2, "sum": 7}}},
+            {"_start_at": d(2013, 4, 8), "_count": 1},
+        ]
+        query = Query.create(period=WEEK, start_at=d_tz(2013, 4, 1),
+                             end_at=d_tz(2013, 4, 15))
+
+        results = self.rollups.group("_week_start_at", query,
+                                     collect=[("value", "mean")])
+
+        self.mongo_driver.find.assert_called_once_with(
+            {"period": "week", "group_key": None, "_count": {"$gt": 0},
+             "_start_at": {"$gte": d_tz(2013, 4, 1),
+                           "$lt": d_tz(2013, 4, 15)}},
+            ["_start_at", "ascending"], None)
+        assert_that(results, is_([
+            {"_week_start_at": d(2013, 4, 1), "_count": 3, "value:mean": 3.5},
+            {"_week_start_at": d(2013, 4, 8), "_count": 1, "value:mean": None},
+        ]))
+
+    def test_period_group_with_non_numeric_values_cannot_be_summed(self):
+        self.mongo_driver.find.return_value = [
+            {"_start_at": d(2013, 4, 1), "_count": 2,
+             "stats": {"value": {"count": 2, "numeric": 1, "sum": 7}}},
+        ]
+
+        self.assertRaises(InvalidOperationError, self.rollups.group,
+                          "_week_start_at", Query.create(period=WEEK),
+                          collect=[("value", "sum")])
+
+    def test_multi_group(self):
+        self.mongo_driver.find.return_value = [
+            {"group_value": "web", "_start_at": d(2013, 4, 8), "_count": 1,
+             "stats": {"value": {"count": 1, "numeric": 1, "sum": 4}}},
+            {"group_value": "phone", "_start_at": d(2013, 4, 1), "_count": 2,
+             "stats": {"value": {"count": 2, "numeric": 2, "sum": 3}}},
+            {"group_value": "web", "_start_at": d(2013, 4, 1), "_count": 2,
+             "stats": {"value": {"count": 2, "numeric": 2, "sum": 6}}},
+        ]
+
+        results = self.rollups.multi_group(
+            "channel", "_week_start_at", Query.create(period=WEEK),
+            collect=[("value", "sum")])
+
+        assert_that(results, contains(
+            has_entries({
+                "channel": "phone",
+                "_count": 2,
+                "_group_count": 1,
+                "value:sum": 3,
+            }),
+            has_entries({
+                "channel": "web",
+                "_count": 3,
+                "_group_count": 2,
+                "value:sum": 10,
+                "_subgroup": contains(
+                    has_entries({"_week_start_at": d(2013, 4, 1),
+                                 "_count": 2, "value:sum": 6}),
+                    has_entries({"_week_start_at": d(2013, 4, 8),
+                                 "_count": 1, "value:sum": 4}),
+                )
+            }),
+        ))
+
+    def test_multi_group_is_sorted_and_limited(self):
+        self.mongo_driver.find.return_value = [
+            {"group_value": "phone", "_start_at": d(2013, 4, 1), "_count": 2},
+            {"group_value": "web", "_start_at": d(2013, 4, 1), "_count": 5},
+        ]
+
+        results = self.rollups.multi_group(
+            "channel", "_day_start_at", Query.create(period=DAY),
+            sort=["_count", "descending"], limit=1)
+
+        assert_that(results, contains(has_entry("channel", "web")))
@@ -0,0 +1,70 @@
+import random
+import unittest
+from hamcrest import assert_that, is_, none, close_to
+from backdrop.core import sketch
+
+
+class TestSketch(unittest.TestCase):
+    def test_quantiles_are_within_the_relative_accuracy(self):
+        values = [random.uniform(0.1, 10000) for _ in range(10000)]
+        values.sort()
+        s = sketch.from_values(values)
+
+        for q in [0.01, 0.5, 0.9, 0.99]:
+            expected = values[int(q * (len(values) - 1))]
+            assert_that(sketch.quantile(s, q),
+                        close_to(expected, expected * 0.02))
+
+    def test_zeros_and_negative_values_are_counted(self):
+        s = sketch.from_values([-100, -10, 0, 0, 10])
+
+        assert_that(round(sketch.quantile(s, 0)), is_(-100))
+        assert_that(sketch.quantile(s, 0.5), is_(0.0))
+        assert_that(round(sketch.quantile(s, 1)), is_(10))
+
+    def test_merging_is_the_same_as_sketching_all_the_values(self):
+        merged = sketch.merge([sketch.from_values([1, 2, 3]),
+                               sketch.from_values([3, 4])])
+
+        assert_that(merged, is_(sketch.from_values([1, 2, 3, 3, 4])))
+
+    def test_bins_from_javascript_are_merged(self):
+        merged = sketch.merge([
+            {"p": {"35": 2.0}, "n": {}, "z": 0.0, "c": 2.0, "b": 1.0,
+             "e": False},
+            sketch.from_values([2])])
+
+        assert_that(merged["p"], is_({35: 3.0}))
+
+    def test_number_of_bins_is_bounded(self):
+        s = sketch.from_values([1.1 ** i for i in range(5000)])
+
+        assert_that(s["b"], is_(sketch.MAX_BINS))
+        assert_that(len(s["p"]), is_(sketch.MAX_BINS))
+        assert_that(s["c"], is_(5000))
+
+    def test_values_that_are_not_numbers_are_flagged(self):
+        s = sketch.from_values([1, "one", None])
+
+        assert_that(s["e"], is_(True))
+        assert_that(s["c"], is_(1))
+
+    def test_sketches_from_bins_are_the_same_as_from_values(self):
+        values = [-3, -3, 0, 1, 2.5, 2.5, 1000]
+        counts = {}
+        for value in values:
+            if value == 0:
+                key = ("z", None)
+            else:
+                key = ("p" if value > 0 else "n", sketch._index(abs(value)))
+            counts[key] = counts.get(key, 0) + 1
+
+        s = sketch.from_bins(
+            [{"s": sign, "i": index, "c": count}
+             for (sign, index), count in counts.items()] +
+            [{"s": "e", "i": None, "c": 2}, {"s": None, "i": None, "c": 1}])
+
+        assert_that(s, is_(sketch.from_values(values + ["one", None])))
+
+    def test_empty_sketches_have_no_quantiles(self):
+        assert_that(sketch.quantile(sketch.empty(), 0.5), none())
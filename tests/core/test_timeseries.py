@@ -1,7 +1,11 @@
 from unittest import TestCase
 import datetime
-from hamcrest import assert_that, is_, contains
-from backdrop.core.timeseries import timeseries, WEEK, MONTH, DAY, HOUR
+import threading
+from hamcrest import assert_that, is_, is_not, contains, same_instance
+from mock import patch
+from backdrop.core import timeseries as timeseries_module
+from backdrop.core.timeseries import timeseries, WEEK, MONTH, DAY, HOUR, \
+    period_range_table, fill_timeseries
 from tests.support.test_helpers import d, d_tz
 
 
@@ -53,6 +57,138 @@ class TestTimeseries(TestCase):
             {"_start_at": d_tz(2013, 4, 22), "_end_at": d_tz(2013, 4, 29), "value": 0},
         ))
 
+    def test_adds_data_without_a_timezone_at_appropriate_places(self):
+        data = [
+            {"_start_at": d(2013, 4, 1, 1), "_end_at": d(2013, 4, 1, 2), "value": 12}
+        ]
+
+        ts = timeseries(start=d_tz(2013, 4, 1),
+                        end=d_tz(2013, 4, 1, 3),
+                        period=HOUR,
+                        data=data,
+                        default={"value": 0})
+
+        assert_that([entry["value"] for entry in ts], contains(0, 12, 0))
+
+    def test_entries_for_missing_periods_are_not_shared(self):
+        first = timeseries(start=d_tz(2013, 4, 1), end=d_tz(2013, 4, 15),
+                           period=WEEK, data=[], default={"value": 0})
+        second = timeseries(start=d_tz(2013, 4, 1), end=d_tz(2013, 4, 15),
+                            period=WEEK, data=[], default={"value": 0})
+        other = timeseries(start=d_tz(2013, 4, 1), end=d_tz(2013, 4, 15),
+                           period=WEEK, data=[], default={"value": None})
+
+        assert_that(second[0], is_(first[0]))
+        assert_that(second[0], is_not(same_instance(first[0])))
+        assert_that(other[0]["value"], is_(None))
+
+
+class TestFillTimeseries(TestCase):
+    def setUp(self):
+        self.data = {
+            d_tz(2013, 4, day): {"_start_at": d_tz(2013, 4, day), "value": day}
+            for day in [1, 2, 3, 5]
+        }
+
+    def fill(self, series, sparse=False):
+        return fill_timeseries(start=d_tz(2013, 4, 1),
+                               end=d_tz(2013, 4, 6),
+                               period=DAY,
+                               series=series,
+                               default={"value": 0},
+                               sparse=sparse)
+
+    def test_each_series_is_filled(self):
+        data = self.data
+        filled = self.fill([[data[d_tz(2013, 4, 5)], data[d_tz(2013, 4, 1)]],
+                            []])
+
+        assert_that([entry["value"] for entry in filled[0]],
+                    contains(1, 0, 0, 0, 5))
+        assert_that([entry["value"] for entry in filled[1]],
+                    contains(0, 0, 0, 0, 0))
+
+    def test_sparse_series_only_have_their_data(self):
+        data = self.data
+        filled = self.fill([[data[d_tz(2013, 4, 5)], data[d_tz(2013, 4, 1)]],
+                            [data[d_tz(2013, 4, day)] for day in [1, 2, 3]]],
+                           sparse=True)
+
+        assert_that([entry["value"] for entry in filled[0]], contains(1, 5))
+        assert_that([entry["value"] for entry in filled[1]],
+                    contains(1, 2, 3, 0, 0))
+
+    def test_changing_a_filled_entry_does_not_change_the_next_fill(self):
+        first = self.fill([[]])
+        first[0][0]["value"] = 99
+        first[0][1]["extra"] = True
+
+        second = self.fill([[]])
+
+        assert_that(second[0][0]["value"], is_(0))
+        assert_that(second[0][1], is_({"_start_at": d_tz(2013, 4, 2),
+                                       "_end_at": d_tz(2013, 4, 3),
+                                       "value": 0}))
+
+    def test_data_that_does_not_start_a_period_is_left_out(self):
+        filled = self.fill([[{"_start_at": d_tz(2013, 4, 1, 12)}]],
+                           sparse=True)
+
+        assert_that(filled[0], is_([]))
+
+
+class TestPeriodRangeTable(TestCase):
+    def test_that_tables_are_shared_for_the_same_range(self):
+        table = period_range_table(DAY, d_tz(2013, 4, 1), d_tz(2013, 4, 3))
+
+        assert_that(period_range_table(DAY, d_tz(2013, 4, 1),
+                                       d_tz(2013, 4, 3)),
+                    same_instance(table))
+        assert_that(period_range_table(HOUR, d_tz(2013, 4, 1),
+                                       d_tz(2013, 4, 3)),
+                    is_not(same_instance(table)))
+
+    def test_that_it_has_the_position_of_each_period(self):
+        table = period_range_table(MONTH, d_tz(2013, 1, 1), d_tz(2013, 3, 1))
+
+        assert_that(len(table), is_(2))
+        assert_that(table.positions, is_({d_tz(2013, 1, 1): 0,
+                                          d_tz(2013, 2, 1): 1}))
+
+    @patch("backdrop.core.timeseries.MAX_TABLED_PERIODS", 10)
+    def test_that_tables_are_dropped_when_there_are_too_many_periods(self):
+        table = period_range_table(DAY, d_tz(2012, 4, 1), d_tz(2012, 4, 8))
+        period_range_table(DAY, d_tz(2012, 5, 1), d_tz(2012, 5, 8))
+
+        assert_that(period_range_table(DAY, d_tz(2012, 4, 1),
+                                       d_tz(2012, 4, 8)),
+                    is_not(same_instance(table)))
+
+    @patch("backdrop.core.timeseries.MAX_TABLED_PERIODS", 10)
+    def test_that_tables_with_too_many_periods_are_not_kept(self):
+        table = period_range_table(DAY, d_tz(2011, 4, 1), d_tz(2011, 4, 20))
+
+        assert_that(period_range_table(DAY, d_tz(2011, 4, 1),
+                                       d_tz(2011, 4, 20)),
+                    is_not(same_instance(table)))
+
+    @patch("backdrop.core.timeseries.MAX_TABLED_PERIODS", 100)
+    def test_that_tables_made_at_the_same_time_are_counted_once(self):
+        def make_tables():
+            for day in range(1, 20):
+                period_range_table(DAY, d_tz(2010, 4, day),
+                                   d_tz(2010, 5, day))
+
+        threads = [threading.Thread(target=make_tables) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert_that(timeseries_module._tabled_periods[0],
+                    is_(sum(len(table) for table in
+                            timeseries_module._range_tables.values())))
+
 
 class TestWeek_start(TestCase):
     def test_that_it_returns_previous_monday_for_midweek(self):
@@ -1,12 +1,15 @@
 import datetime
 import unittest
 import bson
+import pytz
+from dateutil import parser
 
 from hamcrest import *
 from hamcrest import assert_that, is_
 
 from backdrop.core.validation import value_is_valid_id,\
-    value_is_valid, key_is_valid, value_is_valid_datetime_string, key_is_reserved, validate_record_data
+    value_is_valid, key_is_valid, value_is_valid_datetime_string, key_is_reserved, validate_record_data, \
+    parse_datetime_string
 from tests.support.validity_matcher import is_invalid_with_message, is_valid
 
 valid_string = 'validstring'
@@ -116,6 +119,27 @@ class TimestampValueIsInDateTimeFormat(unittest.TestCase):
             is_(True))
 
 
+class ParseDatetimeStringTestCase(unittest.TestCase):
+    def test_times_are_parsed_with_their_offset(self):
+        time = parse_datetime_string('2014-03-03T10:00:00-05:30')
+
+        assert_that(time.utcoffset(), is_(datetime.timedelta(hours=-5.5)))
+        assert_that(time.astimezone(pytz.UTC),
+                    is_(datetime.datetime(2014, 3, 3, 15, 30,
+                                          tzinfo=pytz.UTC)))
+
+    def test_times_are_the_same_as_dateutil_gives(self):
+        for value in ['2014-01-01T00:00:00+00:00', '2014-01-01T00:00:00Z',
+                      '2014-01-01T00:00:00-0100', '2014-01-01T23:59:59+23:59']:
+            assert_that(parse_datetime_string(value), is_(parser.parse(value)))
+
+    def test_invalid_times_are_none(self):
+        for value in ['2014-02-30T00:00:00Z', '2014-01-01T24:00:00Z',
+                      '2013-01-01T00:00:00+99:99', '2014-01-01T00:00:00',
+                      '2014-01-01T00:00:00+00:00 and more']:
+            assert_that(parse_datetime_string(value), is_(None))
+
+
 class IdValueIsValidTestCase(unittest.TestCase):
     def test_id_value_cannot_be_empty(self):
         assert_that(value_is_valid_id(''), is_(False))
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+import unittest
+from bson import ObjectId
+from hamcrest import assert_that, is_
+from backdrop.read import formats
+from backdrop.read.formats import flatten, columns_of, stream_csv, \
+    stream_ndjson
+from tests.support.test_helpers import d_tz
+
+
+class TestFlatten(unittest.TestCase):
+    def test_groups_are_rows(self):
+        data = ({"name": "Max", "_count": 2}, {"name": "Gareth", "_count": 1})
+
+        assert_that(list(flatten(data)), is_(list(data)))
+
+    def test_periods_of_groups_are_rows(self):
+        data = ({"name": "Max", "_count": 3, "values": [
+            {"_start_at": d_tz(2014, 1, 6), "_count": 1},
+            {"_start_at": d_tz(2014, 1, 13), "_count": 2},
+        ]},)
+
+        assert_that(list(flatten(data)), is_([
+            {"name": "Max", "_start_at": d_tz(2014, 1, 6), "_count": 1},
+            {"name": "Max", "_start_at": d_tz(2014, 1, 13), "_count": 2},
+        ]))
+
+    def test_subgroups_and_their_periods_are_rows(self):
+        period = {"_start_at": d_tz(2014, 1, 6), "_count": 3}
+        subgroup = {"place": "Keswick", "_count": 3, "values": [period]}
+        data = ({"name": "Max", "_count": 3, "_group_count": 1,
+                 "_subgroup": [subgroup]},)
+
+        assert_that(list(flatten(data)), is_([
+            {"name": "Max", "_group_count": 1, "place": "Keswick",
+             "_start_at": d_tz(2014, 1, 6), "_count": 3},
+        ]))
+
+    def test_columns_are_those_of_every_row(self):
+        assert_that(columns_of([{"b": 1}, {"a": 1, "b": 2}]),
+                    is_(["a", "b"]))
+
+
+class TestStreamCsv(unittest.TestCase):
+    def test_rows_are_written_with_a_header(self):
+        csv = "".join(stream_csv(iter([{"a": 1, "b": "x"}, {"a": 2}]),
+                                 ["a", "b"]))
+
+        assert_that(csv, is_("a,b\r\n1,x\r\n2,\r\n"))
+
+    def test_columns_default_to_those_of_the_first_row(self):
+        csv = "".join(stream_csv(iter([{"b": 1, "a": 2}, {"a": 3, "c": 4}])))
+
+        assert_that(csv, is_("a,b\r\n2,1\r\n3,\r\n"))
+
+    def test_nothing_is_written_without_rows(self):
+        assert_that("".join(stream_csv(iter([]))), is_(""))
+
+    def test_values_are_written_as_in_json(self):
+        _id = ObjectId()
+        csv = "".join(stream_csv([{
+            "_id": _id,
+            "_timestamp": d_tz(2014, 1, 1),
+            "name": u"Zo\xeb",
+            "values": [1, 2],
+            "flag": True,
+            "value": 0.1,
+        }], ["_id", "_timestamp", "name", "values", "flag", "value"]))
+
+        assert_that(csv.splitlines()[1], is_(
+            '%s,2014-01-01T00:00:00+00:00,Zo\xc3\xab,"[1,2]",true,0.1' % _id))
+
+    def test_rows_are_written_in_chunks(self):
+        formats.CHUNK_SIZE, chunk_size = 10, formats.CHUNK_SIZE
+        try:
+            chunks = list(stream_csv([{"a": "xxxxxx"}] * 4))
+        finally:
+            formats.CHUNK_SIZE = chunk_size
+
+        assert_that(len(chunks), is_(3))
+        assert_that("".join(chunks), is_("a\r\n" + "xxxxxx\r\n" * 4))
+
+
+class TestStreamNdjson(unittest.TestCase):
+    def test_rows_are_written_a_line_each(self):
+        ndjson = "".join(stream_ndjson(iter([
+            {"_timestamp": d_tz(2014, 1, 1)},
+            {"name": "Max"}])))
+
+        assert_that(ndjson, is_(
+            '{"_timestamp":"2014-01-01T00:00:00+00:00"}\n'
+            '{"name":"Max"}\n'))
@@ -0,0 +1,42 @@
+import unittest
+from base64 import urlsafe_b64encode
+from bson import ObjectId, json_util
+from hamcrest import assert_that, is_
+from backdrop.read.page_token import encode_page_token, decode_page_token
+from tests.support.test_helpers import d_tz
+
+
+class TestPageToken(unittest.TestCase):
+    def test_token_holds_timestamp_and_id(self):
+        token = encode_page_token({"_timestamp": d_tz(2014, 1, 1, 12),
+                                   "_id": "abc",
+                                   "name": "Max"})
+
+        assert_that(decode_page_token(token), is_((d_tz(2014, 1, 1, 12),
+                                                   "abc")))
+
+    def test_token_keeps_object_ids(self):
+        _id = ObjectId()
+        token = encode_page_token({"_timestamp": d_tz(2014, 1, 1),
+                                   "_id": _id})
+
+        assert_that(decode_page_token(token)[1], is_(_id))
+
+    def test_token_for_a_document_without_a_timestamp(self):
+        token = encode_page_token({"_id": "abc"})
+
+        assert_that(decode_page_token(token), is_((None, "abc")))
+
+    def test_invalid_tokens_raise_value_error(self):
+        for token in ["not-a-token", "NQ==", u"\xe9"]:
+            self.assertRaises(ValueError, decode_page_token, token)
+
+    def test_tokens_holding_query_operators_raise_value_error(self):
+        for values in [[None, {"$ne": None}],
+                       [{"$where": "sleep(1000)"}, "abc"],
+                       [None, ["abc"]],
+                       [None, True],
+                       {"_timestamp": None, "_id": "abc"},
+                       [None, "abc", "def"]]:
+            token = urlsafe_b64encode(json_util.dumps(values))
+            self.assertRaises(ValueError, decode_page_token, token)
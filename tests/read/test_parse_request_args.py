@@ -6,6 +6,7 @@ from hamcrest import *
 import pytz
 from werkzeug.datastructures import MultiDict
 
+from backdrop.read.page_token import encode_page_token
 from backdrop.read.query import parse_request_args
 
 
@@ -87,6 +88,14 @@ class Test_parse_request_args(unittest.TestCase):
 
         assert_that(args['group_by'], is_('foobar'))
 
+    def test_group_by_lists_are_parsed(self):
+        request_args = MultiDict([("group_by", "foo,bar"),
+                                  ("group_by", "baz")])
+
+        args = parse_request_args(request_args)
+
+        assert_that(args['group_by'], is_(['foo', 'bar', 'baz']))
+
     def test_sort_is_parsed(self):
         request_args = MultiDict([
             ("sort_by", "foo:ascending")])
@@ -142,3 +151,40 @@ class Test_parse_request_args(unittest.TestCase):
         args = parse_request_args(request_args)
 
         assert_that(args['collect'], is_([("some_key", "mean")]))
+
+    def test_fields_are_parsed(self):
+        request_args = MultiDict([
+            ("fields", "name,value"),
+            ("fields", "_timestamp")
+        ])
+
+        args = parse_request_args(request_args)
+
+        assert_that(args['fields'], is_(["name", "value", "_timestamp"]))
+
+    def test_fields_are_none_when_not_given(self):
+        args = parse_request_args(MultiDict([]))
+
+        assert_that(args['fields'], is_(None))
+
+    def test_after_is_parsed(self):
+        request_args = MultiDict([
+            ("after", encode_page_token({
+                "_timestamp": datetime(2014, 1, 1, tzinfo=pytz.UTC),
+                "_id": "abc"}))
+        ])
+
+        args = parse_request_args(request_args)
+
+        assert_that(args['after'],
+                    is_((datetime(2014, 1, 1, tzinfo=pytz.UTC), "abc")))
+
+    def test_after_is_none_when_not_given(self):
+        args = parse_request_args(MultiDict([]))
+
+        assert_that(args['after'], is_(None))
+
+    def test_sparse_is_parsed(self):
+        assert_that(parse_request_args(MultiDict([("sparse", "true")]))
+                    ['sparse'], is_(True))
+        assert_that(parse_request_args(MultiDict([]))['sparse'], is_(False))
@@ -2,7 +2,7 @@ from nose.tools import *
 from hamcrest import *
 from backdrop.core.timeseries import MONTH
 from backdrop.read.response import PeriodGroupedData
-from tests.support.test_helpers import d
+from tests.support.test_helpers import d, d_tz
 
 
 class TestPeriodGroupedData(object):
@@ -36,3 +36,64 @@ class TestPeriodGroupedData(object):
 
         assert_that(values, has_length(3))
         assert_that(values, has_item(has_entry('volume:sum', None)))
+
+    def test_filled_data_with_picked_collect_methods(self):
+        stub_document = {
+            "_subgroup": [{
+                "_month_start_at": d(2013, 9, 1),
+                "_count": 1,
+                "volume:max": 4
+            }]
+        }
+        stub_collect = [('volume', 'max'), ('volume', 'first')]
+
+        data = PeriodGroupedData([stub_document], MONTH)
+        data.fill_missing_periods(d(2013, 7, 1), d(2013, 10, 1), stub_collect)
+        values = data.data()[0]["values"]
+
+        assert_that(values[0], has_entries({'volume:max': None,
+                                            'volume:first': None}))
+        assert_that(values[2], has_entry('volume:max', 4))
+
+    def test_groups_of_several_fields_keep_their_subgroups(self):
+        stub_document = {
+            "name": "Max",
+            "_count": 1,
+            "_subgroup": [{
+                "place": "Keswick",
+                "_count": 1,
+                "_subgroup": [{
+                    "_month_start_at": d(2013, 9, 1),
+                    "_count": 1
+                }]
+            }]
+        }
+
+        data = PeriodGroupedData([stub_document], MONTH)
+        data.fill_missing_periods(d(2013, 7, 1), d(2013, 10, 1))
+        group = data.data()[0]
+
+        assert_that(group, has_entries({"name": "Max", "_count": 1}))
+        assert_that(group["_subgroup"][0], has_entry("place", "Keswick"))
+        assert_that(group["_subgroup"][0]["values"], has_length(3))
+
+    def test_sparse_fill_leaves_mostly_empty_groups_unfilled(self):
+        stub_documents = [{
+            "name": "Max",
+            "_subgroup": [{"_month_start_at": d(2013, 9, 1), "_count": 1}]
+        }, {
+            "name": "Sue",
+            "_subgroup": [{"_month_start_at": d(2013, 7, 1), "_count": 1},
+                          {"_month_start_at": d(2013, 9, 1), "_count": 2}]
+        }]
+
+        data = PeriodGroupedData(stub_documents, MONTH)
+        data.fill_missing_periods(d(2013, 7, 1), d(2013, 10, 1), sparse=True)
+        groups = data.data()
+
+        assert_that(groups[0]["values"], contains(
+            has_entries({"_start_at": d_tz(2013, 9, 1), "_count": 1})))
+        assert_that(groups[1]["values"], contains(
+            has_entry("_count", 1),
+            has_entries({"_start_at": d_tz(2013, 8, 1), "_count": 0}),
+            has_entry("_count", 2)))
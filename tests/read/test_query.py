@@ -1,5 +1,7 @@
 from unittest import TestCase
 from hamcrest import *
+from mock import Mock
+from backdrop.core.timeseries import WEEK
 from backdrop.read.query import Query
 from tests.support.test_helpers import d_tz
 
@@ -34,3 +36,46 @@ class TestBuild_query(TestCase):
         query = Query.create(filter_by= [[ "foo", "bar" ], ["foobar", "yes"]])
         assert_that(query.to_mongo_query(),
                     is_({ "foo": "bar", "foobar": "yes" }))
+
+
+class TestExecute(TestCase):
+    def test_group_by_keys_are_a_list(self):
+        assert_that(Query.create().group_by_keys, is_([]))
+        assert_that(Query.create(group_by="a").group_by_keys, is_(["a"]))
+        assert_that(Query.create(group_by=["a", "b"]).group_by_keys,
+                    is_(["a", "b"]))
+
+    def test_grouping_on_several_keys_is_one_nested_group(self):
+        repository = Mock()
+        repository.nested_group.return_value = []
+        query = Query.create(group_by=["a", "b", "c"])
+
+        query.execute(repository)
+
+        repository.nested_group.assert_called_once_with(
+            ["a", "b", "c"], query, None, None, [])
+
+    def test_period_is_grouped_on_after_the_keys(self):
+        repository = Mock()
+        repository.nested_group.return_value = []
+        query = Query.create(group_by=["a", "b"], period=WEEK)
+
+        query.execute(repository)
+
+        repository.nested_group.assert_called_once_with(
+            ["a", "b", "_week_start_at"], query,
+            sort=None, limit=None, collect=[])
+
+    def test_sparse_period_groups_are_filled_sparsely(self):
+        repository = Mock()
+        repository.multi_group.return_value = [{
+            "a": "x", "_count": 1,
+            "_subgroup": [{"_week_start_at": d_tz(2013, 4, 8), "_count": 1}]
+        }]
+        query = Query.create(group_by="a", period=WEEK, sparse=True,
+                             start_at=d_tz(2013, 4, 1),
+                             end_at=d_tz(2013, 4, 29))
+
+        result = query.execute(repository)
+
+        assert_that(result.data()[0]["values"], has_length(1))
@@ -0,0 +1,165 @@
+import json
+import unittest
+from hamcrest import assert_that, is_, has_entries, contains
+from mock import patch
+from backdrop.core.database import InvalidOperationError
+from backdrop.read import api
+from backdrop.read.query import Query
+from backdrop.read.response import SimpleData
+from backdrop.core.timeseries import WEEK
+from tests.support.bucket import stub_bucket_retrieve_by_name, \
+    stub_bucket_versions
+from tests.support.test_helpers import has_status
+
+
+class StubData(object):
+    def __init__(self, data):
+        self._data = data
+
+    def data(self):
+        return self._data
+
+
+class BatchApiTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = api.app.test_client()
+        stub_bucket_versions(self)
+
+    def post_batch(self, queries):
+        return self.app.post('/_batch',
+                             data=json.dumps({"queries": queries}),
+                             content_type='application/json')
+
+    @stub_bucket_retrieve_by_name("foo")
+    @patch('backdrop.core.bucket.Bucket.query')
+    def test_queries_are_executed(self, mock_query):
+        mock_query.return_value = StubData(({"_count": 1},))
+
+        response = self.post_batch([
+            {"bucket": "foo", "query": {"period": "week"}},
+            {"bucket": "foo", "query": {"group_by": "name",
+                                        "filter_by": ["plays:guitar",
+                                                      "name:max"]}},
+        ])
+
+        assert_that(response, has_status(200))
+        assert_that(json.loads(response.data), is_({"data": [
+            {"status": "ok", "data": [{"_count": 1}]},
+            {"status": "ok", "data": [{"_count": 1}]},
+        ]}))
+        mock_query.assert_any_call(Query.create(period=WEEK))
+        mock_query.assert_any_call(Query.create(
+            group_by="name",
+            filter_by=[["plays", "guitar"], ["name", "max"]]))
+
+    @stub_bucket_retrieve_by_name("foo")
+    @patch('backdrop.core.bucket.Bucket.query')
+    def test_each_query_has_its_own_status(self, mock_query):
+        mock_query.return_value = StubData(())
+
+        response = self.post_batch([
+            {"bucket": "foo", "query": {"period": "week"}},
+            {"bucket": "bar", "query": {"period": "week"}},
+            {"bucket": "foo", "query": {"period": "fortnight"}},
+            "not a query",
+        ])
+
+        assert_that(json.loads(response.data)["data"], contains(
+            has_entries({"status": "ok"}),
+            has_entries({"status": "error", "code": 404,
+                         "message": "bucket not found"}),
+            has_entries({"status": "error", "code": 400}),
+            has_entries({"status": "error", "code": 400,
+                         "message": "invalid query"}),
+        ))
+
+    @stub_bucket_retrieve_by_name("foo")
+    @patch('backdrop.core.bucket.Bucket.query')
+    def test_invalid_collects_are_errors(self, mock_query):
+        mock_query.side_effect = InvalidOperationError
+
+        response = self.post_batch([
+            {"bucket": "foo", "query": {"group_by": "name",
+                                        "collect": "value:sum"}},
+        ])
+
+        assert_that(json.loads(response.data)["data"], contains(
+            has_entries({"status": "error", "code": 400,
+                         "message": "invalid collect for that data"})))
+
+    @stub_bucket_retrieve_by_name("foo")
+    def test_formats_are_not_supported(self):
+        response = self.post_batch([
+            {"bucket": "foo", "query": {"period": "week", "format": "csv"}},
+        ])
+
+        assert_that(json.loads(response.data)["data"], contains(
+            has_entries({"status": "error", "code": 400,
+                         "message": "format is not supported in a batch"})))
+
+    @stub_bucket_retrieve_by_name("foo")
+    def test_explain_is_not_supported(self):
+        response = self.post_batch([
+            {"bucket": "foo", "query": {"period": "week", "explain": "true"}},
+        ])
+
+        assert_that(json.loads(response.data)["data"], contains(
+            has_entries({"status": "error", "code": 400,
+                         "message": "explain is not supported in a batch"})))
+
+    @stub_bucket_retrieve_by_name("foo", raw_queries_allowed=True)
+    @patch('backdrop.core.bucket.Bucket.query')
+    def test_raw_queries_need_a_limit(self, mock_query):
+        response = self.post_batch([
+            {"bucket": "foo", "query": {}},
+            {"bucket": "foo", "query": {"limit": 1001}},
+        ])
+
+        assert_that(json.loads(response.data)["data"], contains(
+            has_entries({"status": "error", "code": 400,
+                         "message": "raw queries in a batch need a limit of "
+                                    "at most 1000"}),
+            has_entries({"status": "error", "code": 400})))
+        assert_that(mock_query.called, is_(False))
+
+    @stub_bucket_retrieve_by_name("foo", raw_queries_allowed=True)
+    @patch('backdrop.core.bucket.Bucket.query')
+    def test_raw_queries_with_a_limit_are_executed(self, mock_query):
+        mock_query.return_value = SimpleData(iter([{"name": "Max"}]))
+
+        response = self.post_batch([
+            {"bucket": "foo", "query": {"limit": 10}},
+        ])
+
+        assert_that(json.loads(response.data)["data"], contains(
+            has_entries({"status": "ok", "data": [{"name": "Max"}]})))
+        mock_query.assert_called_once_with(Query.create(limit=10))
+
+    @patch('backdrop.core.bucket.Bucket.query')
+    def test_unexpected_errors_do_not_fail_the_batch(self, mock_query):
+        with patch.object(api.bucket_repository, 'retrieve') as retrieve:
+            retrieve.side_effect = Exception("database on fire")
+
+            response = self.post_batch([{"bucket": "foo"}])
+
+        assert_that(response, has_status(200))
+        assert_that(json.loads(response.data)["data"], contains(
+            has_entries({"status": "error", "code": 500})))
+
+    def test_batch_must_be_a_list_of_queries(self):
+        response = self.app.post('/_batch', data="nonsense",
+                                 content_type='application/json')
+
+        assert_that(response, has_status(400))
+
+    def test_batch_size_is_limited(self):
+        response = self.post_batch([{"bucket": "foo"}] * 21)
+
+        assert_that(response, has_status(400))
+
+    def test_cors_preflight_allows_json_requests(self):
+        response = self.app.open('/_batch', method='OPTIONS')
+
+        assert_that(response.headers['Access-Control-Allow-Origin'], is_('*'))
+        assert_that(response.headers['Access-Control-Allow-Headers'],
+                    is_('cache-control, content-type'))
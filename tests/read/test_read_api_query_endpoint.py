@@ -1,13 +1,19 @@
+import json
 import unittest
 import urllib
+import urlparse
 import datetime
 from hamcrest import *
 from mock import patch, Mock
 import pytz
+from backdrop.core.query_cache import QueryCache, MemoryStore, query_etag
 from backdrop.core.timeseries import WEEK
 from backdrop.read import api
+from backdrop.read.page_token import encode_page_token
 from backdrop.read.query import Query
-from tests.support.bucket import stub_bucket_retrieve_by_name
+from backdrop.read.response import SimpleData
+from tests.support.bucket import stub_bucket_retrieve_by_name, \
+    stub_bucket_versions
 from tests.support.test_helpers import has_status
 
 from warnings import warn
@@ -25,6 +31,7 @@ warn("This test is deprecated in favour of "
 class QueryingApiTestCase(unittest.TestCase):
     def setUp(self):
         self.app = api.app.test_client()
+        stub_bucket_versions(self)
 
     @stub_bucket_retrieve_by_name("foo")
     @patch('backdrop.core.bucket.Bucket.query')
@@ -50,6 +57,14 @@ class QueryingApiTestCase(unittest.TestCase):
         mock_query.assert_called_with(
             Query.create(group_by=u'zombies'))
 
+    @stub_bucket_retrieve_by_name("foo")
+    @patch('backdrop.core.bucket.Bucket.query')
+    def test_group_by_several_fields_query_is_executed(self, mock_query):
+        mock_query.return_value = NoneData()
+        self.app.get('/foo?group_by=zombies,ghosts&group_by=ghouls')
+        mock_query.assert_called_with(
+            Query.create(group_by=[u'zombies', u'ghosts', u'ghouls']))
+
     @stub_bucket_retrieve_by_name("foo", raw_queries_allowed=True)
     @patch('backdrop.core.bucket.Bucket.query')
     def test_query_with_start_and_end_is_executed(self, mock_query):
@@ -91,6 +106,334 @@ class QueryingApiTestCase(unittest.TestCase):
         mock_query.assert_called_with(
             Query.create(sort_by=["value", "descending"]))
 
+    @stub_bucket_retrieve_by_name("foo", raw_queries_allowed=True)
+    @patch('backdrop.core.bucket.Bucket.query')
+    def test_raw_queries_are_streamed(self, mock_query):
+        mock_query.return_value = SimpleData(iter([
+            {"_timestamp": datetime.datetime(2014, 1, 1), "name": "Max"},
+            {"_timestamp": datetime.datetime(2014, 1, 2), "name": "Gareth"},
+        ]))
+
+        response = self.app.get('/foo?filter_by=zombies:yes')
+
+        assert_that(response.is_streamed, is_(True))
+        assert_that(json.loads(response.data), is_({"data": [
+            {"_timestamp": "2014-01-01T00:00:00+00:00", "name": "Max"},
+            {"_timestamp": "2014-01-02T00:00:00+00:00", "name": "Gareth"},
+        ]}))
+
+    @stub_bucket_retrieve_by_name("foo", raw_queries_allowed=True)
+    @patch('backdrop.core.bucket.Bucket.query')
+    def test_full_pages_of_raw_queries_have_a_next_token(self, mock_query):
+        mock_query.return_value = SimpleData(iter([
+            {"_timestamp": datetime.datetime(2014, 1, 1), "_id": "a"},
+        ]), page_size=1)
+
+        response = self.app.get('/foo?limit=1')
+
+        assert_that(json.loads(response.data)["next"],
+                    is_(encode_page_token({
+                        "_timestamp": datetime.datetime(2014, 1, 1,
+                                                        tzinfo=pytz.UTC),
+                        "_id": "a"})))
+
+    @stub_bucket_retrieve_by_name("foo", raw_queries_allowed=True)
+    @patch('backdrop.core.bucket.Bucket.query')
+    def test_full_pages_of_csv_and_ndjson_link_to_the_next(self, mock_query):
+        token = encode_page_token({
+            "_timestamp": datetime.datetime(2014, 1, 1, tzinfo=pytz.UTC),
+            "_id": "a"})
+
+        for output_format in ['csv', 'ndjson']:
+            mock_query.return_value = SimpleData(iter([
+                {"_timestamp": datetime.datetime(2014, 1, 1), "_id": "a"},
+            ]), page_size=1)
+
+            response = self.app.get('/foo?limit=1&format=' + output_format)
+
+            link, rel = response.headers['Link'].split('; ')
+            url = urlparse.urlparse(link.strip('<>'))
+            assert_that(rel, is_('rel="next"'))
+            assert_that(url.path, is_('/foo'))
+            assert_that(urlparse.parse_qs(url.query), is_({
+                "limit": ["1"], "format": [output_format],
+                "after": [token]}))
+            assert_that(response.data, contains_string("2014-01-01"))
+
+    @stub_bucket_retrieve_by_name("foo", raw_queries_allowed=True)
+    @patch('backdrop.core.bucket.Bucket.query')
+    def test_partial_pages_of_csv_have_no_next_link(self, mock_query):
+        mock_query.return_value = SimpleData(iter([
+            {"_timestamp": datetime.datetime(2014, 1, 1), "_id": "a"},
+        ]), page_size=2)
+
+        response = self.app.get('/foo?limit=2&format=csv')
+
+        assert_that(response.headers.get('Link'), is_(None))
+
+    @stub_bucket_retrieve_by_name("foo", raw_queries_allowed=True)
+    @patch('backdrop.core.bucket.Bucket.query')
+    def test_query_after_a_page_token_is_executed(self, mock_query):
+        mock_query.return_value = NoneData()
+        token = encode_page_token({"_timestamp": None, "_id": "a"})
+
+        self.app.get('/foo?limit=1&after=' + token)
+
+        mock_query.assert_called_with(
+            Query.create(limit=1, after=(None, "a")))
+
+    @stub_bucket_retrieve_by_name("foo", raw_queries_allowed=True)
+    @patch('backdrop.core.bucket.Bucket.query')
+    def test_raw_queries_are_streamed_as_csv(self, mock_query):
+        mock_query.return_value = SimpleData(iter([
+            {"_timestamp": datetime.datetime(2014, 1, 1), "name": "Max"},
+            {"_timestamp": datetime.datetime(2014, 1, 2), "name": "Gareth"},
+        ]))
+
+        response = self.app.get('/foo?format=csv')
+
+        assert_that(response.is_streamed, is_(True))
+        assert_that(response.mimetype, is_('text/csv'))
+        assert_that(response.data, is_(
+            "_timestamp,name\r\n"
+            "2014-01-01T00:00:00+00:00,Max\r\n"
+            "2014-01-02T00:00:00+00:00,Gareth\r\n"))
+
+    @stub_bucket_retrieve_by_name("foo", raw_queries_allowed=True)
+    @patch('backdrop.core.bucket.Bucket.query')
+    def test_raw_queries_are_streamed_as_ndjson(self, mock_query):
+        mock_query.return_value = SimpleData(iter([
+            {"name": "Max"},
+            {"name": "Gareth"},
+        ]))
+
+        response = self.app.get('/foo?format=ndjson')
+
+        assert_that(response.mimetype, is_('application/x-ndjson'))
+        assert_that(response.data.splitlines(), is_([
+            '{"name":"Max"}',
+            '{"name":"Gareth"}']))
+
+    @stub_bucket_retrieve_by_name("foo")
+    @patch('backdrop.core.bucket.Bucket.query')
+    def test_period_grouped_queries_have_a_csv_row_per_period(
+            self, mock_query):
+        mock_query.return_value.data.return_value = ({
+            "name": "Max", "_count": 3, "values": [
+                {"_start_at": "2014-01-06", "_count": 1, "value:sum": 2},
+                {"_start_at": "2014-01-13", "_count": 2, "value:sum": 5},
+            ]},)
+
+        response = self.app.get('/foo?group_by=name&period=week'
+                                '&collect=value:sum&format=csv')
+
+        assert_that(response.data, is_(
+            "_count,_start_at,name,value:sum\r\n"
+            "1,2014-01-06,Max,2\r\n"
+            "2,2014-01-13,Max,5\r\n"))
+
+    @stub_bucket_retrieve_by_name("foo")
+    @patch('backdrop.core.bucket.Bucket.query')
+    def test_each_format_has_its_own_etag(self, mock_query):
+        mock_query.return_value.data.return_value = ()
+
+        json_response = self.app.get('/foo?period=week')
+        csv_response = self.app.get('/foo?period=week&format=csv')
+
+        assert_that(csv_response.headers['ETag'],
+                    is_not(json_response.headers['ETag']))
+
+    @stub_bucket_retrieve_by_name("foo")
+    @patch('backdrop.core.bucket.Bucket.query')
+    def test_explain_is_not_allowed_by_default(self, mock_query):
+        response = self.app.get('/foo?period=week&explain=true')
+
+        assert_that(response, has_status(403))
+        assert_that(mock_query.called, is_(False))
+
+    @stub_bucket_retrieve_by_name("foo")
+    @patch('backdrop.core.bucket.Bucket.query')
+    def test_buckets_can_allow_explain(self, mock_query):
+        mock_query.return_value.data.return_value = ({"_count": 1},)
+
+        with patch.dict(api.app.config, {"EXPLAIN_BUCKETS": ["foo"]}):
+            response = self.app.get('/foo?period=week&explain=true')
+
+        body = json.loads(response.data)
+        assert_that(response, has_status(200))
+        assert_that(response.headers['Cache-Control'], is_('no-cache'))
+        assert_that(body["data"], is_([{"_count": 1}]))
+        assert_that(body["explain"]["returned"], is_(1))
+        assert_that([stage["stage"] for stage in body["explain"]["stages"]],
+                    has_items("config", "validation", "encode"))
+
+    @stub_bucket_retrieve_by_name("foo")
+    @patch('backdrop.core.bucket.Bucket.query')
+    def test_callers_with_a_token_can_explain(self, mock_query):
+        mock_query.return_value.data.return_value = ()
+
+        with patch.dict(api.app.config, {"EXPLAIN_TOKENS": ["secret"]}):
+            response = self.app.get('/foo?period=week&explain=true',
+                                    headers=[('Authorization',
+                                              'Bearer secret')])
+
+        assert_that(response, has_status(200))
+
+    @stub_bucket_retrieve_by_name("foo")
+    @patch('backdrop.core.bucket.Bucket.query')
+    def test_explained_queries_are_not_cached(self, mock_query):
+        mock_query.return_value.data.return_value = ()
+        query_cache = QueryCache(MemoryStore(10))
+
+        with patch.object(api, "query_cache", query_cache):
+            with patch.dict(api.app.config, {"EXPLAIN_BUCKETS": ["foo"]}):
+                self.app.get('/foo?period=week&explain=true')
+                self.app.get('/foo?period=week&explain=true')
+
+        assert_that(mock_query.call_count, is_(2))
+
+    @stub_bucket_retrieve_by_name("foo")
+    @patch('backdrop.core.bucket.Bucket.query')
+    def test_grouped_queries_are_cached(self, mock_query):
+        mock_query.return_value.data.return_value = ({"_count": 1},)
+        query_cache = QueryCache(MemoryStore(10))
+
+        with patch.object(api, "query_cache", query_cache):
+            self.app.get('/foo?group_by=zombies')
+            response = self.app.get('/foo?group_by=zombies')
+
+        assert_that(json.loads(response.data),
+                    is_({"data": [{"_count": 1}]}))
+        assert_that(mock_query.call_count, is_(1))
+
+    @stub_bucket_retrieve_by_name("foo")
+    @patch('backdrop.core.bucket.Bucket.query')
+    def test_stale_results_are_not_cached_by_clients(self, mock_query):
+        query_cache = Mock()
+        query_cache.get.return_value = (2, ({"_count": 1},))
+
+        with patch.object(api, "query_cache", query_cache):
+            with patch.object(api.bucket_versions, "get") as get_version:
+                get_version.return_value = (3, datetime.datetime(2014, 1, 1))
+                response = self.app.get('/foo?period=week')
+
+        assert_that(json.loads(response.data),
+                    is_({"data": [{"_count": 1}]}))
+        assert_that(response.headers['ETag'], is_('"%s"' % query_etag(
+            "foo", 2, Query.create(period=WEEK))))
+        assert_that(response.headers['Cache-Control'], is_('no-cache'))
+        assert_that(response.headers.get('Last-Modified'), is_(None))
+
+    @stub_bucket_retrieve_by_name("foo")
+    @patch('backdrop.core.bucket.Bucket.query')
+    def test_results_from_a_member_that_is_behind_are_stale(self,
+                                                            mock_query):
+        mock_query.return_value.data.return_value = ({"_count": 1},)
+
+        def get_version(name, read_from_primary=True, cached=False):
+            return (3 if cached else 2), None
+
+        with patch.object(api.bucket_versions, "get", get_version):
+            response = self.app.get('/foo?period=week')
+
+        assert_that(response.headers['ETag'], is_('"%s"' % query_etag(
+            "foo", 2, Query.create(period=WEEK))))
+        assert_that(response.headers['Cache-Control'], is_('no-cache'))
+
+    @stub_bucket_retrieve_by_name("foo", raw_queries_allowed=True)
+    @patch('backdrop.core.bucket.Bucket.query')
+    def test_raw_results_from_a_member_that_is_behind_are_stale(self,
+                                                                mock_query):
+        mock_query.return_value = SimpleData(iter([{"name": "Max"}]))
+
+        def get_version(name, read_from_primary=True, cached=False):
+            return (3, None) if cached else (2, None)
+
+        with patch.object(api.bucket_versions, "get", get_version):
+            response = self.app.get('/foo?format=ndjson')
+
+        assert_that(response.data, is_('{"name":"Max"}\n'))
+        assert_that(response.headers['ETag'], is_('"%s-ndjson"' % query_etag(
+            "foo", 2, Query.create())))
+        assert_that(response.headers['Cache-Control'], is_('no-cache'))
+        assert_that(response.headers.get('Last-Modified'), is_(None))
+
+    @stub_bucket_retrieve_by_name("foo")
+    @patch('backdrop.core.bucket.Bucket.query')
+    def test_version_is_cached_and_read_as_the_records_are(self, mock_query):
+        mock_query.return_value = NoneData()
+
+        with patch.object(api.bucket_versions, "get") as get_version:
+            get_version.return_value = (3, None)
+            self.app.get('/foo?period=week')
+
+        get_version.assert_any_call("foo", read_from_primary=False,
+                                    cached=True)
+
+    @stub_bucket_retrieve_by_name("foo", realtime=True)
+    @patch('backdrop.core.bucket.Bucket.query')
+    def test_realtime_version_is_read_from_the_primary(self, mock_query):
+        mock_query.return_value = NoneData()
+
+        with patch.object(api.bucket_versions, "get") as get_version:
+            get_version.return_value = (3, None)
+            self.app.get('/foo?period=week')
+
+        get_version.assert_any_call("foo", read_from_primary=True,
+                                    cached=False)
+
+    @stub_bucket_retrieve_by_name("foo")
+    @patch('backdrop.core.bucket.Bucket.query')
+    def test_etag_comes_from_the_query_and_bucket_version(self, mock_query):
+        mock_query.return_value = NoneData()
+
+        with patch.object(api.bucket_versions, "get") as get_version:
+            get_version.return_value = (3, datetime.datetime(2014, 1, 1))
+            response = self.app.get('/foo?period=week')
+
+        assert_that(response.headers['ETag'], is_('"%s"' % query_etag(
+            "foo", 3, Query.create(period=WEEK))))
+        assert_that(response.headers['Last-Modified'],
+                    is_('Wed, 01 Jan 2014 00:00:00 GMT'))
+
+    @stub_bucket_retrieve_by_name("foo")
+    @patch('backdrop.core.bucket.Bucket.query')
+    def test_matching_etags_are_not_modified_without_querying(self,
+                                                              mock_query):
+        etag = query_etag("foo", 3, Query.create(period=WEEK))
+
+        with patch.object(api.bucket_versions, "get") as get_version:
+            get_version.return_value = (3, datetime.datetime(2014, 1, 1))
+            response = self.app.get('/foo?period=week', headers=[
+                ('If-None-Match', '"%s"' % etag)])
+
+        assert_that(response.status_code, is_(304))
+        assert_that(mock_query.called, is_(False))
+
+    @stub_bucket_retrieve_by_name("foo")
+    @patch('backdrop.core.bucket.Bucket.query')
+    def test_etags_from_other_versions_are_modified(self, mock_query):
+        mock_query.return_value = NoneData()
+        etag = query_etag("foo", 2, Query.create(period=WEEK))
+
+        with patch.object(api.bucket_versions, "get") as get_version:
+            get_version.return_value = (3, datetime.datetime(2014, 1, 1))
+            response = self.app.get('/foo?period=week', headers=[
+                ('If-None-Match', '"%s"' % etag)])
+
+        assert_that(response.status_code, is_(200))
+
+    @stub_bucket_retrieve_by_name("foo")
+    @patch('backdrop.core.bucket.Bucket.query')
+    def test_unmodified_since_last_write_is_not_modified(self, mock_query):
+        with patch.object(api.bucket_versions, "get") as get_version:
+            get_version.return_value = (3, datetime.datetime(2014, 1, 1))
+            response = self.app.get('/foo?period=week', headers=[
+                ('If-Modified-Since', 'Thu, 02 Jan 2014 00:00:00 GMT')])
+
+        assert_that(response.status_code, is_(304))
+        assert_that(mock_query.called, is_(False))
+
     @stub_bucket_retrieve_by_name("bucket", queryable=False)
     def test_returns_404_when_bucket_is_not_queryable(self):
         response = self.app.get('/bucket')
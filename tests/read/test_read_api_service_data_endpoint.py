@@ -86,6 +86,13 @@ class QueryingApiTestCase(unittest.TestCase):
         mock_query.assert_called_with(
             Query.create(sort_by=["value", "descending"]))
 
+    @setup_bucket("foo", data_group="some-group", data_type="some-type")
+    @patch('backdrop.core.bucket.Bucket.query')
+    def test_responses_have_an_etag(self, mock_query):
+        mock_query.return_value = NoneData()
+        response = self.app.get('/data/some-group/some-type?period=week')
+        assert_that(response.headers.get('ETag'), is_not(None))
+
     @setup_bucket("bucket", data_group="some-group", data_type="some-type", queryable=False)
     def test_returns_404_when_bucket_is_not_queryable(self):
         response = self.app.get('/data/some-group/some-type')
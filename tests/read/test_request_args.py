@@ -0,0 +1,61 @@
+import unittest
+from hamcrest import assert_that, is_, none
+from mock import patch
+from werkzeug.datastructures import MultiDict
+from backdrop.read.page_token import encode_page_token
+from backdrop.read.query import Query
+from backdrop.read.request_args import ParsedRequestArgs
+from backdrop.read.validation import validate_request_args
+from backdrop.core.validation import parse_datetime_string
+from tests.support.test_helpers import d_tz
+
+
+class TestParsedRequestArgs(unittest.TestCase):
+    def test_timestamps_are_parsed(self):
+        args = ParsedRequestArgs(
+            MultiDict({"start_at": "2014-01-06T00:00:00+00:00"}))
+
+        assert_that(args.timestamp("start_at"), is_(d_tz(2014, 1, 6)))
+
+    def test_invalid_and_missing_timestamps_are_none(self):
+        args = ParsedRequestArgs(MultiDict({"start_at": "monday"}))
+
+        assert_that(args.timestamp("start_at"), none())
+        assert_that(args.timestamp("end_at"), none())
+
+    def test_page_token_is_decoded(self):
+        args = ParsedRequestArgs(MultiDict({
+            "after": encode_page_token({"_timestamp": None, "_id": "a"})}))
+
+        assert_that(args.page_token(), is_((None, "a")))
+
+    def test_invalid_page_tokens_are_errors(self):
+        args = ParsedRequestArgs(MultiDict({"after": "junk"}))
+
+        self.assertRaises(ValueError, args.page_token)
+
+    def test_missing_lists_are_empty(self):
+        assert_that(ParsedRequestArgs({}).getlist("filter_by"), is_([]))
+
+    def test_comma_separated_values_of_every_argument(self):
+        args = ParsedRequestArgs(MultiDict([("group_by", "a,b"),
+                                            ("group_by", "c")]))
+
+        assert_that(args.comma_separated("group_by"), is_(["a", "b", "c"]))
+        assert_that(ParsedRequestArgs({"group_by": "a"})
+                    .comma_separated("group_by"), is_(["a"]))
+
+    @patch("backdrop.read.request_args.parse_datetime_string",
+           wraps=parse_datetime_string)
+    def test_timestamps_are_parsed_once_to_validate_and_query(self, parse):
+        args = ParsedRequestArgs(MultiDict({
+            "period": "week",
+            "start_at": "2014-01-06T00:00:00+00:00",
+            "end_at": "2014-01-20T00:00:00+00:00"}))
+
+        assert_that(validate_request_args(args).is_valid, is_(True))
+        query = Query.parse(args)
+
+        assert_that(parse.call_count, is_(2))
+        assert_that(query.start_at, is_(d_tz(2014, 1, 6)))
+        assert_that(query.end_at, is_(d_tz(2014, 1, 20)))
@@ -0,0 +1,59 @@
+import json
+import unittest
+from bson import ObjectId
+from dateutil.tz import tzoffset
+from hamcrest import assert_that, is_
+from backdrop.read.serialiser import JsonSerialiser, encode_json
+from tests.support.test_helpers import d_tz, d
+
+
+class TestJsonSerialiser(unittest.TestCase):
+    def test_timestamps_are_iso_formatted(self):
+        assert_that(encode_json({"_start_at": d_tz(2014, 1, 6)}),
+                    is_('{"_start_at":"2014-01-06T00:00:00+00:00"}'))
+
+    def test_timestamps_without_a_timezone(self):
+        assert_that(encode_json([d(2014, 1, 6, 12)]),
+                    is_('["2014-01-06T12:00:00"]'))
+
+    def test_object_ids_are_strings(self):
+        _id = ObjectId()
+
+        assert_that(encode_json({"_id": _id}), is_('{"_id":"%s"}' % _id))
+
+    def test_output_is_the_same_as_the_standard_encoder(self):
+        data = ({"name": u"caf\xe9", "_count": 1.5, "values": [
+            {"_start_at": d_tz(2014, 1, 6), "_end_at": d_tz(2014, 1, 13),
+             "_count": None}]},)
+
+        assert_that(json.loads(encode_json(data)), is_(json.loads(
+            json.dumps(data, default=lambda o: o.isoformat()))))
+
+    def test_repeated_timestamps_are_formatted_once(self):
+        serialiser = JsonSerialiser()
+        timestamps = [d_tz(2014, 1, 6), d_tz(2014, 1, 6), d_tz(2014, 1, 13)]
+
+        serialiser.encode(timestamps)
+
+        assert_that(len(serialiser._timestamps), is_(2))
+
+    def test_equal_timestamps_keep_their_own_offsets(self):
+        plus_one = tzoffset(None, 3600)
+        timestamps = [d_tz(2014, 1, 6, 12),
+                      d_tz(2014, 1, 6, 13, tzinfo=plus_one),
+                      d(2014, 1, 6, 12)]
+
+        assert_that(JsonSerialiser().encode(timestamps), is_(
+            '["2014-01-06T12:00:00+00:00","2014-01-06T13:00:00+01:00",'
+            '"2014-01-06T12:00:00"]'))
+
+    def test_formatted_timestamps_are_bounded(self):
+        serialiser = JsonSerialiser(max_timestamps=2)
+
+        encoded = serialiser.encode([d_tz(2014, 1, day) for day in range(1, 6)])
+
+        assert_that(len(serialiser._timestamps) <= 2, is_(True))
+        assert_that(json.loads(encoded)[4], is_("2014-01-05T00:00:00+00:00"))
+
+    def test_unknown_types_are_errors(self):
+        self.assertRaises(TypeError, encode_json, {"a": object()})
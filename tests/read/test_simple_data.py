@@ -1,5 +1,6 @@
 import unittest
 from hamcrest import *
+from backdrop.read.page_token import decode_page_token
 from backdrop.read.response import SimpleData
 from tests.support.test_helpers import d_tz, d
 
@@ -25,3 +26,56 @@ class TestSimpleData(unittest.TestCase):
             assert_that(False, "expected an exception")
         except AttributeError as e:
             assert_that(str(e), "'tuple' object has no attribute append")
+
+    def test_documents_are_read_from_the_cursor_as_they_are_needed(self):
+        read = []
+
+        def cursor():
+            for i in range(3):
+                read.append(i)
+                yield {"_timestamp": d(2014, 1, i + 1)}
+
+        data = iter(SimpleData(cursor()))
+
+        assert_that(read, is_([]))
+        assert_that(next(data), has_entry("_timestamp", d_tz(2014, 1, 1)))
+        assert_that(read, is_([0]))
+
+    def test_starting_reads_only_the_first_document(self):
+        read = []
+
+        def cursor():
+            for i in range(3):
+                read.append(i)
+                yield {"_timestamp": d(2014, 1, i + 1), "_id": i}
+
+        data = SimpleData(cursor(), page_size=3)
+        data.start()
+
+        assert_that(read, is_([0]))
+        assert_that([document["_id"] for document in data],
+                    is_([0, 1, 2]))
+        assert_that(decode_page_token(data.next_page()),
+                    is_((d_tz(2014, 1, 3), 2)))
+
+    def test_full_pages_have_a_next_page(self):
+        data = SimpleData([{"_timestamp": d(2014, 1, 1), "_id": "a"},
+                           {"_timestamp": d(2014, 1, 2), "_id": "b"}],
+                          page_size=2)
+        data.data()
+
+        assert_that(decode_page_token(data.next_page()),
+                    is_((d_tz(2014, 1, 2), "b")))
+
+    def test_partial_pages_have_no_next_page(self):
+        data = SimpleData([{"_timestamp": d(2014, 1, 1), "_id": "a"}],
+                          page_size=2)
+        data.data()
+
+        assert_that(data.next_page(), is_(None))
+
+    def test_unpaged_data_has_no_next_page(self):
+        data = SimpleData([{"_timestamp": d(2014, 1, 1), "_id": "a"}])
+        data.data()
+
+        assert_that(data.next_page(), is_(None))
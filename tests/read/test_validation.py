@@ -1,7 +1,10 @@
+from base64 import urlsafe_b64encode
 from unittest import TestCase
+from bson import json_util
 from hamcrest import assert_that, is_
-from backdrop.read import validation
+from backdrop.core import validation
 from backdrop.read.api import validate_request_args as _validate_request_args
+from backdrop.read.page_token import encode_page_token
 from werkzeug.datastructures import MultiDict
 from tests.support.validity_matcher import is_invalid_with_message, is_valid
 
@@ -100,6 +103,29 @@ class TestRequestValidation(TestCase):
             "Cannot group by an invalid field name"
         ))
 
+    def test_queries_grouping_on_several_fields_are_allowed(self):
+        validation_result = validate_request_args(MultiDict([
+            ("group_by", "foo,bar"), ("group_by", "baz"),
+            ("period", "week"), ("collect", "qux:sum")]))
+        assert_that(validation_result, is_valid())
+
+    def test_queries_grouping_on_a_field_twice_are_disallowed(self):
+        validation_result = validate_request_args({"group_by": "foo,foo"})
+        assert_that(validation_result, is_invalid_with_message(
+            "Cannot group by the same field twice"))
+
+    def test_every_field_grouped_on_is_validated(self):
+        validation_result = validate_request_args({"group_by": "foo,_bar"})
+        assert_that(validation_result, is_invalid_with_message(
+            "Cannot group by internal fields, internal fields "
+            "start with an underscore"))
+
+    def test_collecting_any_field_grouped_on_is_disallowed(self):
+        validation_result = validate_request_args({
+            "group_by": "foo,bar", "collect": "bar"})
+        assert_that(validation_result, is_invalid_with_message(
+            "Cannot collect by a field that is used for group_by"))
+
     def test_queries_with_sort_by_ascending_are_allowed(self):
         validation_result = validate_request_args({
             'sort_by': 'foo:ascending',
@@ -308,7 +334,9 @@ class TestRequestValidation(TestCase):
             "start_at is not a valid datetime"))
 
     def test_that_collect_queries_with_valid_methods_are_allowed(self):
-        valid_collection_methods = ["sum", "count", "set", "mean"]
+        valid_collection_methods = ["sum", "count", "set", "mean",
+                                    "min", "max", "first", "last",
+                                    "median", "p1", "p90", "p99"]
 
         for method in valid_collection_methods:
             validation_result = validate_request_args({
@@ -328,6 +356,17 @@ class TestRequestValidation(TestCase):
             "Unknown collection method"
         )))
 
+    def test_that_collect_queries_with_invalid_percentiles_are_disallowed(self):
+        for method in ["p0", "p100", "p05", "p9.5"]:
+            validation_result = validate_request_args({
+                'group_by': 'foo',
+                'collect': 'field:{0}'.format(method),
+            })
+
+            assert_that(validation_result, is_invalid_with_message((
+                "Unknown collection method"
+            )))
+
 
 class TestRequestValidationWithNoRawQueries(TestCase):
 
@@ -385,6 +424,98 @@ class TestRequestValidationWithNoRawQueries(TestCase):
 
 
 class TestValidationHelpers(TestCase):
+    def test_queries_with_fields_are_allowed(self):
+        validation_result = validate_request_args({
+            'fields': 'name,_timestamp'
+        })
+        assert_that(validation_result, is_valid())
+
+    def test_queries_with_invalid_fields_are_disallowed(self):
+        validation_result = validate_request_args({
+            'fields': 'name,$where'
+        })
+        assert_that(validation_result, is_invalid_with_message(
+            "Cannot select an invalid field name"))
+
+    def test_grouped_queries_with_fields_are_disallowed(self):
+        validation_result = validate_request_args({
+            'group_by': 'name',
+            'fields': 'name'
+        })
+        assert_that(validation_result, is_invalid_with_message(
+            "fields can only be used for raw queries"))
+
+    def test_queries_after_a_page_token_are_allowed(self):
+        validation_result = validate_request_args({
+            'after': encode_page_token({"_timestamp": None, "_id": "abc"}),
+            'limit': '10'
+        })
+        assert_that(validation_result, is_valid())
+
+    def test_queries_after_an_invalid_page_token_are_disallowed(self):
+        validation_result = validate_request_args({'after': 'not-a-token'})
+        assert_that(validation_result, is_invalid_with_message(
+            "after is not a valid page token"))
+
+    def test_queries_after_a_token_holding_an_operator_are_disallowed(self):
+        token = urlsafe_b64encode(json_util.dumps([None, {"$ne": None}]))
+        validation_result = validate_request_args({'after': token,
+                                                   'limit': '10'})
+        assert_that(validation_result, is_invalid_with_message(
+            "after is not a valid page token"))
+
+    def test_grouped_queries_after_a_page_token_are_disallowed(self):
+        validation_result = validate_request_args({
+            'group_by': 'name',
+            'after': encode_page_token({"_timestamp": None, "_id": "abc"})
+        })
+        assert_that(validation_result, is_invalid_with_message(
+            "after can only be used for raw queries"))
+
+    def test_queries_after_a_page_token_must_sort_by_timestamp(self):
+        validation_result = validate_request_args({
+            'sort_by': 'name:ascending',
+            'after': encode_page_token({"_timestamp": None, "_id": "abc"})
+        })
+        assert_that(validation_result, is_invalid_with_message(
+            "after can only be used when sorting by _timestamp"))
+
+    def test_queries_with_a_known_format_are_allowed(self):
+        for output_format in ['json', 'csv', 'ndjson']:
+            validation_result = validate_request_args({
+                'format': output_format
+            })
+            assert_that(validation_result, is_valid())
+
+    def test_queries_with_an_unknown_format_are_disallowed(self):
+        validation_result = validate_request_args({'format': 'xml'})
+        assert_that(validation_result, is_invalid_with_message(
+            "'format' must be one of ['csv', 'json', 'ndjson']"))
+
+    def test_queries_can_only_ask_to_be_explained(self):
+        assert_that(validate_request_args({'explain': 'true'}), is_valid())
+        assert_that(validate_request_args({'explain': 'yes'}),
+                    is_invalid_with_message(
+                        "'explain' must be one of ['true']"))
+
+    def test_sparse_is_allowed_for_period_grouped_queries(self):
+        assert_that(validate_request_args({'sparse': 'true',
+                                           'group_by': 'name',
+                                           'period': 'week'}),
+                    is_valid())
+
+    def test_sparse_is_disallowed_without_group_by_and_period(self):
+        assert_that(validate_request_args({'sparse': 'true',
+                                           'period': 'week'}),
+                    is_invalid_with_message(
+                        "sparse can only be used with both group_by and "
+                        "period"))
+        assert_that(validate_request_args({'sparse': 'yes',
+                                           'group_by': 'name',
+                                           'period': 'week'}),
+                    is_invalid_with_message(
+                        "'sparse' must be one of ['true']"))
+
     def test_timestamp_is_valid_method(self):
         result = validation.value_is_valid_datetime_string(
             "2013-01-01T00:00:00+99:99")
@@ -1,8 +1,9 @@
 from functools import wraps
 
-from mock import patch
+from mock import patch, MagicMock
 from backdrop.core.bucket import BucketConfig
 from backdrop.core.user import UserConfig
+from backdrop.read import api as read_api
 from backdrop.write.api import bucket_repository
 
 
@@ -50,3 +51,19 @@ def stub_user_retrieve_by_email(email, buckets=None):
                 func(*args, **kwargs)
         return wrapped_stub_user_retrieve_by_name
     return decorator
+
+
+def stub_bucket_versions(test_case, version=0, updated_at=None):
+    """Give every bucket the same version for the rest of a read api test
+
+    Versions are otherwise read from the database, in a pinned request, on
+    every query.
+    """
+    patchers = [
+        patch.object(read_api.bucket_versions, "get",
+                     return_value=(version, updated_at)),
+        patch.object(read_api.db, "pinned_reads", MagicMock()),
+    ]
+    for patcher in patchers:
+        patcher.start()
+        test_case.addCleanup(patcher.stop)
@@ -0,0 +1,110 @@
+"""Time merging groups from the database into nested groups.
+
+Merges two level groups, of channels and weeks with a sum, count and mean
+collected, with nested_merge and with the sort based merge it replaced,
+and prints the time each takes for each number of groups. Channels have
+--weeks subgroups each.
+
+    python tools/benchmark_nested_merge.py --sizes 10000,100000,1000000
+"""
+import argparse
+import itertools
+import os
+import random
+import sys
+import time
+from operator import itemgetter, add
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from backdrop.core.nested_merge import nested_merge, collect_key
+
+COLLECT = [("value", "sum"), ("value", "count"), ("value", "mean")]
+KEYS = ["channel", "_week_start_at"]
+
+
+def make_groups(size, weeks):
+    return [{"channel": "channel-%d" % (i // weeks),
+             "_week_start_at": i % weeks,
+             "_count": 3,
+             "value": [random.randint(0, 100) for _ in range(3)]}
+            for i in random.sample(xrange(size), size)]
+
+
+def sort_merge(keys, collect, data):
+    """The sort and concatenate merge that nested_merge replaced"""
+    data = _group_by(data, keys)
+    for group in data:
+        group["_count"] = sum(sub["_count"] for sub in group["_subgroup"])
+        group["_group_count"] = len(group["_subgroup"])
+    data = [_collect(group, collect) for group in data]
+    for group in data:
+        group["_subgroup"] = sorted(group["_subgroup"],
+                                    key=itemgetter(keys[1]))
+    return sorted(data, key=itemgetter(keys[0]))
+
+
+def _group_by(data, keys):
+    getter = itemgetter(keys[0])
+    data = sorted(data, key=getter)
+    if len(keys) > 1:
+        data = [{keys[0]: value,
+                 "_subgroup": _group_by(
+                     [dict((k, v) for k, v in sub.items() if k != keys[0])
+                      for sub in subgroups], keys[1:])}
+                for value, subgroups in itertools.groupby(data, getter)]
+    return data
+
+
+def _collect(group, collect):
+    group = group.copy()
+    for key, method in collect:
+        values = _values(group, key)
+        if method == "sum":
+            value = sum(values)
+        elif method == "count":
+            value = len(values)
+        else:
+            value = sum(values) / float(len(values))
+        group[collect_key(key, method)] = value
+    if "_subgroup" in group:
+        group["_subgroup"] = [_collect(sub, collect)
+                              for sub in group["_subgroup"]]
+    for key, _ in collect:
+        group.pop(key, None)
+    return group
+
+
+def _values(group, key):
+    if key in group:
+        return group[key]
+    return reduce(add, [_values(sub, key) for sub in group["_subgroup"]])
+
+
+def best_time(merge, size, weeks, repeat):
+    times = []
+    for _ in range(repeat):
+        data = make_groups(size, weeks)
+        start = time.time()
+        merge(KEYS, COLLECT, data)
+        times.append(time.time() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--weeks", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print "%10s %12s %12s" % ("groups", "sort merge", "nested_merge")
+    for size in [int(size) for size in args.sizes.split(",")]:
+        print "%10d %10.1f ms %10.1f ms" % (
+            size,
+            best_time(sort_merge, size, args.weeks, args.repeat) * 1000,
+            best_time(nested_merge, size, args.weeks, args.repeat) * 1000)
+
+
+if __name__ == "__main__":
+    main()
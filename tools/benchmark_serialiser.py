@@ -0,0 +1,96 @@
+"""Compare the read API's JSON serialiser with the flask encoder it replaced.
+
+Encodes period grouped data, the largest kind of grouped response, and raw
+documents, and prints the average time to encode each.
+
+    python tools/benchmark_serialiser.py --groups 20 --periods 52
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import pytz
+from bson import ObjectId
+from backdrop.read.serialiser import JsonEncoder, JsonSerialiser, \
+    encode_json
+
+
+def period_grouped_data(groups, periods):
+    start = datetime.datetime(2013, 1, 7, tzinfo=pytz.UTC)
+    week = datetime.timedelta(weeks=1)
+    return tuple({
+        "name": "group %d" % group,
+        "_count": float(periods),
+        "_group_count": periods,
+        "values": [{
+            "_start_at": start + period * week,
+            "_end_at": start + (period + 1) * week,
+            "_count": 1.0,
+            "value:sum": 12.5,
+        } for period in range(periods)]
+    } for group in range(groups))
+
+
+def raw_documents(count):
+    start = datetime.datetime(2013, 1, 7, tzinfo=pytz.UTC)
+    return [{
+        "_id": ObjectId(),
+        "_timestamp": start + datetime.timedelta(seconds=i),
+        "name": "document %d" % i,
+        "value": i,
+    } for i in range(count)]
+
+
+def flask_encoder(data):
+    # jsonify indents its output for requests that are not made by XHR
+    return json.dumps({"data": data}, cls=JsonEncoder, indent=2)
+
+
+def serialiser(data):
+    return encode_json({"data": data})
+
+
+def streamed_flask_encoder(documents):
+    return [json.dumps(document, cls=JsonEncoder) for document in documents]
+
+
+def streamed_serialiser(documents):
+    serialiser = JsonSerialiser()
+    return [serialiser.encode(document) for document in documents]
+
+
+def report(name, function, data, number):
+    seconds = min(timeit.repeat(lambda: function(data),
+                                number=number, repeat=3)) / number
+    print "%-24s %8.2f ms" % (name, seconds * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--groups", type=int, default=20)
+    parser.add_argument("--periods", type=int, default=52)
+    parser.add_argument("--documents", type=int, default=10000)
+    parser.add_argument("--number", type=int, default=20)
+    args = parser.parse_args()
+
+    grouped = period_grouped_data(args.groups, args.periods)
+    assert json.loads(flask_encoder(grouped)) == \
+        json.loads(serialiser(grouped))
+    print "period grouped data, %d groups of %d periods" % (
+        args.groups, args.periods)
+    report("flask encoder", flask_encoder, grouped, args.number)
+    report("serialiser", serialiser, grouped, args.number)
+
+    documents = raw_documents(args.documents)
+    print "raw data, %d documents" % args.documents
+    report("flask encoder", streamed_flask_encoder, documents, args.number)
+    report("serialiser", streamed_serialiser, documents, args.number)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Time filling in the missing periods of a timeseries.
+
+Fills in a timeseries of each period over spans of one and five years, with
+a tenth of the periods having data, with timeseries and with the mktime
+based fill it replaced. The first fill of a range builds its period range
+table; later fills of the same range reuse it.
+
+Then fills in --groups groups of two years of days, as for a period grouped
+query, with the mktime based fill of each group, with timeseries for each
+group and with fill_timeseries for all of them, both filled and sparse.
+
+    python tools/benchmark_timeseries.py --repeat 5 --groups 500
+"""
+import argparse
+import datetime
+import os
+import random
+import sys
+import time
+
+import pytz
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from backdrop.core import timeseries as ts
+from backdrop.core.timeseries import timeseries, fill_timeseries, \
+    HOUR, DAY, WEEK, MONTH
+
+START = datetime.datetime(2010, 1, 4, tzinfo=pytz.UTC)
+SPANS = [("1 year", 1), ("5 years", 5)]
+DEFAULT = {"_count": 0, "value:sum": None}
+
+
+def mktime_timeseries(start, end, period, data, default):
+    """The fill that timeseries replaced"""
+    data_by_start_at = dict((_time_to_index(d["_start_at"]), d)
+                            for d in data)
+    results = []
+    for period_start, period_end in period.range(start, end):
+        index = _time_to_index(period_start)
+        if index in data_by_start_at:
+            results.append(data_by_start_at[index])
+        else:
+            results.append(dict(default.items() + [
+                ("_start_at", period_start), ("_end_at", period_end)]))
+    return results
+
+
+def _time_to_index(dt):
+    return time.mktime(dt.replace(tzinfo=pytz.utc).timetuple())
+
+
+def make_data(period, end, fraction=0.1):
+    return [{"_start_at": start_at, "_end_at": end_at, "_count": 1,
+             "value:sum": 1}
+            for start_at, end_at in period.range(START, end)
+            if random.random() < fraction]
+
+
+def best_time(fill, period, end, data, repeat, cold=False):
+    times = []
+    for _ in range(repeat):
+        if cold:
+            ts._range_tables.clear()
+            ts._tabled_periods[0] = 0
+        start = time.time()
+        fill(START, end, period, data, DEFAULT)
+        times.append(time.time() - start)
+    return min(times)
+
+
+def best_group_time(fill, series, end, repeat):
+    times = []
+    for _ in range(repeat):
+        ts._range_tables.clear()
+        ts._tabled_periods[0] = 0
+        start = time.time()
+        fill(series, end)
+        times.append(time.time() - start)
+    return min(times)
+
+
+def each_group(timeseries):
+    def fill(series, end):
+        return [timeseries(START, end, DAY, data, DEFAULT)
+                for data in series]
+    return fill
+
+
+def all_groups(sparse):
+    def fill(series, end):
+        return fill_timeseries(START, end, DAY, series, DEFAULT,
+                               sparse=sparse)
+    return fill
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--groups", type=int, default=500)
+    args = parser.parse_args()
+
+    print "%6s %8s %8s %12s %12s %12s" % (
+        "period", "span", "periods", "mktime", "first fill", "later fills")
+    for period in [HOUR, DAY, WEEK, MONTH]:
+        for span, years in SPANS:
+            end = START.replace(year=START.year + years)
+            data = make_data(period, end)
+            print "%6s %8s %8d %9.2f ms %9.2f ms %9.2f ms" % (
+                period.name, span, len(list(period.range(START, end))),
+                best_time(mktime_timeseries, period, end, data,
+                          args.repeat) * 1000,
+                best_time(timeseries, period, end, data,
+                          args.repeat, cold=True) * 1000,
+                best_time(timeseries, period, end, data,
+                          args.repeat) * 1000)
+
+    end = START.replace(year=START.year + 2)
+    print
+    print "%6s %12s %12s %12s %12s" % (
+        "groups", "mktime", "timeseries", "all groups", "sparse")
+    series = [make_data(DAY, end, fraction=random.choice([0.05, 0.9]))
+              for _ in range(args.groups)]
+    print "%6d %9.1f ms %9.1f ms %9.1f ms %9.1f ms" % (
+        args.groups,
+        best_group_time(each_group(mktime_timeseries), series, end,
+                        args.repeat) * 1000,
+        best_group_time(each_group(timeseries), series, end,
+                        args.repeat) * 1000,
+        best_group_time(all_groups(False), series, end, args.repeat) * 1000,
+        best_group_time(all_groups(True), series, end, args.repeat) * 1000)
+
+
+if __name__ == "__main__":
+    main()
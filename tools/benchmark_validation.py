@@ -0,0 +1,59 @@
+"""Time the validation and parsing of read API query arguments.
+
+Runs typical requests through the same steps as the read API's
+parse_query, and prints the average time taken for each request.
+
+    python tools/benchmark_validation.py --number 2000
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from werkzeug.datastructures import MultiDict
+from backdrop.read.query import Query
+from backdrop.read.request_args import ParsedRequestArgs
+from backdrop.read.validation import validate_request_args
+
+REQUESTS = [
+    ("period", False, MultiDict([
+        ("period", "week"),
+        ("start_at", "2014-01-06T00:00:00+00:00"),
+        ("end_at", "2014-03-03T00:00:00+00:00"),
+        ("collect", "value:sum")])),
+    ("period grouped", False, MultiDict([
+        ("group_by", "name"),
+        ("period", "month"),
+        ("start_at", "2014-01-01T00:00:00+00:00"),
+        ("end_at", "2014-06-01T00:00:00+00:00"),
+        ("filter_by", "plays:guitar")])),
+    ("raw", True, MultiDict([
+        ("filter_by", "name:max"),
+        ("limit", "10"),
+        ("sort_by", "_timestamp:descending")])),
+]
+
+
+def parse_query(request_args, raw_queries_allowed):
+    request_args = ParsedRequestArgs(request_args)
+    result = validate_request_args(request_args, raw_queries_allowed)
+    assert result.is_valid, result.message
+    return Query.parse(request_args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=2000)
+    args = parser.parse_args()
+
+    for name, raw_queries_allowed, request_args in REQUESTS:
+        seconds = min(timeit.repeat(
+            lambda: parse_query(request_args, raw_queries_allowed),
+            number=args.number, repeat=3)) / args.number
+        print "%-16s %8.1f us" % (name, seconds * 1000000)
+
+
+if __name__ == "__main__":
+    main()